@@ -1,21 +1,170 @@
+import time
+IMPORT_START = time.perf_counter()
 import os
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import random
 import asyncio
 import aiohttp
 import threading
-import time
 import json
 import sys
 import logging
+import logging.handlers
+import queue
+import atexit
+import signal
 import ast
-from groq import Groq  # <-- FIXED: import from groq
-from datetime import datetime, timedelta
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import hashlib
+import inspect
+import contextvars
+import re
+import unicodedata
+import zlib
+import heapq
+import math
+import functools
+import gc
+import tracemalloc
+import hmac
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
 
 # ================= LOGGING =================
-logging.basicConfig(level=logging.INFO)
+# Records are queued on the event loop and written by a listener thread, so a burst of
+# errors never blocks the loop on stderr. Identical messages are sampled after a burst.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_WINDOW = float(os.environ.get("LOG_SAMPLE_WINDOW", 60))
+LOG_SAMPLE_BURST = int(os.environ.get("LOG_SAMPLE_BURST", 5))
+LOG_SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", 100))
+
+# (user_id, guild_id, command) that triggered the work running in the current task
+invoker = contextvars.ContextVar("invoker", default=(None, None, None))
+
+class RepeatSampler(logging.Filter):
+    """Lets the first LOG_SAMPLE_BURST copies of a message through per window, then one in LOG_SAMPLE_EVERY"""
+    DIGITS = re.compile(r"\d+")
+
+    def __init__(self):
+        super().__init__()
+        self.window_start = time.monotonic()
+        self.seen = {}
+
+    def filter(self, record):
+        now = time.monotonic()
+        if now - self.window_start > LOG_SAMPLE_WINDOW:
+            self.window_start = now
+            self.seen.clear()
+        # Messages that differ only in ids, counts or timings count as the same message
+        key = (record.name, record.levelno, self.DIGITS.sub("#", str(record.msg)))
+        count = self.seen.get(key, 0) + 1
+        self.seen[key] = count
+        if count > LOG_SAMPLE_BURST:
+            if (count - LOG_SAMPLE_BURST) % LOG_SAMPLE_EVERY:
+                return False
+            record.suppressed = LOG_SAMPLE_EVERY - 1
+        return True
+
+class InvokerFilter(logging.Filter):
+    """Copies the invoking user, guild and command onto the record while still in the caller's task"""
+    def filter(self, record):
+        record.user_id, record.guild_id, record.command = invoker.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    EXTRA_FIELDS = ("guild_id", "user_id", "command", "latency_ms", "suppressed")
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for field in self.EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, "suppressed", None):
+            text += f" (+{record.suppressed} similar suppressed)"
+        return text
+
+class QueueHandlerKeepingFields(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Only render the message here; formatting to JSON happens on the listener thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging():
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    log_queue = queue.SimpleQueue()
+    handler = QueueHandlerKeepingFields(log_queue)
+    handler.addFilter(RepeatSampler())
+    handler.addFilter(InvokerFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
+
+# ================= STARTUP TIMELINE =================
+class StartupTimeline:
+    """Records how long each boot phase took, measured from interpreter start of bot.py"""
+    def __init__(self, origin):
+        self.origin = origin
+        self.last = origin
+        self.phases = []
+        self.details = {}
+        self.completed = False
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append({
+            "phase": phase,
+            "duration_ms": round((now - self.last) * 1000, 1),
+            "at_ms": round((now - self.origin) * 1000, 1)
+        })
+        logging.info(f"⏱️ Startup phase '{phase}' took {(now - self.last) * 1000:.0f}ms")
+        self.last = now
+
+    def report(self):
+        return {
+            "mode": STARTUP_MODE,
+            "completed": self.completed,
+            "total_ms": self.phases[-1]["at_ms"] if self.phases else 0,
+            "phases": list(self.phases),
+            **self.details
+        }
+
+startup = StartupTimeline(IMPORT_START)
+startup.mark("imports")
 
 # ================= CONFIGURATION =================
 TOKEN = os.environ.get("DISCORD_TOKEN")
@@ -23,6 +172,14 @@ GROQ_TOKEN = os.environ.get("GROQ_TOKEN")
 PORT = int(os.environ.get("PORT", 10000))
 PREFIX = "!"
 OWNER_ID = 1307042499898118246
+# "lazy" defers the AI client and state file until after login to cut cold-start time
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "eager").lower()
+STATS_RECONCILE_MINUTES = float(os.environ.get("STATS_RECONCILE_MINUTES", 10))
+# "full" chunks every guild at startup, "on_demand" chunks a guild the first time a
+# member-heavy command needs it, "minimal" caches no members and fetches them per use
+MEMBER_CACHE_POLICY = os.environ.get("MEMBER_CACHE_POLICY", "full").lower()
+# Prefix commands need the privileged message content intent; slash commands work without it
+MESSAGE_CONTENT_INTENT = os.environ.get("MESSAGE_CONTENT_INTENT", "1") != "0"
 BOT_START_TIME = time.time()
 
 # ================= DATA STORAGE =================
@@ -34,10 +191,28 @@ bot_data = {
     "user_stats": {}
 }
 
+# Set once bot_data reflects the file on disk; commands wait on it in lazy startup mode
+state_loaded = asyncio.Event()
+
+save_lock = threading.Lock()
+
+def write_json_atomic(path, data, **dump_options):
+    """Write to a temp file and rename it over path, so a kill mid-write never truncates path"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, **dump_options)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
 def save_data():
+    if not state_loaded.is_set():
+        # Writing now would clobber the file with defaults before it has been read
+        logging.warning("Skipping save before state was loaded")
+        return
     try:
-        with open("bot_data.json", "w") as f:
-            json.dump(bot_data, f, indent=4)
+        with save_lock:
+            write_json_atomic("bot_data.json", bot_data, indent=4)
     except Exception as e:
         logging.error(f"Save error: {e}")
 
@@ -49,320 +224,689 @@ def load_data():
     except:
         pass
 
-load_data()
+async def load_data_in_background():
+    await asyncio.to_thread(load_data)
+    # asyncio.Event is not thread-safe, so it is set back on the loop thread
+    state_loaded.set()
+    startup.mark("state_load")
+
+if STARTUP_MODE != "lazy":
+    load_data()
+    state_loaded.set()
+    startup.mark("state_load")
 
 # ================= HTTP SERVER WITH ENHANCED HTML =================
-class BotHTTPServer(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == "/":
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.end_headers()
-            
-            # Real-time stats
-            uptime_seconds = int(time.time() - BOT_START_TIME)
-            uptime_str = str(timedelta(seconds=uptime_seconds))
-            guilds = len(bot.guilds) if hasattr(bot, 'guilds') else 0
-            
-            # Build command lists
-            mod_commands = ["kick", "ban", "timeout", "untimeout", "warn", "warnings", "clear", "lock", "unlock", "slowmode", "nick", "role", "mute", "unmute", "trollkick"]
-            fun_commands = ["meme", "dice", "coinflip", "8ball", "joke", "rps", "randomfact", "compliment", "insult", "roast", "slap", "hug", "pat", "kiss", "cuddle", "tickle", "poke", "wave", "highfive", "dance", "cry", "laugh", "think", "shrug", "clap", "facepalm", "tableflip", "unflip"]
-            util_commands = ["avatar", "serverinfo", "userinfo", "poll", "say", "echo", "embed", "ping", "uptime", "stats", "invite", "support", "math", "choose", "flip"]
-            ai_commands = ["ask", "askai", "summary", "translate", "define", "aijoke", "aipoem", "aistory", "aicode", "aiexplain", "aiadvice", "aiidea", "aifact", "airiddle", "aiquote"]
-            economy_commands = ["level", "rank", "leaderboard", "daily", "rep"]
-            owner_commands = ["whitelist", "blacklist", "showlists"]
-            
-            html = f"""
-            <!DOCTYPE html>
-            <html lang="en">
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>DeepSeek Bot · Dashboard</title>
-                <style>
-                    * {{
-                        margin: 0;
-                        padding: 0;
-                        box-sizing: border-box;
-                        font-family: 'Segoe UI', Roboto, system-ui, sans-serif;
-                    }}
-                    body {{
-                        background: linear-gradient(145deg, #0a0c10 0%, #1a1e26 100%);
-                        color: #e4e7eb;
-                        min-height: 100vh;
-                        display: flex;
-                        justify-content: center;
-                        padding: 2rem 1rem;
-                    }}
-                    .container {{
-                        max-width: 1400px;
-                        width: 100%;
-                    }}
-                    /* header */
-                    .header {{
-                        display: flex;
-                        flex-wrap: wrap;
-                        justify-content: space-between;
-                        align-items: center;
-                        margin-bottom: 2.5rem;
-                        padding-bottom: 1.5rem;
-                        border-bottom: 1px solid #2a2f3a;
-                    }}
-                    .title h1 {{
-                        font-size: 2.8rem;
-                        background: linear-gradient(135deg, #9f7aea, #63b3ed);
-                        -webkit-background-clip: text;
-                        -webkit-text-fill-color: transparent;
-                        background-clip: text;
-                        font-weight: 700;
-                        letter-spacing: -0.5px;
-                    }}
-                    .title p {{
-                        color: #9aa4b8;
-                        margin-top: 0.25rem;
-                        font-size: 1.1rem;
-                    }}
-                    .stats {{
-                        display: flex;
-                        gap: 2rem;
-                        background: #1e222b;
-                        padding: 1rem 2rem;
-                        border-radius: 60px;
-                        border: 1px solid #2f3542;
-                        box-shadow: 0 8px 20px rgba(0,0,0,0.6);
-                    }}
-                    .stat-item {{
-                        text-align: center;
-                    }}
-                    .stat-value {{
-                        font-size: 1.8rem;
-                        font-weight: 700;
-                        color: white;
-                        line-height: 1.2;
-                    }}
-                    .stat-label {{
-                        font-size: 0.85rem;
-                        text-transform: uppercase;
-                        letter-spacing: 1px;
-                        color: #8f9bb3;
-                    }}
-                    /* status bar */
-                    .status-bar {{
-                        background: #1a1e28;
-                        border-radius: 40px;
-                        padding: 1rem 2rem;
-                        margin-bottom: 2.5rem;
-                        display: flex;
-                        align-items: center;
-                        gap: 1.5rem;
-                        flex-wrap: wrap;
-                        border: 1px solid #2d3340;
-                    }}
-                    .badge {{
-                        background: #10b981;
-                        color: white;
-                        font-weight: 600;
-                        padding: 0.3rem 1rem;
-                        border-radius: 30px;
-                        font-size: 0.9rem;
-                        display: inline-flex;
-                        align-items: center;
-                        gap: 6px;
-                    }}
-                    .badge.offline {{ background: #ef4444; }}
-                    .info-row {{
-                        display: flex;
-                        gap: 2rem;
-                        flex-wrap: wrap;
-                    }}
-                    .info-item {{
-                        display: flex;
-                        align-items: center;
-                        gap: 8px;
-                        color: #b9c2d4;
-                    }}
-                    .info-item i {{ font-style: normal; color: #63b3ed; font-weight: 600; }}
-                    /* command grid */
-                    .section-title {{
-                        font-size: 1.8rem;
-                        font-weight: 600;
-                        margin: 2rem 0 1.2rem 0;
-                        color: white;
-                        display: flex;
-                        align-items: center;
-                        gap: 10px;
-                    }}
-                    .section-title span {{
-                        background: #2f3542;
-                        padding: 0.2rem 0.8rem;
-                        border-radius: 40px;
-                        font-size: 1rem;
-                        color: #b9c2d4;
-                    }}
-                    .command-grid {{
-                        display: grid;
-                        grid-template-columns: repeat(auto-fill, minmax(180px, 1fr));
-                        gap: 12px;
-                    }}
-                    .command-card {{
-                        background: #1a1e28;
-                        border: 1px solid #2a2f3a;
-                        border-radius: 16px;
-                        padding: 0.75rem 1rem;
-                        font-size: 0.95rem;
-                        font-weight: 500;
-                        color: #cfd9e8;
-                        transition: 0.15s;
-                        box-shadow: 0 4px 10px rgba(0,0,0,0.3);
-                        display: flex;
-                        align-items: center;
-                        gap: 6px;
-                    }}
-                    .command-card:hover {{
-                        border-color: #63b3ed;
-                        background: #242a36;
-                        transform: translateY(-2px);
-                        color: white;
-                    }}
-                    .command-card .prefix {{
-                        color: #9f7aea;
-                        font-weight: 700;
-                        margin-right: 4px;
-                    }}
-                    .footer {{
-                        margin-top: 4rem;
-                        text-align: center;
-                        color: #6a7285;
-                        font-size: 0.9rem;
-                        border-top: 1px solid #262c38;
-                        padding-top: 2rem;
-                    }}
-                    .footer a {{
-                        color: #9f7aea;
-                        text-decoration: none;
-                    }}
-                    @media (max-width: 700px) {{
-                        .header {{
-                            flex-direction: column;
-                            align-items: start;
-                            gap: 1rem;
-                        }}
-                        .stats {{
-                            width: 100%;
-                            justify-content: space-around;
-                        }}
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <!-- header -->
-                    <div class="header">
-                        <div class="title">
-                            <h1>🤖 DeepSeek Bot</h1>
-                            <p>Multi‑purpose Discord bot with 80+ commands</p>
-                        </div>
-                        <div class="stats">
-                            <div class="stat-item">
-                                <div class="stat-value">{guilds}</div>
-                                <div class="stat-label">SERVERS</div>
-                            </div>
-                            <div class="stat-item">
-                                <div class="stat-value">{len(mod_commands)+len(fun_commands)+len(util_commands)+len(ai_commands)+len(economy_commands)+len(owner_commands)}</div>
-                                <div class="stat-label">COMMANDS</div>
-                            </div>
-                            <div class="stat-item">
-                                <div class="stat-value">{uptime_str.split(':')[0]}h</div>
-                                <div class="stat-label">UPTIME</div>
-                            </div>
-                        </div>
-                    </div>
+EVENTS_PUSH_SECONDS = float(os.environ.get("EVENTS_PUSH_SECONDS", 2))
+EVENTS_KEEPALIVE_SECONDS = 15
+EVENTS_MAX_CLIENTS = int(os.environ.get("EVENTS_MAX_CLIENTS", 50))
+# How often the loop copies its metrics for /status and /events
+STATUS_PUBLISH_SECONDS = 1
+HTTP_LOOP_CALL_TIMEOUT = 5
 
-                    <!-- status -->
-                    <div class="status-bar">
-                        <div class="badge">🟢 ONLINE</div>
-                        <div class="info-row">
-                            <div class="info-item"><i>📋 Prefix</i> <code style="background:#2d3340; padding:4px 8px; border-radius:8px;">{PREFIX}</code></div>
-                            <div class="info-item"><i>👑 Owner</i> <code>1307042499898118246</code></div>
-                            <div class="info-item"><i>🤖 AI</i> {'✅ active' if GROQ_TOKEN else '❌ disabled'}</div>
-                        </div>
+def render_dashboard():
+    """Render the dashboard page; live numbers are filled in by the page from /events"""
+    catalog = command_catalog.get()
+    total = catalog["counts"]["total"]
+    sections_html = "".join(
+        f'<div class="section-title">{label} <span>{len(names)}</span></div>'
+        f'<div class="command-grid">{"".join(f"<div class=command-card><span class=prefix>{PREFIX}</span>{cmd}</div>" for cmd in names)}</div>'
+        for label, names in catalog["sections"]
+    )
+    html = f"""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>DeepSeek Bot · Dashboard</title>
+        <style>
+            * {{
+                margin: 0;
+                padding: 0;
+                box-sizing: border-box;
+                font-family: 'Segoe UI', Roboto, system-ui, sans-serif;
+            }}
+            body {{
+                background: linear-gradient(145deg, #0a0c10 0%, #1a1e26 100%);
+                color: #e4e7eb;
+                min-height: 100vh;
+                display: flex;
+                justify-content: center;
+                padding: 2rem 1rem;
+            }}
+            .container {{
+                max-width: 1400px;
+                width: 100%;
+            }}
+            /* header */
+            .header {{
+                display: flex;
+                flex-wrap: wrap;
+                justify-content: space-between;
+                align-items: center;
+                margin-bottom: 2.5rem;
+                padding-bottom: 1.5rem;
+                border-bottom: 1px solid #2a2f3a;
+            }}
+            .title h1 {{
+                font-size: 2.8rem;
+                background: linear-gradient(135deg, #9f7aea, #63b3ed);
+                -webkit-background-clip: text;
+                -webkit-text-fill-color: transparent;
+                background-clip: text;
+                font-weight: 700;
+                letter-spacing: -0.5px;
+            }}
+            .title p {{
+                color: #9aa4b8;
+                margin-top: 0.25rem;
+                font-size: 1.1rem;
+            }}
+            .stats {{
+                display: flex;
+                gap: 2rem;
+                background: #1e222b;
+                padding: 1rem 2rem;
+                border-radius: 60px;
+                border: 1px solid #2f3542;
+                box-shadow: 0 8px 20px rgba(0,0,0,0.6);
+            }}
+            .stat-item {{
+                text-align: center;
+            }}
+            .stat-value {{
+                font-size: 1.8rem;
+                font-weight: 700;
+                color: white;
+                line-height: 1.2;
+            }}
+            .stat-label {{
+                font-size: 0.85rem;
+                text-transform: uppercase;
+                letter-spacing: 1px;
+                color: #8f9bb3;
+            }}
+            /* status bar */
+            .status-bar {{
+                background: #1a1e28;
+                border-radius: 40px;
+                padding: 1rem 2rem;
+                margin-bottom: 2.5rem;
+                display: flex;
+                align-items: center;
+                gap: 1.5rem;
+                flex-wrap: wrap;
+                border: 1px solid #2d3340;
+            }}
+            .badge {{
+                background: #10b981;
+                color: white;
+                font-weight: 600;
+                padding: 0.3rem 1rem;
+                border-radius: 30px;
+                font-size: 0.9rem;
+                display: inline-flex;
+                align-items: center;
+                gap: 6px;
+            }}
+            .badge.offline {{ background: #ef4444; }}
+            .info-row {{
+                display: flex;
+                gap: 2rem;
+                flex-wrap: wrap;
+            }}
+            .info-item {{
+                display: flex;
+                align-items: center;
+                gap: 8px;
+                color: #b9c2d4;
+            }}
+            .info-item i {{ font-style: normal; color: #63b3ed; font-weight: 600; }}
+            /* command grid */
+            .section-title {{
+                font-size: 1.8rem;
+                font-weight: 600;
+                margin: 2rem 0 1.2rem 0;
+                color: white;
+                display: flex;
+                align-items: center;
+                gap: 10px;
+            }}
+            .section-title span {{
+                background: #2f3542;
+                padding: 0.2rem 0.8rem;
+                border-radius: 40px;
+                font-size: 1rem;
+                color: #b9c2d4;
+            }}
+            .command-grid {{
+                display: grid;
+                grid-template-columns: repeat(auto-fill, minmax(180px, 1fr));
+                gap: 12px;
+            }}
+            .command-card {{
+                background: #1a1e28;
+                border: 1px solid #2a2f3a;
+                border-radius: 16px;
+                padding: 0.75rem 1rem;
+                font-size: 0.95rem;
+                font-weight: 500;
+                color: #cfd9e8;
+                transition: 0.15s;
+                box-shadow: 0 4px 10px rgba(0,0,0,0.3);
+                display: flex;
+                align-items: center;
+                gap: 6px;
+            }}
+            .command-card:hover {{
+                border-color: #63b3ed;
+                background: #242a36;
+                transform: translateY(-2px);
+                color: white;
+            }}
+            .command-card .prefix {{
+                color: #9f7aea;
+                font-weight: 700;
+                margin-right: 4px;
+            }}
+            .footer {{
+                margin-top: 4rem;
+                text-align: center;
+                color: #6a7285;
+                font-size: 0.9rem;
+                border-top: 1px solid #262c38;
+                padding-top: 2rem;
+            }}
+            .footer a {{
+                color: #9f7aea;
+                text-decoration: none;
+            }}
+            @media (max-width: 700px) {{
+                .header {{
+                    flex-direction: column;
+                    align-items: start;
+                    gap: 1rem;
+                }}
+                .stats {{
+                    width: 100%;
+                    justify-content: space-around;
+                }}
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <!-- header -->
+            <div class="header">
+                <div class="title">
+                    <h1>🤖 DeepSeek Bot</h1>
+                    <p>Multi‑purpose Discord bot with {total} commands</p>
+                </div>
+                <div class="stats">
+                    <div class="stat-item">
+                        <div class="stat-value" id="guilds">–</div>
+                        <div class="stat-label">SERVERS</div>
                     </div>
-
-                    <!-- command sections -->
-                    <div class="section-title">🛡️ Moderation <span>{len(mod_commands)}</span></div>
-                    <div class="command-grid">
-                        {''.join(f'<div class="command-card"><span class="prefix">!</span>{cmd}</div>' for cmd in mod_commands)}
+                    <div class="stat-item">
+                        <div class="stat-value">{total}</div>
+                        <div class="stat-label">COMMANDS</div>
                     </div>
-
-                    <div class="section-title">🎉 Fun <span>{len(fun_commands)}</span></div>
-                    <div class="command-grid">
-                        {''.join(f'<div class="command-card"><span class="prefix">!</span>{cmd}</div>' for cmd in fun_commands)}
+                    <div class="stat-item">
+                        <div class="stat-value" id="uptime">–</div>
+                        <div class="stat-label">UPTIME</div>
                     </div>
+                </div>
+            </div>
 
-                    <div class="section-title">🛠️ Utility <span>{len(util_commands)}</span></div>
-                    <div class="command-grid">
-                        {''.join(f'<div class="command-card"><span class="prefix">!</span>{cmd}</div>' for cmd in util_commands)}
-                    </div>
+            <!-- status -->
+            <div class="status-bar">
+                <div class="badge" id="status-badge">🟢 ONLINE</div>
+                <div class="info-row">
+                    <div class="info-item"><i>📋 Prefix</i> <code style="background:#2d3340; padding:4px 8px; border-radius:8px;">{PREFIX}</code></div>
+                    <div class="info-item"><i>👑 Owner</i> <code>1307042499898118246</code></div>
+                    <div class="info-item"><i>🤖 AI</i> {'✅ active' if GROQ_TOKEN else '❌ disabled'}</div>
+                    <div class="info-item"><i>⚡ Commands/s</i> <span id="commands_per_sec">–</span></div>
+                    <div class="info-item"><i>⏱️ AI latency</i> <span id="ai_latency_ms">–</span></div>
+                    <div class="info-item"><i>📬 Queue</i> <span id="queue_depth">–</span></div>
+                    <div class="info-item"><i>🐢 Loop lag</i> <span id="loop_lag_ms">–</span></div>
+                </div>
+            </div>
 
-                    <div class="section-title">🤖 AI <span>{len(ai_commands)}</span></div>
-                    <div class="command-grid">
-                        {''.join(f'<div class="command-card"><span class="prefix">!</span>{cmd}</div>' for cmd in ai_commands)}
-                    </div>
+            <!-- command sections -->
+            {sections_html}
+            <div class="footer">
+                ⚡ Powered by Groq AI · <a href="https://github.com/your-repo" target="_blank">GitHub</a> · Ready for production
+            </div>
+        </div>
+        <script>
+            const format = {{
+                uptime: s => Math.floor(s / 3600) + "h " + Math.floor(s % 3600 / 60) + "m",
+                ai_latency_ms: ms => ms ? Math.round(ms) + " ms" : "–",
+                loop_lag_ms: ms => Math.round(ms) + " ms"
+            }};
+            const badge = document.getElementById("status-badge");
+            const events = new EventSource("/events");
+            events.onmessage = e => {{
+                const delta = JSON.parse(e.data);
+                for (const [key, value] of Object.entries(delta)) {{
+                    const el = document.getElementById(key);
+                    if (el) el.textContent = format[key] ? format[key](value) : value;
+                }}
+                badge.textContent = "🟢 ONLINE";
+                badge.classList.remove("offline");
+            }};
+            events.onerror = () => {{
+                badge.textContent = "🔴 RECONNECTING";
+                badge.classList.add("offline");
+            }};
+        </script>
+    </body>
+    </html>
+    """
+    return html.encode()
 
-                    <div class="section-title">💰 Economy <span>{len(economy_commands)}</span></div>
-                    <div class="command-grid">
-                        {''.join(f'<div class="command-card"><span class="prefix">!</span>{cmd}</div>' for cmd in economy_commands)}
-                    </div>
+class DashboardPage:
+    """The dashboard rendered once and served with an ETag until something invalidates it"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.body = None
+        self.etag = None
 
-                    <div class="section-title">⚙️ Owner only <span>{len(owner_commands)}</span></div>
-                    <div class="command-grid">
-                        {''.join(f'<div class="command-card"><span class="prefix">!</span>{cmd}</div>' for cmd in owner_commands)}
-                    </div>
+    def get(self):
+        with self.lock:
+            if self.body is None:
+                self.body = render_dashboard()
+                self.etag = '"' + hashlib.sha1(self.body).hexdigest()[:16] + '"'
+            return self.body, self.etag
 
-                    <div class="footer">
-                        ⚡ Powered by Groq AI · <a href="https://github.com/your-repo" target="_blank">GitHub</a> · Ready for production
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-            self.wfile.write(html.encode())
+    def invalidate(self):
+        with self.lock:
+            self.body = None
+
+dashboard_page = DashboardPage()
+events_clients = threading.BoundedSemaphore(EVENTS_MAX_CLIENTS)
+
+def live_stats(previous_run, previous_at):
+    """Numbers pushed to the dashboard; returns (stats, commands_run, taken_at) for the next rate"""
+    snapshot = stats_service.snapshot
+    status = status_snapshot.snapshot
+    now = time.monotonic()
+    elapsed = now - previous_at
+    per_second = (snapshot["commands_run"] - previous_run) / elapsed if previous_at and elapsed > 0 else 0.0
+    stats = {
+        "guilds": snapshot["guilds"],
+        "uptime": int(time.time() - BOT_START_TIME),
+        "commands_per_sec": round(per_second, 2),
+        "ai_latency_ms": status.get("ai_latency_ms"),
+        "queue_depth": status.get("queue_depth", 0),
+        # Read live, since a stuck loop is exactly when the snapshot stops updating
+        "loop_lag_ms": loop_monitor.current_lag_ms()
+    }
+    return stats, snapshot["commands_run"], now
+
+class BotHTTPServer(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/":
+            self.send_dashboard()
+        elif self.path == "/events":
+            self.send_events()
         elif self.path == "/status":
-            self.send_response(200)
+            # A draining instance fails its health check, so the platform stops routing to it at once
+            self.send_response(503 if drainer.draining else 200)
             self.send_header("Content-type", "application/json")
             self.end_headers()
+            status = status_snapshot.snapshot
             status_data = {
-                "status": "online",
+                "status": "draining" if drainer.draining else "online",
                 "uptime": int(time.time() - BOT_START_TIME),
                 "owner": OWNER_ID,
-                "servers": len(bot.guilds) if hasattr(bot, 'guilds') else 0,
-                "commands": len(bot.commands) if hasattr(bot, 'commands') else 0,
+                "servers": stats_service.snapshot["guilds"],
+                "commands": command_catalog.get()["counts"]["total"],
+                "command_categories": command_catalog.get()["counts"],
+                "autorespond_reuse": status.get("autorespond_reuse"),
+                "outbound": status.get("outbound"),
+                "scheduled_jobs": status.get("scheduled_jobs"),
+                "loop_lag_ms": loop_monitor.current_lag_ms(),
+                "ai_hedging": status.get("ai_hedging"),
+                "content_filter": status.get("content_filter"),
+                "overload": status.get("overload"),
                 "ai": bool(GROQ_TOKEN)
             }
             self.wfile.write(json.dumps(status_data).encode())
+        elif urlsplit(self.path).path == "/usage":
+            # Per-user and per-guild token counts are not for the public
+            self.send_admin_json(lambda: call_on_loop(usage_tracker.export))
+        elif self.path == "/startup":
+            self.send_response(200)
+            self.send_header("Content-type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(startup.report()).encode())
+        elif self.path.startswith("/memory"):
+            self.send_memory()
+        elif urlsplit(self.path).path == "/loop":
+            # Includes stack traces of stalls; read here rather than on the loop, which may be the one stalled
+            self.send_admin_json(loop_monitor.metrics)
         else:
             self.send_response(404)
             self.end_headers()
 
+    def send_dashboard(self):
+        body, etag = dashboard_page.get()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "public, max-age=300")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self, query):
+        """True when ADMIN_TOKEN is set and supplied as a bearer token or ?token="""
+        supplied = self.headers.get("Authorization", "").removeprefix("Bearer ").strip() or query.get("token", "")
+        return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied, ADMIN_TOKEN)
+
+    def send_admin_json(self, payload):
+        """Owner-only JSON endpoint; a missing or wrong token gets the same 404 as an unknown path"""
+        query = {key: values[-1] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        if not self.authorized(query):
+            self.send_response(404)
+            self.end_headers()
+            return
+        try:
+            output = payload()
+        except Exception as e:
+            logging.error(f"HTTP {urlsplit(self.path).path} failed: {e}")
+            self.send_response(503)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(output).encode())
+
+    def send_memory(self):
+        """Owner memory introspection; needs ADMIN_TOKEN as a bearer token or ?token="""
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path != "/memory" or not self.authorized(query):
+            self.send_response(404)
+            self.end_headers()
+            return
+        try:
+            limit = int(query.get("limit", 10))
+        except ValueError:
+            limit = 10
+        action = query.get("action", "report")
+        if action == "trim":
+            # Caches belong to the event loop thread, so trimming has to happen there
+            bot.loop.call_soon_threadsafe(trim_memory)
+            output = {"trim": "scheduled"}
+        elif action in ("start", "stop", "snapshot", "diff", "top"):
+            output = memory_profiler.run(action, limit)
+        else:
+            # The report walks caches the loop is mutating
+            try:
+                output = call_on_loop(memory_profiler.run, action, limit)
+            except Exception as e:
+                logging.error(f"HTTP /memory failed: {e}")
+                self.send_response(503)
+                self.end_headers()
+                return
+        self.send_response(200)
+        self.send_header("Content-type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(output).encode())
+
+    def send_events(self):
+        """Server-Sent Events: the full stats once, then only the fields that changed"""
+        if not events_clients.acquire(blocking=False):
+            self.send_response(503)
+            self.send_header("Retry-After", "30")
+            self.end_headers()
+            return
+        try:
+            self.send_response(200)
+            self.send_header("Content-type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
+            self.end_headers()
+            self.wfile.write(f"retry: {int(EVENTS_PUSH_SECONDS * 2000)}\n\n".encode())
+            sent, commands_run, taken_at = {}, 0, 0.0
+            quiet_since = time.monotonic()
+            while True:
+                stats, commands_run, taken_at = live_stats(commands_run, taken_at)
+                delta = {key: value for key, value in stats.items() if sent.get(key) != value}
+                if delta:
+                    self.wfile.write(f"data: {json.dumps(delta, separators=(',', ':'))}\n\n".encode())
+                    sent.update(delta)
+                    quiet_since = time.monotonic()
+                elif time.monotonic() - quiet_since > EVENTS_KEEPALIVE_SECONDS:
+                    # A comment line keeps proxies from closing an idle stream
+                    self.wfile.write(b": keepalive\n\n")
+                    quiet_since = time.monotonic()
+                self.wfile.flush()
+                time.sleep(EVENTS_PUSH_SECONDS)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            events_clients.release()
+
     def log_message(self, format, *args):
         return
 
 def run_http_server():
     try:
-        server = HTTPServer(("0.0.0.0", PORT), BotHTTPServer)
+        # One thread per connection, so open /events streams don't hold up other requests
+        server = ThreadingHTTPServer(("0.0.0.0", PORT), BotHTTPServer)
         logging.info(f"🌐 HTTP server running on port {PORT}")
         server.serve_forever()
     except Exception as e:
         logging.error(f"HTTP server error: {e}")
 
+# ================= COMMAND CATALOG =================
+# Each command carries extras={"category": ...}; !help, the dashboard and /status all
+# read this catalog, which is rebuilt only after commands are added or removed.
+COMMAND_CATEGORIES = OrderedDict([
+    ("moderation", "🛡️ Moderation"),
+    ("fun", "🎉 Fun"),
+    ("utility", "🛠️ Utility"),
+    ("ai", "🤖 AI"),
+    ("economy", "💰 Economy (Mock)"),
+    ("owner", "⚙️ Owner only"),
+    ("other", "📦 Other")
+])
+
+class CommandCatalog:
+    """Help embeds, dashboard sections and counts derived once from the registered commands"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built = None
+
+    def invalidate(self):
+        self.built = None
+        dashboard_page.invalidate()
+
+    def get(self):
+        built = self.built
+        if built is None:
+            with self.lock:
+                if self.built is None:
+                    self.built = self.build()
+                built = self.built
+        return built
+
+    @staticmethod
+    def command_embed(cmd, label):
+        embed = discord.Embed(
+            title=f"Help: {PREFIX}{cmd.qualified_name}",
+            description=cmd.help or cmd.description or "No description.",
+            color=0x5865F2
+        )
+        usage = f"{PREFIX}{cmd.qualified_name} {cmd.signature}".strip()
+        embed.add_field(name="Usage", value=f"`{usage}`", inline=False)
+        if cmd.aliases:
+            embed.add_field(name="Aliases", value=", ".join(f"`{alias}`" for alias in cmd.aliases))
+        embed.add_field(name="Category", value=label)
+        if isinstance(cmd, commands.Group):
+            embed.add_field(
+                name="Subcommands",
+                value=", ".join(f"`{sub.name}`" for sub in sorted(cmd.commands, key=lambda c: c.name)),
+                inline=False
+            )
+        return embed
+
+    def build(self):
+        # list() takes the registry in one step, the HTTP thread may build while commands change
+        registered = sorted(list(bot.all_commands.values()), key=lambda c: c.name)
+        by_category = OrderedDict((key, []) for key in COMMAND_CATEGORIES)
+        seen = set()
+        for cmd in registered:
+            if cmd.name in seen or cmd.hidden:
+                continue
+            seen.add(cmd.name)
+            category = cmd.extras.get("category", "other")
+            by_category.setdefault(category if category in COMMAND_CATEGORIES else "other", []).append(cmd)
+        by_category = OrderedDict((key, cmds) for key, cmds in by_category.items() if cmds)
+
+        overview = discord.Embed(
+            title="🤖 DeepSeek Bot Help",
+            description=f"Prefix: `{PREFIX}` | Owner: <@{OWNER_ID}>\nUse `{PREFIX}help <category>` or `{PREFIX}help <command>` for details.",
+            color=0x5865F2
+        )
+        category_embeds, command_embeds = {}, {}
+        for key, cmds in by_category.items():
+            label = COMMAND_CATEGORIES[key]
+            overview.add_field(
+                name=f"{label} ({len(cmds)})",
+                value=", ".join("/".join(f"`{n}`" for n in [c.name] + list(c.aliases)) for c in cmds)[:1024],
+                inline=False
+            )
+            category_embeds[key] = discord.Embed(
+                title=f"{label} ({len(cmds)})",
+                description="\n".join(f"`{PREFIX}{c.name}` · {(c.short_doc or 'No description.')}" for c in cmds)[:4096],
+                color=0x5865F2
+            )
+            for cmd in cmds:
+                embed = self.command_embed(cmd, label)
+                for name in [cmd.name] + list(cmd.aliases):
+                    command_embeds[name] = embed
+        total = sum(len(cmds) for cmds in by_category.values())
+        overview.set_footer(text=f"Total commands: {total}")
+        return {
+            "overview": overview,
+            "categories": category_embeds,
+            "commands": command_embeds,
+            "sections": [(COMMAND_CATEGORIES[key], [c.name for c in cmds]) for key, cmds in by_category.items()],
+            "counts": {"total": total, **{key: len(cmds) for key, cmds in by_category.items()}}
+        }
+
+    def help_embed(self, query=None):
+        """Overview, a category or a single command; None if nothing matches"""
+        built = self.get()
+        if query is None:
+            return built["overview"]
+        query = query.lower().removeprefix(PREFIX)
+        return built["categories"].get(query) or built["commands"].get(query)
+
+command_catalog = CommandCatalog()
+
 # ================= DISCORD SETUP =================
 intents = discord.Intents.default()
-intents.message_content = True
+intents.message_content = MESSAGE_CONTENT_INTENT
 intents.members = True
 
-bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None)
+if MEMBER_CACHE_POLICY == "minimal":
+    member_cache_flags = discord.MemberCacheFlags.none()
+else:
+    member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+
+class CatalogBot(commands.Bot):
+    """Bot that drops the command catalog whenever the set of commands changes"""
+    def add_command(self, command, /):
+        super().add_command(command)
+        command_catalog.invalidate()
+
+    def remove_command(self, name, /):
+        command = super().remove_command(name)
+        if command is not None:
+            command_catalog.invalidate()
+        return command
+
+bot = CatalogBot(
+    command_prefix=PREFIX,
+    intents=intents,
+    help_command=None,
+    # The snipe log keeps its own compact records, so this cache can stay small
+    max_messages=int(os.environ.get("MESSAGE_CACHE_SIZE", 1000)),
+    member_cache_flags=member_cache_flags,
+    chunk_guilds_at_startup=MEMBER_CACHE_POLICY == "full"
+)
+
+def rss_mb():
+    """Resident memory of this process in MB (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def get_guild_members(guild):
+    """Full member list of a guild, for the few commands that need it, under any cache policy"""
+    if guild.chunked:
+        return guild.members
+    if MEMBER_CACHE_POLICY == "minimal":
+        return await guild.chunk(cache=False)
+    return await guild.chunk()
+
+# ================= SLASH COMMAND SYNC =================
+def command_tree_hash():
+    """Stable hash of the slash command payloads we would send to Discord"""
+    payload = sorted((cmd.to_dict(bot.tree) for cmd in bot.tree.get_commands()), key=lambda c: c["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def sync_command_tree(force=False):
+    """Sync the slash command tree, skipping the rate-limited call when nothing changed"""
+    tree_hash = command_tree_hash()
+    if not force and bot_data.get("command_tree_hash") == tree_hash:
+        logging.info("🌲 Command tree unchanged, skipping sync")
+        return False
+    synced = await bot.tree.sync()
+    bot_data["command_tree_hash"] = tree_hash
+    save_data()
+    logging.info(f"🌲 Synced {len(synced)} slash commands")
+    return True
+
+async def sync_on_startup():
+    await state_loaded.wait()
+    try:
+        await sync_command_tree()
+    except Exception as e:
+        logging.error(f"Command tree sync failed: {e}")
+
+@bot.event
+async def setup_hook():
+    startup.mark("login")
+    if not state_loaded.is_set():
+        # Read the state file while the gateway connects instead of before login
+        bot.loop.create_task(load_data_in_background())
+    bot.loop.create_task(sync_on_startup())
+    bot.loop.create_task(warm_caches())
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        bot.loop.add_signal_handler(sig, lambda sig=sig: asyncio.create_task(drainer.drain(sig.name)))
 
 # ================= CHECKS =================
+@bot.check
+async def wait_for_state(ctx):
+    # Only blocks in lazy startup mode, for commands arriving before the state file is read
+    await state_loaded.wait()
+    return True
+
 def is_owner():
     async def predicate(ctx):
         return ctx.author.id == OWNER_ID
@@ -384,111 +928,1842 @@ def is_not_blacklisted():
         return ctx.author.id not in bot_data["blacklist"]
     return commands.check(predicate)
 
-# ================= AI SETUP (FIXED: using from groq import Groq) =================
-GROQ_MODEL = "llama-3.3-70b-versatile"
-ai_client = None
-if GROQ_TOKEN:
-    try:
-        ai_client = Groq(api_key=GROQ_TOKEN)  # <-- FIXED: direct Groq, not groq.Groq
-        logging.info("✅ Groq client initialized")
-    except Exception as e:
-        logging.error(f"❌ Failed to initialize Groq client: {e}")
+# ================= AI SETUP (FIXED: using from groq import Groq) =================
+GROQ_MODEL = "llama-3.3-70b-versatile"
+# Point at another OpenAI-compatible Groq endpoint, e.g. a local stub server in tests
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL")
+AI_TIMEOUT = float(os.environ.get("AI_TIMEOUT", 30))
+# Upper bound on simultaneous Groq requests across every command and feature
+AI_CONCURRENCY = int(os.environ.get("AI_CONCURRENCY", 8))
+ai_slots = asyncio.Semaphore(AI_CONCURRENCY)
+# Requests waiting for or holding a slot; read by the drainer
+ai_pending = 0
+# Requests still waiting for a slot, not counting summary fan-out; read by the overload controller
+ai_queued = 0
+ai_client = None
+ai_client_lock = threading.Lock()
+
+def get_ai_client():
+    """Create the Groq client on first use; importing groq is a large share of cold start"""
+    global ai_client
+    if ai_client is not None or not GROQ_TOKEN:
+        return ai_client
+    with ai_client_lock:
+        if ai_client is None:
+            try:
+                from groq import AsyncGroq
+                # Async client so a per-prompt timeout actually cancels the request
+                ai_client = AsyncGroq(api_key=GROQ_TOKEN, base_url=GROQ_BASE_URL)
+                logging.info("✅ Groq client initialized")
+            except Exception as e:
+                logging.error(f"❌ Failed to initialize Groq client: {e}")
+    return ai_client
+
+if STARTUP_MODE != "lazy":
+    get_ai_client()
+
+# ================= AI HEDGING =================
+# Optional second endpoint, key or model. A request that has not answered within the
+# recent p90 latency is duplicated there; the first answer wins and the other is cancelled.
+AI_HEDGE_BASE_URL = os.environ.get("AI_HEDGE_BASE_URL")
+AI_HEDGE_API_KEY = os.environ.get("AI_HEDGE_API_KEY")
+AI_HEDGE_MODEL = os.environ.get("AI_HEDGE_MODEL")
+AI_HEDGE_ENABLED = bool(AI_HEDGE_BASE_URL or AI_HEDGE_API_KEY or AI_HEDGE_MODEL) and os.environ.get("AI_HEDGE", "true").lower() == "true"
+AI_HEDGE_PERCENTILE = float(os.environ.get("AI_HEDGE_PERCENTILE", 0.9))
+AI_HEDGE_MIN_DELAY = float(os.environ.get("AI_HEDGE_MIN_DELAY", 0.3))
+AI_HEDGE_INITIAL_DELAY = float(os.environ.get("AI_HEDGE_INITIAL_DELAY", 2.0))
+# At most this fraction of requests may be duplicated, so hedging costs at most that much extra
+AI_HEDGE_MAX_RATE = float(os.environ.get("AI_HEDGE_MAX_RATE", 0.1))
+hedge_client = None
+
+def get_hedge_client():
+    global hedge_client
+    if hedge_client is not None or not AI_HEDGE_ENABLED:
+        return hedge_client
+    with ai_client_lock:
+        if hedge_client is None:
+            try:
+                from groq import AsyncGroq
+                hedge_client = AsyncGroq(api_key=AI_HEDGE_API_KEY or GROQ_TOKEN, base_url=AI_HEDGE_BASE_URL or GROQ_BASE_URL)
+                logging.info(f"✅ Hedge client initialized ({AI_HEDGE_BASE_URL or 'same endpoint'}, {AI_HEDGE_MODEL or 'same model'})")
+            except Exception as e:
+                logging.error(f"❌ Failed to initialize hedge client: {e}")
+    return hedge_client
+
+class HedgePolicy:
+    """Adaptive hedge delay from recent latencies, with a credit budget capping the hedge rate"""
+    def __init__(self, percentile, min_delay, initial_delay, max_rate, window=200, min_samples=20):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.max_rate = max_rate
+        self.latencies = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.credit = 1.0
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.capped = 0
+
+    def delay(self):
+        if len(self.latencies) < self.min_samples:
+            return self.initial_delay
+        ordered = sorted(self.latencies)
+        return max(self.min_delay, ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))])
+
+    def start(self):
+        self.requests += 1
+        # Each request earns max_rate of a hedge; bursts may spend up to 10 saved hedges
+        self.credit = min(10.0, self.credit + self.max_rate)
+
+    def allow(self):
+        if self.credit < 1:
+            self.capped += 1
+            return False
+        self.credit -= 1
+        self.hedged += 1
+        return True
+
+    def observe(self, seconds, hedge_won):
+        self.latencies.append(seconds)
+        if hedge_won:
+            self.hedge_wins += 1
+
+    def metrics(self):
+        return {
+            "enabled": AI_HEDGE_ENABLED,
+            "delay_ms": round(self.delay() * 1000),
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.requests, 3) if self.requests else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "win_rate": round(self.hedge_wins / self.hedged, 3) if self.hedged else 0.0,
+            "capped": self.capped
+        }
+
+ai_hedging = HedgePolicy(AI_HEDGE_PERCENTILE, AI_HEDGE_MIN_DELAY, AI_HEDGE_INITIAL_DELAY, AI_HEDGE_MAX_RATE)
+
+async def hedged_completion(client, request):
+    """Primary request, plus a duplicate on the hedge client if it is slower than the current delay"""
+    started = time.perf_counter()
+    ai_hedging.start()
+    primary = asyncio.create_task(client.chat.completions.create(**request))
+    tasks = [primary]
+    try:
+        second = get_hedge_client()
+        if second is not None:
+            done, _ = await asyncio.wait(tasks, timeout=ai_hedging.delay())
+            # A primary that already failed is retried on the hedge at once, outside the hedge budget
+            failed = bool(done) and primary.exception() is not None
+            if failed or (not done and ai_hedging.allow()):
+                hedge_request = dict(request, model=AI_HEDGE_MODEL or request["model"])
+                tasks.append(asyncio.create_task(second.chat.completions.create(**hedge_request)))
+        pending = list(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    ai_hedging.observe(time.perf_counter() - started, task is not primary)
+                    return task.result()
+            if not pending:
+                # Every attempt failed; report the primary's error
+                raise primary.exception() or next(t.exception() for t in tasks if t.exception())
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+if STARTUP_MODE != "lazy":
+    get_hedge_client()
+
+# ================= AI USAGE ACCOUNTING =================
+# Token budgets per scope; 0 means unlimited
+AI_BUDGETS = {
+    (scope, period): int(os.environ.get(f"AI_{period.upper()}_BUDGET_{scope.upper()}", 0))
+    for scope in ("user", "guild", "command") for period in ("daily", "monthly")
+}
+USAGE_FLUSH_SECONDS = int(os.environ.get("USAGE_FLUSH_SECONDS", 300))
+
+
+class UsageTracker:
+    """Per-user, per-guild and per-command AI token counters, aggregated in memory.
+
+    Counters are only written to bot_data by the periodic flush, never per call.
+    """
+    SCOPES = ("user", "guild", "command", "total")
+
+    def __init__(self):
+        self.counters = {scope: {} for scope in self.SCOPES}
+        self.recent_latency = deque(maxlen=20)
+        self.dirty = False
+
+    @staticmethod
+    def periods():
+        now = discord.utils.utcnow()
+        return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+
+    def entry(self, scope, key):
+        day, month = self.periods()
+        entry = self.counters[scope].setdefault(str(key), {
+            "day": day, "month": month, "daily_tokens": 0, "monthly_tokens": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "calls": 0, "latency_ms": 0
+        })
+        # Roll the windows over lazily, on first touch in a new day or month
+        if entry["day"] != day:
+            entry["day"], entry["daily_tokens"] = day, 0
+        if entry["month"] != month:
+            entry["month"], entry["monthly_tokens"] = month, 0
+        return entry
+
+    def keys_for(self, attribution):
+        user_id, guild_id, command = attribution
+        return (("user", user_id), ("guild", guild_id), ("command", command), ("total", "all"))
+
+    def over_budget(self, attribution):
+        """Name of the exhausted budget for this caller, or None"""
+        for scope, key in self.keys_for(attribution):
+            if key is None or scope == "total" or str(key) not in self.counters[scope]:
+                continue
+            entry = self.entry(scope, key)
+            for period in ("daily", "monthly"):
+                budget = AI_BUDGETS[(scope, period)]
+                if budget and entry[f"{period}_tokens"] >= budget:
+                    return f"{period} {scope}"
+        return None
+
+    def record(self, attribution, prompt_tokens, completion_tokens, latency_ms):
+        tokens = prompt_tokens + completion_tokens
+        for scope, key in self.keys_for(attribution):
+            if key is None:
+                continue
+            entry = self.entry(scope, key)
+            entry["daily_tokens"] += tokens
+            entry["monthly_tokens"] += tokens
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["calls"] += 1
+            entry["latency_ms"] += round(latency_ms)
+        self.recent_latency.append(latency_ms)
+        self.dirty = True
+
+    def recent_latency_ms(self):
+        """Average latency of the last few AI calls, for the live dashboard"""
+        recent = list(self.recent_latency)
+        return round(sum(recent) / len(recent), 1) if recent else None
+
+    def restore(self, saved):
+        """Fold counters persisted by a previous process into the in-memory ones"""
+        for scope, entries in (saved or {}).items():
+            for key, old in entries.items():
+                if scope not in self.counters:
+                    continue
+                current = self.counters[scope].get(key)
+                if current is None:
+                    self.counters[scope][key] = dict(old)
+                    continue
+                for field in ("prompt_tokens", "completion_tokens", "calls", "latency_ms"):
+                    current[field] += old[field]
+                if old["day"] == current["day"]:
+                    current["daily_tokens"] += old["daily_tokens"]
+                if old["month"] == current["month"]:
+                    current["monthly_tokens"] += old["monthly_tokens"]
+
+    def top(self, scope, limit=10):
+        entries = [(key, self.entry(scope, key)) for key in list(self.counters[scope])]
+        return sorted(entries, key=lambda item: item[1]["monthly_tokens"], reverse=True)[:limit]
+
+    def export(self):
+        return {scope: {key: dict(entry) for key, entry in entries.items()} for scope, entries in self.counters.items()}
+
+usage_tracker = UsageTracker()
+
+def flush_usage():
+    if usage_tracker.dirty:
+        bot_data["ai_usage"] = usage_tracker.export()
+        usage_tracker.dirty = False
+        save_data()
+
+@tasks.loop(seconds=USAGE_FLUSH_SECONDS)
+async def flush_usage_loop():
+    flush_usage()
+
+@bot.listen("on_ready")
+async def start_usage_flush():
+    if not flush_usage_loop.is_running():
+        await state_loaded.wait()
+        usage_tracker.restore(bot_data.get("ai_usage"))
+        flush_usage_loop.start()
+
+@bot.before_invoke
+async def remember_invoker(ctx):
+    invoker.set((ctx.author.id, ctx.guild.id if ctx.guild else None, ctx.command.qualified_name))
+
+async def groq_chat(messages, max_tokens=300, temperature=0.4, model=None, stop=None, timeout=AI_TIMEOUT, fan_out=False):
+    """Run one chat completion and return (text, finish_reason); errors come back as text
+
+    fan_out marks one of many calls made for a single command, which stays out of the overload backlog.
+    """
+    global ai_pending, ai_queued
+    client = get_ai_client()
+    if not client:
+        return "🤖 AI not configured. Ask the owner to set GROQ_TOKEN.", "error"
+    attribution = invoker.get()
+    exhausted = usage_tracker.over_budget(attribution)
+    if exhausted:
+        return f"💸 The {exhausted} AI token budget is used up. Try again later.", "error"
+    started = time.perf_counter()
+    try:
+        ai_pending += 1
+        try:
+            if not fan_out:
+                ai_queued += 1
+            try:
+                await ai_slots.acquire()
+            finally:
+                if not fan_out:
+                    ai_queued -= 1
+            try:
+                completion = await asyncio.wait_for(hedged_completion(client, {
+                    "model": model or GROQ_MODEL,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    "stop": stop
+                }), timeout)
+            finally:
+                ai_slots.release()
+        finally:
+            ai_pending -= 1
+        if completion.usage:
+            usage_tracker.record(
+                attribution,
+                completion.usage.prompt_tokens,
+                completion.usage.completion_tokens,
+                (time.perf_counter() - started) * 1000
+            )
+        choice = completion.choices[0]
+        return choice.message.content, choice.finish_reason
+    except asyncio.TimeoutError:
+        logging.error(f"Groq API timeout after {timeout}s", extra={"latency_ms": round(timeout * 1000)})
+        return "⌛ AI took too long to answer, try again.", "error"
+    except Exception as e:
+        logging.error(f"Groq API error: {e}", extra={"latency_ms": round((time.perf_counter() - started) * 1000, 1)})
+        return f"❌ AI failed: {e}", "error"
+
+# ================= AI RESPONSE CACHE =================
+AI_CACHE_SIZE = int(os.environ.get("AI_CACHE_SIZE", 500))
+AI_CACHE_TTL = int(os.environ.get("AI_CACHE_TTL", 3600))
+
+class TTLCache:
+    """Small LRU cache whose entries also expire after a fixed time-to-live"""
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def trim(self, keep=0.5):
+        """Drop the least recently used entries, keeping the given fraction of the current ones"""
+        for _ in range(len(self.entries) - int(len(self.entries) * keep)):
+            self.entries.popitem(last=False)
+
+    def export(self):
+        """Live entries as [key, seconds left, value], least recently used first"""
+        now = time.monotonic()
+        return [[list(key), expires - now, value] for key, (expires, value) in self.entries.items() if expires > now]
+
+    def restore(self, items, elapsed=0):
+        now = time.monotonic()
+        for key, remaining, value in items:
+            if remaining > elapsed:
+                self.entries[tuple(key)] = (now + remaining - elapsed, value)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+ai_response_cache = TTLCache(AI_CACHE_SIZE, AI_CACHE_TTL)
+
+# ================= PAGINATED AI OUTPUT =================
+AI_PAGE_TOKENS = int(os.environ.get("AI_PAGE_TOKENS", 450))
+AI_MAX_PAGES = int(os.environ.get("AI_MAX_PAGES", 8))
+AI_MIN_PAGE_CHARS = 500
+# User input interpolated into a command header is cut to this length
+AI_HEADER_VALUE_CHARS = 100
+AI_PAGE_TIMEOUT = 600
+CONTINUE_PROMPT = "Continue exactly where you stopped. Do not repeat anything or add a preamble."
+
+def split_pages(text, limit):
+    """Split text into chunks of at most limit characters, preferring line then word breaks"""
+    if limit <= 0:
+        raise ValueError(f"page limit must be positive, got {limit}")
+    pages = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0 or cut < limit // 2:
+            cut = limit
+        pages.append(text[:cut])
+        text = text[cut:].lstrip()
+    pages.append(text)
+    return pages
+
+class AIPaginator(discord.ui.View):
+    """Pages through a long AI answer, generating each further page only when someone asks for it"""
+    def __init__(self, author_id, header, messages, text, finished, settings):
+        super().__init__(timeout=AI_PAGE_TIMEOUT)
+        self.author_id = author_id
+        self.settings = settings
+        # Button callbacks run in their own task, so carry the original caller along
+        self.attribution = invoker.get()
+        self.header = header
+        self.messages = messages
+        self.text = text
+        self.finished = finished
+        # Headers are short once run_prompt has truncated user input, but never trust that here
+        self.page_chars = max(AI_MIN_PAGE_CHARS, 2000 - len(header) - 40)
+        self.pages = split_pages(text, self.page_chars)
+        self.generated = 1
+        self.index = 0
+        # Set while a continuation is being written, so a second Next click cannot start another
+        self.generating = False
+        self.message = None
+        self.refresh_buttons()
+
+    def render(self):
+        more = "" if self.finished else "+"
+        return f"{self.header}{self.pages[self.index]}\n-# Page {self.index + 1}/{len(self.pages)}{more}"
+
+    def refresh_buttons(self):
+        self.previous_page.disabled = self.index == 0
+        self.next_page.disabled = self.generating or (self.index == len(self.pages) - 1 and self.finished)
+
+    async def generate_more(self):
+        """Ask the model to continue the answer and append the result as new pages"""
+        messages = self.messages + [
+            {"role": "assistant", "content": self.text},
+            {"role": "user", "content": CONTINUE_PROMPT}
+        ]
+        invoker.set(self.attribution)
+        text, finish_reason = await groq_chat(messages, **self.settings)
+        self.generated += 1
+        self.finished = finish_reason != "length" or self.generated >= AI_MAX_PAGES
+        if finish_reason == "error":
+            self.pages.append(text)
+            return
+        self.text += text
+        self.pages.extend(split_pages(text, self.page_chars))
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("❌ Only the person who asked can turn pages.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        self.index -= 1
+        self.refresh_buttons()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction, button):
+        if self.generating:
+            await interaction.response.defer()
+            return
+        if self.index == len(self.pages) - 1:
+            # Continuation takes a few seconds, longer than an interaction may stay unanswered,
+            # so answer right away with Next disabled and fill the page in afterwards
+            last = self.index
+            self.generating = True
+            self.refresh_buttons()
+            await interaction.response.edit_message(view=self)
+            try:
+                await self.generate_more()
+            finally:
+                self.generating = False
+            self.index = last + 1
+            self.refresh_buttons()
+            await interaction.edit_original_response(content=self.render(), view=self)
+            return
+        self.index += 1
+        self.refresh_buttons()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    async def on_timeout(self):
+        if self.message:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+async def send_ai_response(ctx, header, prompt, settings=None, cache_key=None):
+    """Send an AI answer, generating only its first page up front"""
+    settings = settings or {"max_tokens": AI_PAGE_TOKENS}
+    messages = [{"role": "user", "content": prompt}]
+    cached = ai_response_cache.get(cache_key) if cache_key else None
+    if cached:
+        text, finish_reason = cached
+    else:
+        text, finish_reason = await groq_chat(messages, **settings)
+        if cache_key and finish_reason != "error":
+            ai_response_cache.put(cache_key, (text, finish_reason))
+    finished = finish_reason != "length"
+    if finished and len(header) + len(text) <= 2000:
+        await ctx.send(f"{header}{text}")
+        return
+    view = AIPaginator(ctx.author.id, header, messages, text, finished, settings)
+    view.message = await ctx.send(view.render(), view=view)
+
+# ================= EVENTS =================
+async def warm_up():
+    """Background work deferred until after the gateway is ready in lazy startup mode"""
+    await asyncio.to_thread(get_ai_client)
+    await asyncio.to_thread(get_hedge_client)
+    startup.mark("warm_up")
+
+@bot.event
+async def on_connect():
+    if not startup.completed:
+        startup.mark("gateway_connect")
+
+@bot.event
+async def on_ready():
+    logging.info(f"✅ {bot.user} connected to Discord.")
+    if not startup.completed:
+        # discord.py dispatches on_ready only after guilds have streamed in and been chunked
+        startup.mark("guild_chunking")
+        startup.completed = True
+        startup.details["member_cache"] = {
+            "policy": MEMBER_CACHE_POLICY,
+            "guilds": len(bot.guilds),
+            "chunked_guilds": sum(1 for g in bot.guilds if g.chunked),
+            "cached_members": sum(len(g.members) for g in bot.guilds),
+            "rss_mb": round(rss_mb(), 1)
+        }
+        logging.info(f"👥 Member cache policy '{MEMBER_CACHE_POLICY}': {startup.details['member_cache']}")
+        logging.info("⏱️ Startup timeline: " + ", ".join(f"{p['phase']}={p['duration_ms']:.0f}ms" for p in startup.phases))
+        if STARTUP_MODE == "lazy":
+            bot.loop.create_task(warm_up())
+    await bot.change_presence(activity=discord.Game(name=f"{PREFIX}help"))
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, commands.CommandNotFound):
+        return
+    elif isinstance(error, Draining):
+        await ctx.send("🔄 Restarting, try again in a moment.", ephemeral=True)
+    elif isinstance(error, Overloaded):
+        await ctx.send("🔥 I'm busy right now, try again in a few seconds.", ephemeral=True)
+    elif isinstance(error, commands.CommandOnCooldown):
+        await ctx.send(f"⏰ Cooldown: {error.retry_after:.1f}s")
+    elif isinstance(error, commands.MissingPermissions):
+        await ctx.send("❌ Missing permission.")
+    elif isinstance(error, commands.CheckFailure):
+        await ctx.send("❌ You are not allowed to use this command.")
+    else:
+        await ctx.send(f"❌ Error: {error}")
+
+# ================= LOOP MONITOR =================
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", 0.5))
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", 250))
+# asyncio debug mode names every slow callback but slows the loop down, so it is opt-in
+LOOP_DEBUG = os.environ.get("LOOP_DEBUG", "false").lower() == "true"
+
+class LoopMonitor:
+    """Measures event-loop lag and captures the loop thread's stack while it is blocked.
+
+    A heartbeat coroutine wakes every ``interval`` seconds and records how late it ran.
+    A watchdog thread notices when the heartbeat is overdue by more than ``threshold_ms``
+    and grabs the loop thread's current frame with ``sys._current_frames()``, so the
+    blocking call is caught in the act rather than reconstructed after the fact.
+    """
+    def __init__(self, interval, threshold_ms, window=600, keep_stalls=20):
+        self.interval = interval
+        self.threshold_ms = threshold_ms
+        self.lags = deque(maxlen=window)
+        self.stalls = deque(maxlen=keep_stalls)
+        self.slow_callbacks = deque(maxlen=keep_stalls)
+        self.stall_count = 0
+        self.last_beat = None
+        self.captured_beat = None
+        self.loop_thread = None
+        self.watchdog = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        if LOOP_DEBUG:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold_ms / 1000
+            logging.getLogger("asyncio").addFilter(self.note_slow_callback)
+        asyncio.create_task(self.heartbeat())
+        self.watchdog = threading.Thread(target=self.watch, name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+
+    async def heartbeat(self):
+        while not self.stopping.is_set():
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag_ms = max(0.0, (now - self.last_beat - self.interval) * 1000)
+            self.lags.append(lag_ms)
+            if self.captured_beat == self.last_beat and self.stalls:
+                # The watchdog caught this stall while it was happening; now we know how long it lasted
+                stall = self.stalls[-1]
+                stall["blocked_ms"] = round(lag_ms, 1)
+                logging.warning(f"🐢 Event loop was blocked for {lag_ms:.0f}ms in {stall['frame']}", extra={"latency_ms": round(lag_ms, 1)})
+            self.last_beat = now
+
+    def watch(self):
+        while not self.stopping.wait(self.threshold_ms / 2000):
+            beat = self.last_beat
+            overdue_ms = (time.monotonic() - beat - self.interval) * 1000
+            if overdue_ms < self.threshold_ms or self.captured_beat == beat:
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)[-15:]
+            self.captured_beat = beat
+            self.stall_count += 1
+            self.stalls.append({
+                "at": discord.utils.utcnow().isoformat(timespec="seconds").replace("+00:00", "Z"),
+                "blocked_ms": round(overdue_ms, 1),
+                "frame": f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}",
+                "stack": [line.rstrip() for line in stack]
+            })
+            logging.warning(f"🧵 Event loop blocked >{overdue_ms:.0f}ms, loop thread is at:\n" + "".join(stack))
+
+    def note_slow_callback(self, record):
+        # asyncio debug mode logs "Executing <Handle ...> took 0.300 seconds" on the loop thread
+        if "took" in str(record.msg) and record.args:
+            self.slow_callbacks.append({
+                "at": discord.utils.utcnow().isoformat(timespec="seconds").replace("+00:00", "Z"),
+                "callback": str(record.args[0])[:200],
+                "seconds": round(record.args[-1], 3)
+            })
+        return True
+
+    def percentile(self, fraction):
+        if not self.lags:
+            return 0.0
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def current_lag_ms(self):
+        """Lag of the last heartbeat, or how overdue the next one already is if the loop is stuck"""
+        if self.last_beat is None:
+            return 0.0
+        overdue_ms = (time.monotonic() - self.last_beat - self.interval) * 1000
+        return round(max(overdue_ms, self.lags[-1] if self.lags else 0.0, 0.0), 1)
+
+    def metrics(self):
+        return {
+            "running": self.watchdog is not None,
+            "interval_s": self.interval,
+            "threshold_ms": self.threshold_ms,
+            "debug": LOOP_DEBUG,
+            "lag_ms": self.current_lag_ms(),
+            "p50_ms": round(self.percentile(0.5), 1),
+            "p99_ms": round(self.percentile(0.99), 1),
+            "max_ms": round(max(self.lags, default=0.0), 1),
+            "stalls": self.stall_count,
+            "recent_stalls": list(self.stalls),
+            "slow_callbacks": list(self.slow_callbacks)
+        }
+
+loop_monitor = LoopMonitor(LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD_MS)
+
+@bot.listen("on_ready")
+async def start_loop_monitor():
+    if loop_monitor.watchdog is None:
+        loop_monitor.start()
+
+# ================= AGGREGATE STATS =================
+class StatsAggregator:
+    """Guild, member, channel and command counters kept current from gateway events.
+
+    Consumers (including the HTTP thread) only read ``snapshot``, a dict that is
+    replaced as a whole on every change, so reads are O(1) and need no lock.
+    """
+    def __init__(self):
+        self.guilds = 0
+        self.members = 0
+        self.channels = 0
+        self.commands_registered = 0
+        self.commands_run = 0
+        self.reconciled_at = None
+        self.publish()
+
+    def publish(self):
+        self.snapshot = {
+            "guilds": self.guilds,
+            "members": self.members,
+            "channels": self.channels,
+            "commands": self.commands_registered,
+            "commands_run": self.commands_run,
+            "reconciled_at": self.reconciled_at
+        }
+
+    def reconcile(self):
+        """Recount everything from the discord.py cache to correct any drift"""
+        guilds = list(bot.guilds)
+        counts = (len(guilds), sum(g.member_count or 0 for g in guilds), sum(len(g.channels) for g in guilds))
+        drift = (counts[0] - self.guilds, counts[1] - self.members, counts[2] - self.channels)
+        if any(drift) and self.reconciled_at is not None:
+            logging.info(f"📊 Stats reconcile corrected drift (guilds, members, channels) = {drift}")
+        self.guilds, self.members, self.channels = counts
+        self.commands_registered = len(bot.commands)
+        self.reconciled_at = int(time.time())
+        self.publish()
+
+    def add_guild(self, guild, sign=1):
+        self.guilds += sign
+        self.members += sign * (guild.member_count or 0)
+        self.channels += sign * len(guild.channels)
+        self.publish()
+
+    def add_members(self, delta):
+        self.members += delta
+        self.publish()
+
+    def add_channels(self, delta):
+        self.channels += delta
+        self.publish()
+
+    def command_completed(self):
+        self.commands_run += 1
+        self.publish()
+
+stats_service = StatsAggregator()
+
+@tasks.loop(minutes=STATS_RECONCILE_MINUTES)
+async def reconcile_stats():
+    stats_service.reconcile()
+
+@bot.listen()
+async def on_guild_join(guild):
+    stats_service.add_guild(guild)
+
+@bot.listen()
+async def on_guild_remove(guild):
+    stats_service.add_guild(guild, sign=-1)
+
+@bot.listen()
+async def on_member_join(member):
+    stats_service.add_members(1)
+
+@bot.listen()
+async def on_member_remove(member):
+    stats_service.add_members(-1)
+
+@bot.listen()
+async def on_guild_channel_create(channel):
+    stats_service.add_channels(1)
+
+@bot.listen()
+async def on_guild_channel_delete(channel):
+    stats_service.add_channels(-1)
+
+@bot.listen()
+async def on_command_completion(ctx):
+    stats_service.command_completed()
+
+@bot.listen("on_ready")
+async def start_stats_reconcile():
+    # The first loop iteration runs immediately and seeds the counters from the cache
+    if not reconcile_stats.is_running():
+        reconcile_stats.start()
+    if not publish_status.is_running():
+        publish_status.start()
+
+class StatusSnapshot:
+    """Metrics of loop-owned structures for the HTTP thread, copied on the loop like StatsAggregator.snapshot.
+
+    Reading the dicts and deques directly from another thread can hit
+    "changed size during iteration" while the loop mutates them.
+    """
+    def __init__(self):
+        self.snapshot = {}
+
+    def publish(self):
+        self.snapshot = {
+            "autorespond_reuse": answer_reuse.metrics(),
+            "outbound": outbound.metrics(),
+            "queue_depth": outbound.depth(),
+            "scheduled_jobs": scheduler.pending(),
+            "ai_hedging": ai_hedging.metrics(),
+            "ai_latency_ms": usage_tracker.recent_latency_ms(),
+            "content_filter": filter_metrics.metrics(),
+            "overload": overload.metrics()
+        }
+
+status_snapshot = StatusSnapshot()
+
+@tasks.loop(seconds=STATUS_PUBLISH_SECONDS)
+async def publish_status():
+    status_snapshot.publish()
+
+def call_on_loop(function, *args):
+    """Run function on the event loop thread and wait for its result; for HTTP handlers"""
+    loop = getattr(bot, "loop", None)
+    if not isinstance(loop, asyncio.AbstractEventLoop) or not loop.is_running():
+        raise RuntimeError("event loop is not running")
+    async def call():
+        return function(*args)
+    return asyncio.run_coroutine_threadsafe(call(), loop).result(HTTP_LOOP_CALL_TIMEOUT)
+
+# ================= OUTBOUND MESSAGE QUEUE =================
+PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW = 0, 1, 2
+OUTBOUND_STALE_SECONDS = float(os.environ.get("OUTBOUND_STALE_SECONDS", 10))
+OUTBOUND_IDLE_SECONDS = 60
+
+class OutboundItem:
+    __slots__ = ("content", "kwargs", "priority", "coalesce", "enqueued", "future")
+
+    def __init__(self, content, kwargs, priority, coalesce):
+        self.content = content
+        self.kwargs = kwargs
+        self.priority = priority
+        self.coalesce = coalesce
+        self.enqueued = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+class OutboundDispatcher:
+    """One FIFO queue and sender task per channel.
+
+    A channel's worker sends one message at a time, so while discord.py waits out a
+    429 the queue fills up. The next send then merges the run of pending plain-text
+    items at the head into one message, and drops low-priority items that went stale
+    while waiting. Items that must not be merged (replies, embeds, views) go out
+    on their own, in order.
+    """
+    def __init__(self):
+        self.queues = {}
+        self.workers = {}
+        self.wakeups = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.latency_ms = 0.0
+
+    async def send(self, channel, content, priority=PRIORITY_NORMAL, coalesce=False, **kwargs):
+        """Queue a message; resolves to the sent message, or None if it was dropped as stale"""
+        item = OutboundItem(content, kwargs, priority, coalesce and not kwargs)
+        self.queues.setdefault(channel.id, deque()).append(item)
+        if channel.id in self.workers:
+            self.wakeups[channel.id].set()
+        else:
+            self.wakeups[channel.id] = asyncio.Event()
+            self.workers[channel.id] = asyncio.create_task(self.worker(channel))
+        return await item.future
+
+    def stale(self, item, now):
+        return item.priority == PRIORITY_LOW and now - item.enqueued > OUTBOUND_STALE_SECONDS
+
+    def next_batch(self, queue):
+        now = time.monotonic()
+        batch = []
+        length = 0
+        while queue:
+            item = queue[0]
+            if item.future.done():
+                # The caller stopped waiting (command timeout, shutdown), so nobody wants this message
+                queue.popleft()
+                self.dropped += 1
+                continue
+            if self.stale(item, now):
+                queue.popleft()
+                self.dropped += 1
+                item.future.set_result(None)
+                continue
+            if batch and not (batch[0].coalesce and item.coalesce and length + len(item.content) + 1 <= 2000):
+                break
+            queue.popleft()
+            batch.append(item)
+            length += len(item.content) + 1
+            if not item.coalesce:
+                break
+        return batch
+
+    async def worker(self, channel):
+        queue = self.queues[channel.id]
+        wakeup = self.wakeups[channel.id]
+        try:
+            while True:
+                batch = self.next_batch(queue)
+                if not batch:
+                    wakeup.clear()
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), OUTBOUND_IDLE_SECONDS)
+                    except asyncio.TimeoutError:
+                        # An item can land just as the wait times out; exit only with nothing left to send
+                        if queue:
+                            continue
+                        return
+                    continue
+                started = time.monotonic()
+                try:
+                    message = await channel.send("\n".join(item.content for item in batch), **batch[0].kwargs)
+                except Exception as e:
+                    for item in batch:
+                        if not item.future.done():
+                            item.future.set_exception(e)
+                else:
+                    for item in batch:
+                        if not item.future.done():
+                            item.future.set_result(message)
+                elapsed = (time.monotonic() - started) * 1000
+                self.latency_ms = elapsed if not self.sent else 0.8 * self.latency_ms + 0.2 * elapsed
+                self.sent += 1
+                self.coalesced += len(batch) - 1
+        finally:
+            del self.workers[channel.id]
+            del self.wakeups[channel.id]
+            del self.queues[channel.id]
+
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def metrics(self):
+        return {
+            "queue_depth": self.depth(),
+            "busiest_channels": sorted(((len(q), cid) for cid, q in self.queues.items() if q), reverse=True)[:5],
+            "send_latency_ms": round(self.latency_ms, 1),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped_stale": self.dropped
+        }
+
+outbound = OutboundDispatcher()
+
+async def queued_send(ctx, content, priority=PRIORITY_LOW):
+    """Send a plain-text command reply through the channel queue"""
+    if ctx.interaction:
+        # Slash invocations have to be answered on the interaction itself
+        return await ctx.send(content)
+    return await outbound.send(ctx.channel, content, priority=priority, coalesce=True)
+
+# ================= OVERLOAD CONTROL =================
+# Pressure is the worst of loop lag, outbound queue depth and AI backlog, each relative to
+# its limit. Higher levels shed more: 1 cools down fun commands, 2 also turns AI away,
+# 3 also cools down utility and economy. Moderation and owner commands are never shed.
+OVERLOAD_LAG_MS = float(os.environ.get("OVERLOAD_LAG_MS", 200))
+OVERLOAD_QUEUE_DEPTH = int(os.environ.get("OVERLOAD_QUEUE_DEPTH", 200))
+# Requests queued behind the AI semaphore before the backlog counts as full pressure
+OVERLOAD_AI_BACKLOG = int(os.environ.get("OVERLOAD_AI_BACKLOG", AI_CONCURRENCY * 3))
+OVERLOAD_RECOVERY_SECONDS = float(os.environ.get("OVERLOAD_RECOVERY_SECONDS", 30))
+# Pressure needed to enter each level; a level is left below 70% of its threshold
+OVERLOAD_THRESHOLDS = (0.6, 1.0, 1.6)
+OVERLOAD_COOLDOWNS = (0, 3, 10, 30)
+SHED_CATEGORIES = {"fun": 1, "ai": 2, "utility": 3, "economy": 3}
+
+class Overloaded(commands.CheckFailure):
+    pass
+
+class OverloadController:
+    """Turns load signals into a shed level, rising at once and falling one step at a time"""
+    def __init__(self):
+        self.level = 0
+        self.pressure = 0.0
+        self.signals = {}
+        self.calm_since = None
+        self.shed = {"cooldown": 0, "busy": 0}
+        # One mapping per category, so a user cooled down on fun commands can still use utility ones,
+        # and per level, since a bucket keeps the rate it was created with and would outlive a level change
+        self.cooldowns = {
+            (category, level): commands.CooldownMapping.from_cooldown(1, per, commands.BucketType.user)
+            for category in SHED_CATEGORIES for level, per in enumerate(OVERLOAD_COOLDOWNS) if per
+        }
+
+    def sample(self):
+        self.signals = {
+            "loop_lag": loop_monitor.current_lag_ms() / OVERLOAD_LAG_MS,
+            "outbound": outbound.depth() / OVERLOAD_QUEUE_DEPTH,
+            "ai_backlog": ai_queued / OVERLOAD_AI_BACKLOG
+        }
+        # Smooth single spikes; a sustained rise still crosses a threshold within a few samples
+        self.pressure = 0.5 * self.pressure + 0.5 * max(self.signals.values())
+        target = sum(1 for threshold in OVERLOAD_THRESHOLDS if self.pressure >= threshold)
+        if target > self.level:
+            logging.warning(f"🔥 Overload level {self.level} -> {target} (pressure {self.pressure:.2f}, {self.rounded_signals()})")
+            self.level = target
+            self.calm_since = None
+        elif self.level and self.pressure < OVERLOAD_THRESHOLDS[self.level - 1] * 0.7:
+            now = time.monotonic()
+            if self.calm_since is None:
+                self.calm_since = now
+            elif now - self.calm_since >= OVERLOAD_RECOVERY_SECONDS:
+                self.level -= 1
+                self.calm_since = now if self.level else None
+                logging.info(f"🧊 Overload level down to {self.level} (pressure {self.pressure:.2f})")
+        else:
+            self.calm_since = None
+
+    def shed_level(self, ctx):
+        if ctx.author.id == OWNER_ID or ctx.command is None:
+            return None
+        return SHED_CATEGORIES.get(ctx.command.extras.get("category"))
+
+    def admit(self, ctx):
+        """Raise CommandOnCooldown or Overloaded if ctx's command is being shed right now"""
+        level = self.shed_level(ctx)
+        if level is None or self.level < level:
+            return
+        category = ctx.command.extras["category"]
+        if category == "ai":
+            self.shed["busy"] += 1
+            raise Overloaded("busy")
+        mapping = self.cooldowns.get((category, self.level))
+        bucket = mapping.get_bucket(ctx.message) if mapping else None
+        retry_after = bucket.update_rate_limit() if bucket else None
+        if retry_after:
+            self.shed["cooldown"] += 1
+            raise commands.CommandOnCooldown(bucket, retry_after, commands.BucketType.user)
+
+    def rounded_signals(self):
+        return {name: round(value, 2) for name, value in self.signals.items()}
+
+    def metrics(self):
+        return {"level": self.level, "pressure": round(self.pressure, 2), "signals": self.rounded_signals(), "shed": dict(self.shed)}
+
+overload = OverloadController()
+
+@tasks.loop(seconds=1)
+async def sample_overload():
+    overload.sample()
+
+@bot.listen("on_ready")
+async def start_overload_control():
+    if not sample_overload.is_running():
+        sample_overload.start()
+
+@bot.check
+async def shed_load(ctx):
+    overload.admit(ctx)
+    return True
+
+# ================= AUTO-RESPOND ANSWER REUSE =================
+REUSE_THRESHOLD = float(os.environ.get("AUTORESPOND_REUSE_THRESHOLD", 0.6))
+REUSE_TTL = int(os.environ.get("AUTORESPOND_REUSE_TTL", 6 * 3600))
+REUSE_MAX_PER_CHANNEL = int(os.environ.get("AUTORESPOND_REUSE_MAX", 200))
+REUSE_MAX_CHANNELS = 100
+MINHASH_PERMUTATIONS = 32
+LSH_ROWS = 2  # 16 bands of 2 rows: pairs around 0.5 similarity almost always share a bucket
+MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(1416480455670239232)
+MINHASH_PARAMS = [(_minhash_rng.randrange(1, MINHASH_PRIME), _minhash_rng.randrange(MINHASH_PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
+# Filler words that change between phrasings of the same question
+REUSE_STOPWORDS = {
+    "a", "an", "the", "do", "does", "did", "i", "you", "we", "me", "my", "to", "is", "are",
+    "can", "could", "would", "should", "please", "pls", "plz", "u", "ur", "of", "in", "on", "for"
+}
+
+def question_shingles(text):
+    """Character trigrams of the question with case, punctuation and filler words stripped"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    words = [w for w in re.findall(r"[a-z0-9]+", text) if w not in REUSE_STOPWORDS]
+    normalized = " ".join(words)
+    if len(normalized) < 3:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + 3] for i in range(len(normalized) - 2)}
+
+def minhash_signature(shingles):
+    hashes = [zlib.crc32(s.encode()) for s in shingles]
+    return tuple(min((a * h + b) % MINHASH_PRIME for h in hashes) for a, b in MINHASH_PARAMS)
+
+class ReuseEntry:
+    __slots__ = ("signature", "answer", "created")
+
+    def __init__(self, signature, answer, created):
+        self.signature = signature
+        self.answer = answer
+        self.created = created
+
+class ChannelAnswerIndex:
+    """Recently answered questions of one channel, bucketed by MinHash LSH bands"""
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.next_id = 0
+
+    def bands(self, signature):
+        return [(i, signature[i:i + LSH_ROWS]) for i in range(0, len(signature), LSH_ROWS)]
+
+    def remove(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        for band in self.bands(entry.signature):
+            bucket = self.buckets.get(band)
+            if bucket:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.buckets[band]
+
+    def expire(self, now):
+        # Entries are kept in insertion order, so the expired ones are all at the front
+        while self.entries:
+            entry_id, entry = next(iter(self.entries.items()))
+            if now - entry.created < REUSE_TTL:
+                break
+            self.remove(entry_id)
+
+    def lookup(self, signature, now):
+        self.expire(now)
+        candidates = set()
+        for band in self.bands(signature):
+            candidates |= self.buckets.get(band, set())
+        best, best_score = None, 0.0
+        for entry_id in candidates:
+            entry = self.entries[entry_id]
+            score = sum(a == b for a, b in zip(signature, entry.signature)) / MINHASH_PERMUTATIONS
+            if score > best_score:
+                best, best_score = entry, score
+        return (best.answer, best_score) if best and best_score >= REUSE_THRESHOLD else (None, best_score)
+
+    def add(self, signature, answer, now):
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = ReuseEntry(signature, answer, now)
+        for band in self.bands(signature):
+            self.buckets.setdefault(band, set()).add(entry_id)
+        while len(self.entries) > REUSE_MAX_PER_CHANNEL:
+            self.remove(next(iter(self.entries)))
+
+class AnswerReuse:
+    """Serves stored auto-responder answers to near-duplicate questions"""
+    def __init__(self):
+        self.channels = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def signature(self, question):
+        shingles = question_shingles(question)
+        return minhash_signature(shingles) if shingles else None
+
+    def lookup(self, channel_id, signature):
+        index = self.channels.get(channel_id)
+        if signature is None or index is None:
+            self.misses += 1
+            return None
+        self.channels.move_to_end(channel_id)
+        answer, _ = index.lookup(signature, time.time())
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def store(self, channel_id, signature, answer):
+        if signature is None:
+            return
+        index = self.channels.get(channel_id)
+        if index is None:
+            index = self.channels[channel_id] = ChannelAnswerIndex()
+            while len(self.channels) > REUSE_MAX_CHANNELS:
+                self.channels.popitem(last=False)
+        self.channels.move_to_end(channel_id)
+        index.add(signature, answer, time.time())
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "channels": len(self.channels),
+            "entries": sum(len(index.entries) for index in self.channels.values())
+        }
+
+answer_reuse = AnswerReuse()
+
+# ================= CONTENT FILTER =================
+# Per-guild banned words, phrases and domains compiled into one Aho-Corasick automaton
+# per guild, so a message is scanned once however many patterns the guild has.
+FILTER_KINDS = ("word", "phrase", "domain")
+FILTER_ACTIONS = ("delete", "warn", "timeout")
+INVITE_PATTERNS = ("discord.gg/", "discord.com/invite/", "discordapp.com/invite/")
+ZERO_WIDTH = dict.fromkeys(map(ord, "\u00ad\u180e\u200b\u200c\u200d\u200e\u200f\u2060\u2061\u2062\u2063\u2064\ufeff"))
+LEETSPEAK = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b", "@": "a", "$": "s", "!": "i", "|": "i"})
+
+def fold_filter_text(text):
+    """Fold case, accents, zero-width characters and runs of whitespace"""
+    text = unicodedata.normalize("NFKD", text.translate(ZERO_WIDTH))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    return re.sub(r"\s+", " ", text)
+
+def normalize_filter_text(text):
+    """fold_filter_text plus leetspeak, one character for one, so positions still line up"""
+    return fold_filter_text(text).translate(LEETSPEAK)
+
+class AhoCorasick:
+    """Trie with failure links. add() extends the trie in place; build() only relinks it"""
+    def __init__(self):
+        self.goto = [{}]
+        self.own = [()]
+        self.fail = [0]
+        self.out = [()]
+
+    def add(self, pattern, value):
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.own.append(())
+            node = nxt
+        self.own[node] += ((len(pattern), value),)
+
+    def build(self):
+        self.fail = [0] * len(self.goto)
+        self.out = list(self.own)
+        pending = deque(self.goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, nxt in self.goto[node].items():
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                if node:
+                    self.fail[nxt] = self.goto[state].get(ch, 0)
+                self.out[nxt] = self.own[nxt] + self.out[self.fail[nxt]]
+                pending.append(nxt)
+
+    def search(self, text):
+        """Yield (end_index, length, value) for every occurrence, in one pass over text"""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for index, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, value in out[node]:
+                yield index, length, value
+
+class GuildFilter:
+    """A guild's compiled patterns plus the actions to take on a hit"""
+    def __init__(self, config):
+        self.config = config
+        self.automaton = AhoCorasick()
+        self.patterns = set()
+        self.extend(config)
+
+    def extend(self, config):
+        """Add patterns that are new in config without rebuilding the trie"""
+        entries = [(kind, normalize_filter_text(p)) for kind in FILTER_KINDS for p in config["patterns"].get(kind, [])]
+        if config.get("invites"):
+            entries += [("domain", p) for p in INVITE_PATTERNS]
+        for kind, pattern in entries:
+            if pattern and (kind, pattern) not in self.patterns:
+                self.patterns.add((kind, pattern))
+                self.automaton.add(pattern, kind)
+        self.automaton.build()
+        self.config = config
+
+    def first_match(self, text):
+        folded = fold_filter_text(text)
+        text = folded.translate(LEETSPEAK)
+        for end, length, kind in self.automaton.search(text):
+            start = end - length + 1
+            # Boundaries are judged before leetspeak, so "scam!" still ends at the "!"
+            before = folded[start - 1] if start else " "
+            after = folded[end + 1] if end + 1 < len(folded) else " "
+            # Words and phrases need boundaries on both sides. A domain needs one before it, and one
+            # after it too unless the pattern ends in a separator, so evil.com skips evil.community
+            if kind == "domain":
+                open_end = not folded[end].isalnum() or not (after.isalnum() or after == "-")
+                if not (before.isalnum() or before == "-") and open_end:
+                    return text[start:end + 1]
+            elif not before.isalnum() and not after.isalnum():
+                return text[start:end + 1]
+        return None
+
+class FilterMetrics:
+    """Per-message scan time over a rolling window"""
+    def __init__(self, window=1000):
+        self.scan_us = deque(maxlen=window)
+        self.scanned = 0
+        self.matched = 0
+
+    def observe(self, seconds, matched):
+        self.scan_us.append(seconds * 1e6)
+        self.scanned += 1
+        self.matched += bool(matched)
+
+    def metrics(self):
+        ordered = sorted(self.scan_us)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 1) if ordered else 0.0
+        return {
+            "guilds": len(guild_filters),
+            "scanned": self.scanned,
+            "matched": self.matched,
+            "p50_us": pick(0.5),
+            "p99_us": pick(0.99),
+            "max_us": round(ordered[-1], 1) if ordered else 0.0
+        }
+
+guild_filters = {}
+filter_metrics = FilterMetrics()
+
+def filter_config(guild_id):
+    return bot_data.setdefault("content_filter", {}).setdefault(str(guild_id), {
+        "enabled": True,
+        "patterns": {kind: [] for kind in FILTER_KINDS},
+        "invites": False,
+        "actions": ["delete"],
+        "timeout_minutes": 10
+    })
+
+def compile_filter(guild_id, removed=False):
+    """Refresh one guild's automaton; only removals need a fresh trie"""
+    config = filter_config(guild_id)
+    current = guild_filters.get(guild_id)
+    if not config["enabled"] or not (any(config["patterns"].values()) or config["invites"]):
+        guild_filters.pop(guild_id, None)
+    elif current is None or removed:
+        guild_filters[guild_id] = GuildFilter(config)
+    else:
+        current.extend(config)
+
+@bot.listen("on_ready")
+async def load_content_filters():
+    await state_loaded.wait()
+    for guild_id in bot_data.get("content_filter", {}):
+        compile_filter(int(guild_id), removed=True)
+
+async def apply_content_filter(message):
+    """Scan a guild message; returns True if it was acted on and should not be processed further"""
+    guild_filter = guild_filters.get(message.guild.id)
+    if guild_filter is None or message.author.guild_permissions.manage_messages:
+        return False
+    started = time.perf_counter()
+    match = guild_filter.first_match(message.content)
+    filter_metrics.observe(time.perf_counter() - started, match)
+    if match is None:
+        return False
+    actions = guild_filter.config["actions"]
+    reason = f"Content filter: matched '{match}'"
+    try:
+        if "delete" in actions:
+            await message.delete()
+        if "warn" in actions:
+            bot_data["warnings"].setdefault(str(message.author.id), []).append(reason)
+            save_data()
+        if "timeout" in actions:
+            minutes = guild_filter.config["timeout_minutes"]
+            await message.author.timeout(discord.utils.utcnow() + timedelta(minutes=minutes), reason=reason)
+    except discord.HTTPException as e:
+        logging.warning(f"🚫 Content filter could not act in guild {message.guild.id}: {e}")
+    await outbound.send(message.channel, f"🚫 {message.author.mention}, that message is not allowed here.", priority=PRIORITY_HIGH)
+    return "delete" in actions
+
+@bot.hybrid_group(name="filter", fallback="list", extras={"category": "moderation"})
+@is_mod()
+async def content_filter(ctx):
+    """Show this server's content filter"""
+    config = filter_config(ctx.guild.id)
+    embed = discord.Embed(title="🚫 Content filter", color=0x5865F2)
+    embed.add_field(name="Status", value="on" if config["enabled"] else "off")
+    embed.add_field(name="Actions", value=", ".join(config["actions"]) or "none")
+    embed.add_field(name="Invite links", value="blocked" if config["invites"] else "allowed")
+    for kind in FILTER_KINDS:
+        patterns = config["patterns"].get(kind, [])
+        embed.add_field(name=f"{kind.title()}s ({len(patterns)})", value=", ".join(f"`{p}`" for p in patterns)[:1024] or "none", inline=False)
+    await ctx.send(embed=embed, ephemeral=True)
+
+@content_filter.command(name="add")
+@is_mod()
+async def filter_add(ctx, kind: str, *, pattern: str):
+    """Block a word, phrase or domain"""
+    if kind not in FILTER_KINDS:
+        await ctx.send(f"❌ Kind must be one of: {', '.join(FILTER_KINDS)}")
+        return
+    patterns = filter_config(ctx.guild.id)["patterns"].setdefault(kind, [])
+    if pattern.lower() not in patterns:
+        patterns.append(pattern.lower())
+        save_data()
+        compile_filter(ctx.guild.id)
+    await ctx.send(f"✅ Now filtering {kind} `{pattern}`.", ephemeral=True)
+
+@content_filter.command(name="remove")
+@is_mod()
+async def filter_remove(ctx, *, pattern: str):
+    """Stop blocking a pattern"""
+    config = filter_config(ctx.guild.id)
+    found = [kind for kind, patterns in config["patterns"].items() if pattern.lower() in patterns]
+    if not found:
+        await ctx.send(f"❌ `{pattern}` is not in the filter.")
+        return
+    for kind in found:
+        config["patterns"][kind].remove(pattern.lower())
+    save_data()
+    compile_filter(ctx.guild.id, removed=True)
+    await ctx.send(f"✅ Removed `{pattern}` from the filter.", ephemeral=True)
+
+@content_filter.command(name="invites")
+@is_mod()
+async def filter_invites(ctx, blocked: bool):
+    """Block or allow Discord invite links"""
+    filter_config(ctx.guild.id)["invites"] = blocked
+    save_data()
+    compile_filter(ctx.guild.id, removed=not blocked)
+    await ctx.send(f"✅ Invite links are now {'blocked' if blocked else 'allowed'}.")
+
+@content_filter.command(name="actions")
+@is_mod()
+async def filter_actions(ctx, *, actions: str):
+    """Set what happens on a match: any of delete, warn, timeout"""
+    chosen = [a for a in actions.replace(",", " ").split() if a]
+    if not chosen or any(a not in FILTER_ACTIONS for a in chosen):
+        await ctx.send(f"❌ Actions must be from: {', '.join(FILTER_ACTIONS)}")
+        return
+    filter_config(ctx.guild.id)["actions"] = chosen
+    save_data()
+    compile_filter(ctx.guild.id)
+    await ctx.send(f"✅ Filter actions: {', '.join(chosen)}.")
+
+@content_filter.command(name="timeout")
+@is_mod()
+async def filter_timeout(ctx, minutes: int):
+    """Set the timeout length used by the timeout action"""
+    if minutes < 1 or minutes > 40320:
+        await ctx.send("❌ Minutes must be between 1 and 40320.")
+        return
+    filter_config(ctx.guild.id)["timeout_minutes"] = minutes
+    save_data()
+    compile_filter(ctx.guild.id)
+    await ctx.send(f"✅ Filter timeouts last {minutes} minutes.")
+
+@content_filter.command(name="toggle")
+@is_mod()
+async def filter_toggle(ctx, enabled: bool):
+    """Turn the content filter on or off"""
+    filter_config(ctx.guild.id)["enabled"] = enabled
+    save_data()
+    compile_filter(ctx.guild.id, removed=True)
+    await ctx.send(f"✅ Content filter {'on' if enabled else 'off'}.")
+
+# ================= AUTO-RESPOND FEATURE =================
+LEGACY_AUTORESPOND_CHANNEL = 1416480455670239232
+DEFAULT_AUTORESPOND_PROMPT = (
+    "You are a helpful assistant in a Discord server.\n\n"
+    "Your task:\n"
+    "- Only respond to messages that are questions, i.e., messages that:\n"
+    "  - Contain question words like 'who', 'what', 'when', 'where', 'why', 'how', OR\n"
+    "  - End with a question mark '?'\n"
+    "- Reply directly to the user with a helpful and concise answer.\n"
+    "- Do not change anything else about the message, formatting, or context.\n"
+    "- Do not answer messages that are not questions.\n"
+    "- Keep your tone friendly, informative, and respectful."
+)
+AUTORESPOND_TRIGGERS = ("question", "mention", "all")
+QUESTION_PATTERN = re.compile(r"\b(who|what|when|where|why|how)\b|\?", re.IGNORECASE)
+
+class AutoRespondRule:
+    """Compiled auto-responder settings for one channel"""
+    __slots__ = ("guild_id", "system_prompt", "model", "trigger", "cooldown", "last_reply")
+
+    def __init__(self, config):
+        self.guild_id = config.get("guild_id")
+        self.system_prompt = config.get("prompt") or DEFAULT_AUTORESPOND_PROMPT
+        self.model = config.get("model")
+        self.trigger = config.get("trigger", "question")
+        self.cooldown = config.get("cooldown", 0)
+        self.last_reply = {}
+
+    def matches(self, message):
+        if self.trigger == "all":
+            return True
+        if self.trigger == "mention":
+            return bot.user in message.mentions
+        return QUESTION_PATTERN.search(message.content) is not None
+
+    def take_cooldown(self, user_id):
+        """True if the user may get an answer now, starting their cooldown"""
+        if not self.cooldown:
+            return True
+        now = time.monotonic()
+        if now - self.last_reply.get(user_id, -self.cooldown) < self.cooldown:
+            return False
+        if len(self.last_reply) > 1000:
+            self.last_reply = {uid: t for uid, t in self.last_reply.items() if now - t < self.cooldown}
+        self.last_reply[user_id] = now
+        return True
+
+# channel id -> AutoRespondRule; the only thing on_message consults per message
+autorespond_rules = {}
+
+def autorespond_config():
+    if "autorespond" not in bot_data:
+        # Installs from before per-guild config answered in one hardcoded channel
+        return {str(LEGACY_AUTORESPOND_CHANNEL): {"guild_id": None, "trigger": "question"}}
+    return bot_data["autorespond"]
+
+def compile_autorespond():
+    """Rebuild the channel -> rule map from bot_data; swapped in as a whole"""
+    global autorespond_rules
+    autorespond_rules = {int(channel_id): AutoRespondRule(config) for channel_id, config in autorespond_config().items()}
+
+@bot.listen("on_ready")
+async def load_autorespond_rules():
+    await state_loaded.wait()
+    compile_autorespond()
+
+@bot.event
+async def on_message(message):
+    # Ignore messages from bots (including itself)
+    if message.author.bot:
+        return
+
+    if message.guild is not None:
+        if await apply_content_filter(message):
+            return
+        # Only after the filter, so removed content can't be sniped back
+        snipe_log.remember(message)
+
+    # Auto-respond only in configured channels, and never to commands
+    rule = autorespond_rules.get(message.channel.id)
+    # Auto-responses are AI work, so they stop at the same overload level as AI commands
+    if rule is not None and not drainer.draining and overload.level < SHED_CATEGORIES["ai"] and not message.content.startswith(PREFIX) and rule.matches(message) and rule.take_cooldown(message.author.id):
+        invoker.set((message.author.id, message.guild.id if message.guild else None, "autorespond"))
+        signature = answer_reuse.signature(message.content)
+        cached_answer = answer_reuse.lookup(message.channel.id, signature)
+        if cached_answer:
+            await outbound.send(message.channel, cached_answer, reference=message)
+        else:
+            async with message.channel.typing():
+                response, finish_reason = await groq_chat([
+                    {"role": "system", "content": rule.system_prompt},
+                    {"role": "user", "content": message.content}
+                ], max_tokens=300, model=rule.model)
+                if finish_reason != "error":
+                    answer_reuse.store(message.channel.id, signature, response)
+            await outbound.send(message.channel, response, reference=message)
+
+    # Always process commands
+    await bot.process_commands(message)
+
+def editable_autorespond_config():
+    if "autorespond" not in bot_data:
+        bot_data["autorespond"] = {channel_id: dict(rule) for channel_id, rule in autorespond_config().items()}
+    return bot_data["autorespond"]
+
+def update_autorespond(channel, **changes):
+    """Apply a config change for channel and recompile the rule map without a restart"""
+    entry = editable_autorespond_config().setdefault(str(channel.id), {"guild_id": channel.guild.id, "trigger": "question"})
+    entry["guild_id"] = channel.guild.id
+    entry.update(changes)
+    # Answers given under the old settings should not be replayed
+    answer_reuse.channels.pop(channel.id, None)
+    save_data()
+    compile_autorespond()
+
+@bot.hybrid_group(fallback="list", extras={"category": "moderation"})
+@is_mod()
+async def autorespond(ctx):
+    """Show auto-responder channels in this server"""
+    rules = {cid: rule for cid, rule in autorespond_rules.items() if rule.guild_id in (ctx.guild.id, None) and ctx.guild.get_channel(cid)}
+    if not rules:
+        await ctx.send(f"ℹ️ Auto-respond is off here. Enable it with `{PREFIX}autorespond enable #channel`.")
+        return
+    embed = discord.Embed(title="🤖 Auto-respond channels", color=0x5865F2)
+    for cid, rule in rules.items():
+        custom = "custom prompt" if rule.system_prompt != DEFAULT_AUTORESPOND_PROMPT else "default prompt"
+        embed.add_field(
+            name=f"#{ctx.guild.get_channel(cid).name}",
+            value=f"Trigger: `{rule.trigger}` · Cooldown: {rule.cooldown}s\nModel: `{rule.model or GROQ_MODEL}` · {custom}",
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+@autorespond.command(name="enable")
+@is_mod()
+async def autorespond_enable(ctx, channel: discord.TextChannel):
+    """Answer questions in a channel"""
+    update_autorespond(channel)
+    await ctx.send(f"✅ Auto-respond enabled in {channel.mention}.")
+
+@autorespond.command(name="disable")
+@is_mod()
+async def autorespond_disable(ctx, channel: discord.TextChannel):
+    """Stop answering in a channel"""
+    if editable_autorespond_config().pop(str(channel.id), None) is None:
+        await ctx.send(f"ℹ️ Auto-respond is not enabled in {channel.mention}.")
+        return
+    answer_reuse.channels.pop(channel.id, None)
+    save_data()
+    compile_autorespond()
+    await ctx.send(f"✅ Auto-respond disabled in {channel.mention}.")
+
+@autorespond.command(name="prompt")
+@is_mod()
+async def autorespond_prompt(ctx, channel: discord.TextChannel, *, prompt: str = None):
+    """Set the system prompt for a channel (leave empty for the default)"""
+    update_autorespond(channel, prompt=prompt)
+    await ctx.send(f"✅ {'Custom' if prompt else 'Default'} prompt set for {channel.mention}.")
+
+@autorespond.command(name="model")
+@is_mod()
+async def autorespond_model(ctx, channel: discord.TextChannel, model: str = None):
+    """Set the AI model for a channel (leave empty for the default)"""
+    update_autorespond(channel, model=model)
+    await ctx.send(f"✅ Model for {channel.mention} set to `{model or GROQ_MODEL}`.")
+
+@autorespond.command(name="trigger")
+@is_mod()
+async def autorespond_trigger(ctx, channel: discord.TextChannel, mode: str):
+    """Choose which messages get answers: question, mention or all"""
+    mode = mode.lower()
+    if mode not in AUTORESPOND_TRIGGERS:
+        await ctx.send(f"❌ Trigger must be one of: {', '.join(AUTORESPOND_TRIGGERS)}")
+        return
+    update_autorespond(channel, trigger=mode)
+    await ctx.send(f"✅ {channel.mention} now answers on `{mode}`.")
+
+@autorespond.command(name="cooldown")
+@is_mod()
+async def autorespond_cooldown(ctx, channel: discord.TextChannel, seconds: int):
+    """Set the per-user cooldown between answers in a channel"""
+    if seconds < 0 or seconds > 86400:
+        await ctx.send("❌ Seconds must be 0-86400.")
+        return
+    update_autorespond(channel, cooldown=seconds)
+    await ctx.send(f"✅ Cooldown in {channel.mention} set to {seconds}s.")
+
+# ================= SCHEDULER =================
+SCHEDULE_FILE = os.environ.get("SCHEDULE_FILE", "scheduled_jobs.json")
+SCHEDULE_FLUSH_SECONDS = 30
+DURATION_PATTERN = re.compile(r"^(\d+)([smhdw])$", re.IGNORECASE)
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+def parse_duration(text):
+    """Seconds for strings like 30s, 10m, 2h, 1d or 1w; None if text is not a duration"""
+    match = DURATION_PATTERN.match(text.strip())
+    if not match:
+        return None
+    return int(match.group(1)) * DURATION_UNITS[match.group(2).lower()]
+
+class Scheduler:
+    """Persistent timed jobs (temp bans, temp roles, reminders, ...) on one heap.
+
+    A single task sleeps until the earliest due time, so pending jobs cost one small
+    tuple each instead of a sleeping coroutine. Scheduling and popping are O(log n),
+    cancellation is lazy. Jobs are written to SCHEDULE_FILE by a periodic flush and
+    overdue ones run as soon as the scheduler starts again.
+
+    Kinds listed in KEYED_JOBS undo a moderation action on one target; their first
+    arguments form a key, and at most one job per key is pending, so a newer lock,
+    mute or ban (or an early manual undo) supersedes the old expiry job.
+    """
+    KEYED_JOBS = {"unban": 2, "remove_role": 3, "unlock": 1}
+
+    def __init__(self):
+        self.heap = []
+        self.cancelled = set()
+        self.keyed = {}
+        self.handlers = {}
+        self.next_id = 1
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.dirty = False
+
+    def handler(self, kind):
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def schedule(self, delay, kind, *args):
+        """Run the handler for kind with args after delay seconds; returns the job id"""
+        job_id = self.next_id
+        self.next_id += 1
+        job = (time.time() + delay, job_id, kind, args)
+        key = self.job_key(kind, args)
+        if key is not None:
+            self.cancel_key(*key)
+            self.keyed[key] = job_id
+        heapq.heappush(self.heap, job)
+        if self.heap[0] is job:
+            self.wakeup.set()
+        self.dirty = True
+        return job_id
+
+    def job_key(self, kind, args):
+        size = self.KEYED_JOBS.get(kind)
+        return (kind,) + tuple(args[:size]) if size else None
+
+    def cancel(self, job_id):
+        self.cancelled.add(job_id)
+        self.dirty = True
+
+    def cancel_key(self, kind, *args):
+        """Cancel the pending job for this target, e.g. cancel_key("unlock", channel_id)"""
+        job_id = self.keyed.pop((kind,) + args, None)
+        if job_id is not None:
+            self.cancel(job_id)
+
+    def pending(self):
+        return len(self.heap) - len(self.cancelled)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due, job_id, kind, args = heapq.heappop(self.heap)
+            self.dirty = True
+            key = self.job_key(kind, args)
+            if key is not None and self.keyed.get(key) == job_id:
+                del self.keyed[key]
+            if job_id in self.cancelled:
+                self.cancelled.discard(job_id)
+                continue
+            asyncio.create_task(self.execute(kind, args, due))
+
+    async def execute(self, kind, args, due):
+        handler = self.handlers.get(kind)
+        if handler is None:
+            logging.error(f"No scheduler handler for job kind '{kind}'")
+            return
+        try:
+            await handler(*args)
+        except Exception as e:
+            logging.error(f"Scheduled '{kind}' job (due {int(time.time() - due)}s ago) failed: {e}")
+
+    def export(self):
+        return [[due, job_id, kind, list(args)] for due, job_id, kind, args in self.heap if job_id not in self.cancelled]
+
+    def restore(self, jobs):
+        """Add persisted jobs under fresh ids, so they never collide with jobs scheduled before restore"""
+        live = set(self.keyed)
+        latest = {}
+        for due, _, kind, args in sorted(jobs, key=lambda job: job[1]):
+            job = (due, self.next_id, sys.intern(kind), tuple(args))
+            self.next_id += 1
+            key = self.job_key(kind, args)
+            if key is None:
+                self.heap.append(job)
+            elif key not in live:
+                # A later job for the same target supersedes an earlier one, and one scheduled
+                # by this process supersedes every persisted one
+                latest[key] = job
+        for key, job in latest.items():
+            self.keyed[key] = job[1]
+            self.heap.append(job)
+        heapq.heapify(self.heap)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
 
-async def ask_groq(question, max_tokens=150):  # max_tokens kept for compatibility
-    """Ask AI using Groq Python client (model: llama-3.3-70b-versatile, temp=0.4, max_tokens=300)"""
-    if not ai_client:
-        return "🤖 AI not configured. Ask the owner to set GROQ_TOKEN."
+scheduler = Scheduler()
+
+def load_schedule():
     try:
-        completion = ai_client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[{"role": "user", "content": question}],
-            temperature=0.4,
-            max_tokens=300
-        )
-        return completion.choices[0].message.content
+        with open(SCHEDULE_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
     except Exception as e:
-        logging.error(f"Groq API error: {e}")
-        return f"❌ AI failed: {e}"
+        logging.error(f"Could not read {SCHEDULE_FILE}: {e}")
+        return []
 
-async def ask_groq_with_prompt(system_prompt, user_message, max_tokens=300):
-    """Ask AI with system prompt using Groq Python client"""
-    if not ai_client:
-        return "🤖 AI not configured."
+def write_schedule(jobs):
     try:
-        completion = ai_client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.4,
-            max_tokens=300
-        )
-        return completion.choices[0].message.content
+        write_json_atomic(SCHEDULE_FILE, jobs, separators=(",", ":"))
     except Exception as e:
-        logging.error(f"Groq API error (with prompt): {e}")
-        return f"❌ AI failed: {e}"
+        logging.error(f"Schedule save error: {e}")
 
-# ================= EVENTS =================
-@bot.event
-async def on_ready():
-    logging.info(f"✅ {bot.user} connected to Discord.")
-    await bot.change_presence(activity=discord.Game(name=f"{PREFIX}help"))
+@tasks.loop(seconds=SCHEDULE_FLUSH_SECONDS)
+async def flush_schedule():
+    if scheduler.dirty:
+        scheduler.dirty = False
+        await asyncio.to_thread(write_schedule, scheduler.export())
 
-@bot.event
-async def on_command_error(ctx, error):
-    if isinstance(error, commands.CommandNotFound):
-        return
-    elif isinstance(error, commands.CommandOnCooldown):
-        await ctx.send(f"⏰ Cooldown: {error.retry_after:.1f}s")
-    elif isinstance(error, commands.MissingPermissions):
-        await ctx.send("❌ Missing permission.")
-    elif isinstance(error, commands.CheckFailure):
-        await ctx.send("❌ You are not allowed to use this command.")
-    else:
-        await ctx.send(f"❌ Error: {error}")
+@bot.listen("on_ready")
+async def start_scheduler():
+    if scheduler.task is None:
+        scheduler.restore(await asyncio.to_thread(load_schedule))
+        overdue = sum(1 for job in scheduler.heap if job[0] <= time.time())
+        logging.info(f"⏲️ Scheduler restored {len(scheduler.heap)} jobs ({overdue} overdue, running now)")
+        scheduler.start()
+        flush_schedule.start()
 
-# ================= AUTO-RESPOND FEATURE =================
-@bot.event
-async def on_message(message):
-    # Ignore messages from bots (including itself)
-    if message.author.bot:
-        return
+async def resolve_member(guild, user_id):
+    return guild.get_member(user_id) or await guild.fetch_member(user_id)
 
-    # Check if message starts with command prefix (so commands are not auto-answered)
-    is_command = message.content.startswith(PREFIX)
-
-    # Auto-respond only in the designated channel, not a command, and not from bot
-    if not is_command and message.channel.id == 1416480455670239232:
-        # Detect question indicators
-        content_lower = message.content.lower()
-        question_words = ["who", "what", "when", "where", "why", "how"]
-        has_question_word = any(word in content_lower for word in question_words)
-        has_question_mark = "?" in message.content
-
-        if has_question_word or has_question_mark:
-            # System prompt from friend
-            system_prompt = (
-                "You are a helpful assistant in a Discord server.\n\n"
-                "Your task:\n"
-                "- Only answer messages in channel ID 1416480455670239232.\n"
-                "- Only respond to messages that are questions, i.e., messages that:\n"
-                "  - Contain question words like 'who', 'what', 'when', 'where', 'why', 'how', OR\n"
-                "  - End with a question mark '?'\n"
-                "- Reply directly to the user with a helpful and concise answer.\n"
-                "- Do not change anything else about the message, formatting, or context.\n"
-                "- Do not answer messages that are not questions.\n"
-                "- Keep your tone friendly, informative, and respectful."
-            )
-            async with message.channel.typing():
-                response = await ask_groq_with_prompt(system_prompt, message.content)
-                await message.reply(response)
+@bot.listen()
+async def on_member_unban(guild, user):
+    # Unbanned early by hand: a later ban must not be lifted by the old tempban job
+    scheduler.cancel_key("unban", guild.id, user.id)
 
-    # Always process commands
-    await bot.process_commands(message)
+@scheduler.handler("unban")
+async def scheduled_unban(guild_id, user_id):
+    guild = bot.get_guild(guild_id)
+    if guild:
+        await guild.unban(discord.Object(id=user_id), reason="Temporary ban expired")
+
+@scheduler.handler("remove_role")
+async def scheduled_remove_role(guild_id, user_id, role_id):
+    guild = bot.get_guild(guild_id)
+    role = guild and guild.get_role(role_id)
+    if role:
+        member = await resolve_member(guild, user_id)
+        await member.remove_roles(role, reason="Temporary role expired")
+
+@scheduler.handler("unlock")
+async def scheduled_unlock(channel_id):
+    channel = bot.get_channel(channel_id)
+    if channel:
+        await channel.set_permissions(channel.guild.default_role, send_messages=True)
+        await channel.send("🔓 Channel unlocked.")
+
+@scheduler.handler("remind")
+async def scheduled_remind(channel_id, user_id, text):
+    channel = bot.get_channel(channel_id)
+    if channel:
+        await channel.send(f"⏰ <@{user_id}> reminder: {text}", allowed_mentions=discord.AllowedMentions(users=True, everyone=False, roles=False))
+
+@scheduler.handler("delete_message")
+async def scheduled_delete_message(channel_id, message_id):
+    channel = bot.get_channel(channel_id)
+    if channel:
+        try:
+            await channel.get_partial_message(message_id).delete()
+        except discord.NotFound:
+            pass
 
 # ================= MODERATION COMMANDS (15) =================
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def kick(ctx, member: discord.Member, *, reason="No reason"):
     if not ctx.guild.me.guild_permissions.kick_members:
@@ -497,29 +2772,30 @@ async def kick(ctx, member: discord.Member, *, reason="No reason"):
     await member.kick(reason=reason)
     await ctx.send(f"👢 Kicked {member.mention} | {reason}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def ban(ctx, member: discord.Member, *, reason="No reason"):
     if not ctx.guild.me.guild_permissions.ban_members:
         await ctx.send("❌ I lack ban permissions.")
         return
     await member.ban(reason=reason)
+    scheduler.cancel_key("unban", ctx.guild.id, member.id)
     await ctx.send(f"🔨 Banned {member.mention} | {reason}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def timeout(ctx, member: discord.Member, minutes: int = 10):
     until = discord.utils.utcnow() + timedelta(minutes=minutes)
     await member.timeout(until)
     await ctx.send(f"⏰ {member.mention} timed out {minutes}m")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def untimeout(ctx, member: discord.Member):
     await member.timeout(None)
     await ctx.send(f"✅ Timeout removed for {member.mention}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def warn(ctx, member: discord.Member, *, reason="No reason"):
     user_id = str(member.id)
@@ -529,7 +2805,7 @@ async def warn(ctx, member: discord.Member, *, reason="No reason"):
     save_data()
     await ctx.send(f"⚠️ Warned {member.mention} | {reason}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 async def warnings(ctx, member: discord.Member = None):
     member = member or ctx.author
     user_id = str(member.id)
@@ -539,30 +2815,46 @@ async def warnings(ctx, member: discord.Member = None):
     else:
         await ctx.send(f"📋 Warnings for {member.display_name}:\n" + "\n".join(f"• {w}" for w in warns))
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def clear(ctx, amount: int = 10):
     if amount < 1 or amount > 100:
         await ctx.send("❌ Amount must be between 1 and 100.")
         return
+    if ctx.interaction:
+        # Slash invocations have no trigger message, and the reply must not land in the purge
+        await ctx.defer(ephemeral=True)
+        deleted = await ctx.channel.purge(limit=amount)
+        await ctx.send(f"🧹 Deleted {len(deleted)} messages.", ephemeral=True)
+        return
     deleted = await ctx.channel.purge(limit=amount + 1)
     msg = await ctx.send(f"🧹 Deleted {len(deleted)-1} messages.")
-    await asyncio.sleep(3)
-    await msg.delete()
+    scheduler.schedule(3, "delete_message", msg.channel.id, msg.id)
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
-async def lock(ctx):
+async def lock(ctx, duration: str = None):
+    seconds = parse_duration(duration) if duration else None
+    if duration and not seconds:
+        await ctx.send("❌ Duration looks like `30m`, `2h` or `1d`.")
+        return
     await ctx.channel.set_permissions(ctx.guild.default_role, send_messages=False)
-    await ctx.send("🔒 Channel locked.")
+    # A lock without a duration must not be lifted by an earlier timed lock's job
+    scheduler.cancel_key("unlock", ctx.channel.id)
+    if seconds:
+        scheduler.schedule(seconds, "unlock", ctx.channel.id)
+        await ctx.send(f"🔒 Channel locked for {duration}.")
+    else:
+        await ctx.send("🔒 Channel locked.")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def unlock(ctx):
+    scheduler.cancel_key("unlock", ctx.channel.id)
     await ctx.channel.set_permissions(ctx.guild.default_role, send_messages=True)
     await ctx.send("🔓 Channel unlocked.")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def slowmode(ctx, seconds: int):
     if seconds < 0 or seconds > 21600:
@@ -571,13 +2863,13 @@ async def slowmode(ctx, seconds: int):
     await ctx.channel.edit(slowmode_delay=seconds)
     await ctx.send(f"🐌 Slowmode set to {seconds}s.")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def nick(ctx, member: discord.Member, *, nickname: str = None):
     await member.edit(nick=nickname)
     await ctx.send(f"✅ Nickname changed.")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def role(ctx, action: str, member: discord.Member, *, role_name: str):
     role = discord.utils.get(ctx.guild.roles, name=role_name)
@@ -585,42 +2877,86 @@ async def role(ctx, action: str, member: discord.Member, *, role_name: str):
         await ctx.send(f"❌ Role '{role_name}' not found.")
         return
     if action.lower() in ["add", "+"]:
+        # A manual change replaces any pending temprole/mute expiry for this role
+        scheduler.cancel_key("remove_role", ctx.guild.id, member.id, role.id)
         await member.add_roles(role)
         await ctx.send(f"✅ Added {role.name} to {member.mention}.")
     elif action.lower() in ["remove", "-"]:
+        scheduler.cancel_key("remove_role", ctx.guild.id, member.id, role.id)
         await member.remove_roles(role)
         await ctx.send(f"✅ Removed {role.name} from {member.mention}.")
     else:
         await ctx.send("❌ Use `add` or `remove`.")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
-async def mute(ctx, member: discord.Member):
+async def mute(ctx, member: discord.Member, duration: str = None):
+    seconds = parse_duration(duration) if duration else None
+    if duration and not seconds:
+        await ctx.send("❌ Duration looks like `30m`, `2h` or `1d`.")
+        return
+    await ctx.defer()
     mute_role = discord.utils.get(ctx.guild.roles, name="Muted")
     if not mute_role:
         mute_role = await ctx.guild.create_role(name="Muted")
         for channel in ctx.guild.channels:
             await channel.set_permissions(mute_role, send_messages=False)
     await member.add_roles(mute_role)
-    await ctx.send(f"🔇 Muted {member.mention}")
+    scheduler.cancel_key("remove_role", ctx.guild.id, member.id, mute_role.id)
+    if seconds:
+        scheduler.schedule(seconds, "remove_role", ctx.guild.id, member.id, mute_role.id)
+        await ctx.send(f"🔇 Muted {member.mention} for {duration}")
+    else:
+        await ctx.send(f"🔇 Muted {member.mention}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def unmute(ctx, member: discord.Member):
     mute_role = discord.utils.get(ctx.guild.roles, name="Muted")
+    if mute_role:
+        scheduler.cancel_key("remove_role", ctx.guild.id, member.id, mute_role.id)
     if mute_role and mute_role in member.roles:
         await member.remove_roles(mute_role)
         await ctx.send(f"🔊 Unmuted {member.mention}")
     else:
         await ctx.send("ℹ️ User is not muted.")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
+@is_mod()
+async def tempban(ctx, member: discord.Member, duration: str, *, reason="No reason"):
+    seconds = parse_duration(duration)
+    if not seconds:
+        await ctx.send("❌ Duration looks like `30m`, `2h` or `7d`.")
+        return
+    if not ctx.guild.me.guild_permissions.ban_members:
+        await ctx.send("❌ I lack ban permissions.")
+        return
+    await member.ban(reason=f"{reason} ({duration})")
+    scheduler.schedule(seconds, "unban", ctx.guild.id, member.id)
+    await ctx.send(f"🔨 Banned {member.mention} for {duration} | {reason}")
+
+@bot.hybrid_command(extras={"category": "moderation"})
+@is_mod()
+async def temprole(ctx, member: discord.Member, duration: str, *, role_name: str):
+    seconds = parse_duration(duration)
+    if not seconds:
+        await ctx.send("❌ Duration looks like `30m`, `2h` or `7d`.")
+        return
+    role = discord.utils.get(ctx.guild.roles, name=role_name)
+    if not role:
+        await ctx.send(f"❌ Role '{role_name}' not found.")
+        return
+    await member.add_roles(role)
+    scheduler.schedule(seconds, "remove_role", ctx.guild.id, member.id, role.id)
+    await ctx.send(f"✅ Added {role.name} to {member.mention} for {duration}.")
+
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def purge(ctx, amount: int):
     await clear(ctx, amount)
 
 # ================= TROLL KICK =================
-@bot.command()
+@bot.hybrid_command(extras={"category": "moderation"})
 @is_mod()
 async def trollkick(ctx, member: discord.Member):
     if member == ctx.author:
@@ -646,7 +2982,7 @@ async def trollkick(ctx, member: discord.Member):
         await ctx.send("❌ Couldn't DM that user.")
 
 # ================= FUN COMMANDS (30) =================
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def meme(ctx):
     memes = [
@@ -656,31 +2992,31 @@ async def meme(ctx):
         "When the code runs without errors: 👁️👄👁️",
         "I don't always test my code, but when I do, I do it in production."
     ]
-    await ctx.send(random.choice(memes))
+    await queued_send(ctx, random.choice(memes))
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def dice(ctx, sides: int = 6):
     if sides < 2 or sides > 100:
-        await ctx.send("❌ Sides must be between 2 and 100.")
+        await queued_send(ctx, "❌ Sides must be between 2 and 100.")
         return
-    await ctx.send(f"🎲 You rolled **{random.randint(1, sides)}** (1-{sides})")
+    await queued_send(ctx, f"🎲 You rolled **{random.randint(1, sides)}** (1-{sides})")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def coinflip(ctx):
-    await ctx.send(f"🪙 **{random.choice(['Heads', 'Tails'])}**!")
+    await queued_send(ctx, f"🪙 **{random.choice(['Heads', 'Tails'])}**!")
 
-@bot.command()
+@bot.hybrid_command(aliases=["8ball"], extras={"category": "fun"})
 @is_not_blacklisted()
 async def eightball(ctx, *, question):
     answers = [
         "Yes", "No", "Maybe", "Ask again later", "Definitely", 
         "I doubt it", "Absolutely", "Never", "Signs point to yes"
     ]
-    await ctx.send(f"🎱 **{question}**\nAnswer: {random.choice(answers)}")
+    await queued_send(ctx, f"🎱 **{question}**\nAnswer: {random.choice(answers)}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def joke(ctx):
     jokes = [
@@ -689,14 +3025,14 @@ async def joke(ctx):
         "Why did the scarecrow win an award? He was outstanding in his field!",
         "What do you call a fake noodle? An impasta!"
     ]
-    await ctx.send(random.choice(jokes))
+    await queued_send(ctx, random.choice(jokes))
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def rps(ctx, choice: str):
     choices = ["rock", "paper", "scissors"]
     if choice.lower() not in choices:
-        await ctx.send("❌ Choose `rock`, `paper`, or `scissors`.")
+        await queued_send(ctx, "❌ Choose `rock`, `paper`, or `scissors`.")
         return
     bot_choice = random.choice(choices)
     result = "It's a tie!"
@@ -706,9 +3042,9 @@ async def rps(ctx, choice: str):
         result = "You win! 🎉"
     elif choice.lower() != bot_choice:
         result = "I win! 😎"
-    await ctx.send(f"🤖 I chose **{bot_choice}**.\n{result}")
+    await queued_send(ctx, f"🤖 I chose **{bot_choice}**.\n{result}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def randomfact(ctx):
     facts = [
@@ -717,9 +3053,9 @@ async def randomfact(ctx):
         "A group of flamingos is called a 'flamboyance'.",
         "Bananas are berries, but strawberries aren't."
     ]
-    await ctx.send(f"🧠 **Did you know?** {random.choice(facts)}")
+    await queued_send(ctx, f"🧠 **Did you know?** {random.choice(facts)}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def compliment(ctx, member: discord.Member = None):
     member = member or ctx.author
@@ -729,9 +3065,9 @@ async def compliment(ctx, member: discord.Member = None):
         f"Everyone loves {member.mention}! ❤️",
         f"{member.mention} has a great taste in bots! 🤖"
     ]
-    await ctx.send(random.choice(compliments))
+    await queued_send(ctx, random.choice(compliments))
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def insult(ctx, member: discord.Member = None):
     member = member or ctx.author
@@ -741,9 +3077,9 @@ async def insult(ctx, member: discord.Member = None):
         f"{member.mention}'s jokes are so bad they're good! 😂",
         f"{member.mention} is proof that even errors can be unique."
     ]
-    await ctx.send(random.choice(insults))
+    await queued_send(ctx, random.choice(insults))
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def roast(ctx, member: discord.Member):
     roasts = [
@@ -753,104 +3089,281 @@ async def roast(ctx, member: discord.Member):
         f"{member.mention}, you're the reason the gene pool needs a lifeguard.",
         f"{member.mention}, if I wanted to hear from an idiot, I'd join a call with you."
     ]
-    await ctx.send(random.choice(roasts))
+    await queued_send(ctx, random.choice(roasts))
 
 # Interaction commands
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def slap(ctx, member: discord.Member):
-    await ctx.send(f"👋 {ctx.author.mention} slapped {member.mention}!")
+    await queued_send(ctx, f"👋 {ctx.author.mention} slapped {member.mention}!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def hug(ctx, member: discord.Member):
-    await ctx.send(f"🤗 {ctx.author.mention} hugged {member.mention}!")
+    await queued_send(ctx, f"🤗 {ctx.author.mention} hugged {member.mention}!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def pat(ctx, member: discord.Member):
-    await ctx.send(f"👋 {ctx.author.mention} patted {member.mention}!")
+    await queued_send(ctx, f"👋 {ctx.author.mention} patted {member.mention}!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def kiss(ctx, member: discord.Member):
-    await ctx.send(f"😘 {ctx.author.mention} kissed {member.mention}!")
+    await queued_send(ctx, f"😘 {ctx.author.mention} kissed {member.mention}!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def cuddle(ctx, member: discord.Member):
-    await ctx.send(f"🥰 {ctx.author.mention} cuddled {member.mention}!")
+    await queued_send(ctx, f"🥰 {ctx.author.mention} cuddled {member.mention}!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def tickle(ctx, member: discord.Member):
-    await ctx.send(f"😆 {ctx.author.mention} tickled {member.mention}!")
+    await queued_send(ctx, f"😆 {ctx.author.mention} tickled {member.mention}!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def poke(ctx, member: discord.Member):
-    await ctx.send(f"👉 {ctx.author.mention} poked {member.mention}!")
+    await queued_send(ctx, f"👉 {ctx.author.mention} poked {member.mention}!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def wave(ctx, member: discord.Member = None):
     target = member.mention if member else "everyone"
-    await ctx.send(f"👋 {ctx.author.mention} waves at {target}!")
+    await queued_send(ctx, f"👋 {ctx.author.mention} waves at {target}!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def highfive(ctx, member: discord.Member):
-    await ctx.send(f"🖐️ {ctx.author.mention} high-fived {member.mention}!")
+    await queued_send(ctx, f"🖐️ {ctx.author.mention} high-fived {member.mention}!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def dance(ctx):
     dances = ["💃", "🕺", "👯", "🤸", "🧍‍♂️💃"]
-    await ctx.send(f"{ctx.author.mention} {random.choice(dances)}")
+    await queued_send(ctx, f"{ctx.author.mention} {random.choice(dances)}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def cry(ctx):
-    await ctx.send(f"{ctx.author.mention} cries... 😢")
+    await queued_send(ctx, f"{ctx.author.mention} cries... 😢")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def laugh(ctx):
     laughs = ["😂", "🤣", "😆", "😹", "💀"]
-    await ctx.send(f"{ctx.author.mention} {random.choice(laughs)}")
+    await queued_send(ctx, f"{ctx.author.mention} {random.choice(laughs)}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def think(ctx, *, thought):
-    await ctx.send(f"🤔 {ctx.author.mention} thinks: *{thought}*")
+    await queued_send(ctx, f"🤔 {ctx.author.mention} thinks: *{thought}*")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def shrug(ctx):
-    await ctx.send(f"{ctx.author.mention} ¯\\_(ツ)_/¯")
+    await queued_send(ctx, f"{ctx.author.mention} ¯\\_(ツ)_/¯")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def clap(ctx):
-    await ctx.send(f"{ctx.author.mention} 👏")
+    await queued_send(ctx, f"{ctx.author.mention} 👏")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def facepalm(ctx):
-    await ctx.send(f"{ctx.author.mention} 🤦")
+    await queued_send(ctx, f"{ctx.author.mention} 🤦")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def tableflip(ctx):
-    await ctx.send(f"{ctx.author.mention} (╯°□°）╯︵ ┻━┻")
+    await queued_send(ctx, f"{ctx.author.mention} (╯°□°）╯︵ ┻━┻")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "fun"})
 @is_not_blacklisted()
 async def unflip(ctx):
-    await ctx.send(f"{ctx.author.mention} ┬─┬ ノ( ゜-゜ノ)")
+    await queued_send(ctx, f"{ctx.author.mention} ┬─┬ ノ( ゜-゜ノ)")
+
+# ================= MATH ENGINE =================
+MATH_TIMEOUT = float(os.environ.get("MATH_TIMEOUT", 2))
+MATH_MAX_LENGTH = 300
+MATH_MAX_NODES = 200
+MATH_MAX_DIGITS = 1000
+MATH_MAX_FACTORIAL = 450  # 450! is just under MATH_MAX_DIGITS digits
+MATH_FUNCTIONS = {
+    "sqrt": math.sqrt, "cbrt": lambda x: math.copysign(abs(x) ** (1 / 3), x),
+    "sin": math.sin, "cos": math.cos, "tan": math.tan,
+    "asin": math.asin, "acos": math.acos, "atan": math.atan, "atan2": math.atan2,
+    "sinh": math.sinh, "cosh": math.cosh, "tanh": math.tanh,
+    "log": math.log, "ln": math.log, "log10": math.log10, "log2": math.log2, "exp": math.exp,
+    "abs": abs, "round": round, "floor": math.floor, "ceil": math.ceil,
+    "min": min, "max": max, "hypot": math.hypot, "gcd": math.gcd,
+    "degrees": math.degrees, "radians": math.radians, "factorial": math.factorial
+}
+MATH_CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+MATH_BINARY_OPS = {
+    ast.Add: lambda a, b: a + b, ast.Sub: lambda a, b: a - b, ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b, ast.FloorDiv: lambda a, b: a // b, ast.Mod: lambda a, b: a % b,
+    ast.Pow: lambda a, b: a ** b
+}
+MATH_ALLOWED_NODES = (
+    ast.Module, ast.Expr, ast.Assign, ast.Name, ast.Load, ast.Store, ast.Constant,
+    ast.BinOp, ast.UnaryOp, ast.UAdd, ast.USub, ast.Call, *MATH_BINARY_OPS
+)
+
+class MathError(Exception):
+    pass
+
+def digits_of(value):
+    """Approximate number of decimal digits of an int without converting it to a string"""
+    return int(abs(value).bit_length() * 0.30103) + 1
+
+@functools.lru_cache(maxsize=512)
+def compile_expression(source):
+    """Parse and statically check an expression; the validated tree is cached per source"""
+    if len(source) > MATH_MAX_LENGTH:
+        raise MathError(f"Expression is longer than {MATH_MAX_LENGTH} characters.")
+    try:
+        tree = ast.parse(source.replace("^", "**"), mode="exec")
+    except SyntaxError:
+        raise MathError("Could not parse that expression.")
+    nodes = list(ast.walk(tree))
+    if len(nodes) > MATH_MAX_NODES:
+        raise MathError("Expression is too complex.")
+    for node in nodes:
+        if not isinstance(node, MATH_ALLOWED_NODES):
+            raise MathError(f"`{type(node).__name__}` is not allowed.")
+        if isinstance(node, ast.Constant) and (type(node.value) not in (int, float) or (type(node.value) is int and digits_of(node.value) > MATH_MAX_DIGITS)):
+            raise MathError("Only plain numbers are allowed.")
+        if isinstance(node, ast.Assign) and (len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name)):
+            raise MathError("Assign to one variable at a time, like `x = 2`.")
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.func.id not in MATH_FUNCTIONS or node.keywords):
+            raise MathError("Unknown function.")
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow) and isinstance(node.right, ast.Constant) and abs(node.right.value) > 10 ** 6:
+            raise MathError("Exponent is too large.")
+    if not tree.body or not isinstance(tree.body[-1], ast.Expr):
+        raise MathError("The last statement must be an expression to show.")
+    return tree
+
+def checked_binary_op(op, left, right):
+    """Apply op, refusing integer results that would exceed MATH_MAX_DIGITS"""
+    if type(left) is int and type(right) is int:
+        if isinstance(op, ast.Pow) and right > 0 and abs(left) > 1 and right * math.log10(abs(left)) > MATH_MAX_DIGITS:
+            raise MathError(f"Result would have more than {MATH_MAX_DIGITS} digits.")
+        if isinstance(op, ast.Mult) and digits_of(left) + digits_of(right) > MATH_MAX_DIGITS + 1:
+            raise MathError(f"Result would have more than {MATH_MAX_DIGITS} digits.")
+    try:
+        result = MATH_BINARY_OPS[type(op)](left, right)
+    except ZeroDivisionError:
+        raise MathError("Division by zero.")
+    except OverflowError:
+        raise MathError("Result is too large.")
+    if isinstance(result, complex):
+        # A negative base to a fractional power, e.g. (-8) ^ 0.5
+        raise MathError("Result is not a real number.")
+    return result
+
+def evaluate_node(node, variables):
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id in variables:
+            return variables[node.id]
+        if node.id in MATH_CONSTANTS:
+            return MATH_CONSTANTS[node.id]
+        raise MathError(f"Unknown variable `{node.id}`.")
+    if isinstance(node, ast.UnaryOp):
+        value = evaluate_node(node.operand, variables)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp):
+        return checked_binary_op(node.op, evaluate_node(node.left, variables), evaluate_node(node.right, variables))
+    if isinstance(node, ast.Call):
+        args = [evaluate_node(arg, variables) for arg in node.args]
+        if node.func.id == "factorial" and args and (type(args[0]) is not int or args[0] > MATH_MAX_FACTORIAL):
+            raise MathError(f"factorial takes a whole number up to {MATH_MAX_FACTORIAL}.")
+        try:
+            return MATH_FUNCTIONS[node.func.id](*args)
+        except (ValueError, TypeError) as e:
+            raise MathError(f"`{node.func.id}`: {e}")
+        except OverflowError:
+            raise MathError("Result is too large.")
+    raise MathError("Unsupported expression.")
+
+def format_number(value):
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f"{value:.12g}"
+    return str(value)
+
+def evaluate_expression(source):
+    """Evaluate statements like `x = 2; x ^ 10 / 3` and format the last value (runs in a worker)"""
+    variables = {}
+    result = None
+    for statement in compile_expression(source).body:
+        if isinstance(statement, ast.Assign):
+            variables[statement.targets[0].id] = evaluate_node(statement.value, variables)
+        else:
+            result = evaluate_node(statement.value, variables)
+    return format_number(result)
+
+math_pool = None
+math_context = None
+
+class MathWorkerContext(type(multiprocessing.get_context("fork"))):
+    """Fork context that remembers the workers it starts, so a hard timeout can kill them"""
+    def __init__(self):
+        super().__init__()
+        self.workers = []
+
+    def Process(self, *args, **kwargs):
+        process = super().Process(*args, **kwargs)
+        self.workers = [worker for worker in self.workers if worker.is_alive()]
+        self.workers.append(process)
+        return process
+
+def reset_worker_signals():
+    """Pool initializer: a forked worker inherits the loop's SIGTERM handler and signal wakeup fd,
+    so without this a signal aimed at the worker lands in the parent and starts a drain"""
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+def get_math_pool():
+    global math_pool, math_context
+    if math_pool is None:
+        math_context = MathWorkerContext()
+        math_pool = ProcessPoolExecutor(max_workers=2, mp_context=math_context, initializer=reset_worker_signals)
+    return math_pool
+
+def reset_math_pool():
+    """Kill the workers; the only way to stop a computation that blew through its timeout"""
+    global math_pool
+    pool, math_pool = math_pool, None
+    if pool is not None:
+        # SIGKILL, since a worker stuck in a C-level bignum operation never runs a signal handler
+        for process in math_context.workers:
+            process.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+async def run_math(source):
+    compile_expression(source)  # cheap rejection without a round trip to the worker
+    future = asyncio.get_running_loop().run_in_executor(get_math_pool(), evaluate_expression, source)
+    try:
+        return await asyncio.wait_for(future, MATH_TIMEOUT)
+    except asyncio.TimeoutError:
+        reset_math_pool()
+        raise MathError(f"Gave up after {MATH_TIMEOUT:g}s.")
+    except MathError:
+        raise
+    except Exception as e:
+        logging.error(f"Math worker error: {e}")
+        reset_math_pool()
+        raise MathError("Calculator is restarting, try again.")
 
 # ================= UTILITY COMMANDS (15) =================
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def avatar(ctx, member: discord.Member = None):
     member = member or ctx.author
@@ -858,21 +3371,22 @@ async def avatar(ctx, member: discord.Member = None):
     embed.set_image(url=member.display_avatar.url)
     await ctx.send(embed=embed)
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def serverinfo(ctx):
     guild = ctx.guild
     embed = discord.Embed(title=guild.name, description=guild.description, color=0x5865F2)
     if guild.icon:
         embed.set_thumbnail(url=guild.icon.url)
-    embed.add_field(name="Owner", value=guild.owner.mention)
+    # guild.owner is only set when the owner happens to be cached
+    embed.add_field(name="Owner", value=f"<@{guild.owner_id}>")
     embed.add_field(name="Members", value=guild.member_count)
     embed.add_field(name="Channels", value=len(guild.channels))
     embed.add_field(name="Roles", value=len(guild.roles))
     embed.add_field(name="Created", value=discord.utils.format_dt(guild.created_at, style="R"))
     await ctx.send(embed=embed)
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def userinfo(ctx, member: discord.Member = None):
     member = member or ctx.author
@@ -885,75 +3399,81 @@ async def userinfo(ctx, member: discord.Member = None):
     embed.add_field(name="Roles", value=roles, inline=False)
     await ctx.send(embed=embed)
 
-@bot.command()
-@is_not_blacklisted()
-async def poll(ctx, *, question):
-    message = await ctx.send(f"📊 **{question}**\n\n👍 Yes  |  👎 No")
-    await message.add_reaction("👍")
-    await message.add_reaction("👎")
-
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def say(ctx, *, text):
     await ctx.send(text)
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def echo(ctx, channel: discord.TextChannel, *, text):
     await channel.send(text)
     await ctx.send(f"✅ Message sent to {channel.mention}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def embed(ctx, *, text):
     embed = discord.Embed(description=text, color=0x5865F2)
     await ctx.send(embed=embed)
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def ping(ctx):
     await ctx.send(f"🏓 Pong! `{round(bot.latency * 1000)}ms`")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def uptime(ctx):
     uptime_seconds = int(time.time() - BOT_START_TIME)
     uptime_str = str(timedelta(seconds=uptime_seconds))
     await ctx.send(f"⏱️ Uptime: **{uptime_str}**")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
+@is_not_blacklisted()
+async def remind(ctx, duration: str, *, text: str):
+    seconds = parse_duration(duration)
+    if not seconds:
+        await ctx.send("❌ Duration looks like `10m`, `2h` or `1d`.")
+        return
+    scheduler.schedule(seconds, "remind", ctx.channel.id, ctx.author.id, text[:1500])
+    await ctx.send(f"⏰ I'll remind you in {duration}.")
+
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def stats(ctx):
+    snapshot = stats_service.snapshot
     embed = discord.Embed(title="📊 Bot Stats", color=0x5865F2)
-    embed.add_field(name="Servers", value=len(bot.guilds))
-    embed.add_field(name="Users", value=sum(g.member_count for g in bot.guilds))
-    embed.add_field(name="Commands", value=len(bot.commands))
+    embed.add_field(name="Servers", value=snapshot["guilds"])
+    embed.add_field(name="Users", value=snapshot["members"])
+    embed.add_field(name="Channels", value=snapshot["channels"])
+    embed.add_field(name="Commands", value=snapshot["commands"])
+    embed.add_field(name="Commands run", value=snapshot["commands_run"])
     embed.add_field(name="Uptime", value=str(timedelta(seconds=int(time.time()-BOT_START_TIME))))
     await ctx.send(embed=embed)
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def invite(ctx):
     permissions = discord.Permissions(administrator=True)
     url = discord.utils.oauth_url(bot.user.id, permissions=permissions)
     await ctx.send(f"🔗 Invite me:\n{url}")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def support(ctx):
     await ctx.send("📞 Join the support server: https://discord.gg/your-invite")
 
-@bot.command()
+@bot.hybrid_command(name="math", extras={"category": "utility"})
 @is_not_blacklisted()
-async def math(ctx, *, expression):
+async def math_command(ctx, *, expression):
     try:
-        # Safe evaluation of literals only
-        result = ast.literal_eval(expression)
-        await ctx.send(f"🧮 `{expression}` = **{result}**")
-    except:
-        await ctx.send("❌ Invalid expression or unsafe operation.")
+        result = await run_math(expression)
+    except MathError as e:
+        await ctx.send(f"❌ {e}")
+        return
+    await ctx.send(f"🧮 `{expression}` = **{result}**")
 
-@bot.command()
+@bot.command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def choose(ctx, *options):
     if len(options) < 2:
@@ -961,7 +3481,7 @@ async def choose(ctx, *options):
         return
     await ctx.send(f"🤔 I choose: **{random.choice(options)}**")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
 async def flip(ctx, text: str):
     """Flip text upside down"""
@@ -970,144 +3490,610 @@ async def flip(ctx, text: str):
     flipped = text.translate(mapping)[::-1]
     await ctx.send(f"🔄 {flipped}")
 
-# ================= AI COMMANDS (15) =================
-@bot.command()
-@is_not_blacklisted()
-async def ask(ctx, *, question):
-    async with ctx.channel.typing():
-        response = await ask_groq(question)
-        await ctx.send(f"🤖 **Answer:** {response}")
+# ================= POLLS =================
+POLL_EDIT_INTERVAL = float(os.environ.get("POLL_EDIT_INTERVAL", 3))
+# Votes are written out at most this often; a drain flushes whatever is left
+POLL_SAVE_SECONDS = int(os.environ.get("POLL_SAVE_SECONDS", 60))
+POLL_MAX_OPTIONS = 10
+class Poll:
+    """Live tally of one poll; the dict in bot_data["polls"] is its persisted form"""
+    def __init__(self, poll_id, data):
+        self.poll_id = poll_id
+        self.data = data
+        self.counts = [0] * len(data["options"])
+        for index in data["votes"].values():
+            self.counts[index] += 1
+        self.dirty = False
+        self.edit_task = None
 
-@bot.command()
-@is_not_blacklisted()
-async def askai(ctx, *, question):
-    await ask(ctx, question=question)
+    def vote(self, user_id, index):
+        """Record or change a user's vote; returns False if nothing changed"""
+        previous = self.data["votes"].get(str(user_id))
+        if previous == index:
+            return False
+        if previous is not None:
+            self.counts[previous] -= 1
+        self.data["votes"][str(user_id)] = index
+        self.counts[index] += 1
+        return True
 
-@bot.command()
-@is_not_blacklisted()
-async def summary(ctx, *, text):
-    async with ctx.channel.typing():
-        response = await ask_groq(f"Summarize this: {text}")
-        await ctx.send(f"📝 **Summary:** {response}")
+    def embed(self):
+        total = sum(self.counts)
+        lines = []
+        for option, count in zip(self.data["options"], self.counts):
+            share = count / total if total else 0
+            lines.append(f"**{option}**\n`{'█' * round(share * 20):<20}` {count} ({share:.0%})")
+        if self.data["closed"]:
+            lines.append("\n🔒 **Poll closed**")
+        elif self.data["closes_at"]:
+            lines.append(f"\n⏳ Closes <t:{int(self.data['closes_at'])}:R>")
+        embed = discord.Embed(title=f"📊 {self.data['question']}", description="\n".join(lines), color=0x5865F2)
+        embed.set_footer(text=f"{total} vote{'s' if total != 1 else ''} · poll {self.poll_id}")
+        return embed
 
-@bot.command()
-@is_not_blacklisted()
-async def translate(ctx, lang: str, *, text):
-    async with ctx.channel.typing():
-        response = await ask_groq(f"Translate this to {lang}: {text}")
-        await ctx.send(f"🌍 **Translation to {lang}:** {response}")
+    def schedule_edit(self):
+        """Coalesce vote bursts into one message edit every POLL_EDIT_INTERVAL seconds"""
+        self.dirty = True
+        if self.edit_task is None:
+            self.edit_task = bot.loop.create_task(self.flush_edits())
 
-@bot.command()
-@is_not_blacklisted()
-async def define(ctx, *, word):
-    async with ctx.channel.typing():
-        response = await ask_groq(f"Define '{word}'")
-        await ctx.send(f"📖 **Definition:** {response}")
+    async def flush_edits(self):
+        global polls_dirty
+        try:
+            while self.dirty:
+                await asyncio.sleep(POLL_EDIT_INTERVAL)
+                self.dirty = False
+                await self.refresh_message()
+                # A full save on every edit would block the loop under vote load; save_polls_loop writes it
+                polls_dirty = True
+        finally:
+            self.edit_task = None
 
-@bot.command()
-@is_not_blacklisted()
-async def aijoke(ctx):
-    async with ctx.channel.typing():
-        response = await ask_groq("Tell me a funny joke")
-        await ctx.send(f"😂 **AI Joke:** {response}")
+    async def refresh_message(self, view=discord.utils.MISSING):
+        channel = bot.get_channel(self.data["channel_id"])
+        if channel is None or not self.data.get("message_id"):
+            return
+        try:
+            await channel.get_partial_message(self.data["message_id"]).edit(embed=self.embed(), view=view)
+        except discord.HTTPException as e:
+            logging.error(f"Poll {self.poll_id} edit failed: {e}")
 
-@bot.command()
-@is_not_blacklisted()
-async def aipoem(ctx, *, topic):
-    async with ctx.channel.typing():
-        response = await ask_groq(f"Write a short poem about {topic}")
-        await ctx.send(f"📜 **Poem about {topic}:**\n{response}")
+class PollButton(discord.ui.Button):
+    def __init__(self, poll_id, index, label):
+        super().__init__(
+            label=label[:80],
+            style=discord.ButtonStyle.secondary,
+            custom_id=f"poll:{poll_id}:{index}",
+            row=index // 5
+        )
+        self.poll_id = poll_id
+        self.index = index
 
-@bot.command()
-@is_not_blacklisted()
-async def aistory(ctx, *, prompt):
-    async with ctx.channel.typing():
-        response = await ask_groq(f"Write a very short story about: {prompt}")
-        await ctx.send(f"📖 **Story:** {response}")
+    async def callback(self, interaction):
+        poll = active_polls.get(self.poll_id)
+        if poll is None or poll.data["closed"]:
+            await interaction.response.send_message("🔒 This poll is closed.", ephemeral=True)
+            return
+        changed = poll.vote(interaction.user.id, self.index)
+        if changed:
+            poll.schedule_edit()
+        await interaction.response.send_message(f"🗳️ Your vote: **{poll.data['options'][self.index]}**", ephemeral=True)
 
-@bot.command()
-@is_not_blacklisted()
-async def aicode(ctx, *, description):
-    async with ctx.channel.typing():
-        response = await ask_groq(f"Generate code snippet for: {description}. Provide only code with brief explanation.")
-        await ctx.send(f"💻 **Code:**\n{response}")
+class PollView(discord.ui.View):
+    """Persistent vote buttons; re-attached on startup so polls survive restarts"""
+    def __init__(self, poll):
+        super().__init__(timeout=None)
+        for index, option in enumerate(poll.data["options"]):
+            self.add_item(PollButton(poll.poll_id, index, option))
 
-@bot.command()
-@is_not_blacklisted()
-async def aiexplain(ctx, *, concept):
-    async with ctx.channel.typing():
-        response = await ask_groq(f"Explain '{concept}' in simple terms")
-        await ctx.send(f"🔍 **Explanation:** {response}")
+active_polls = {}
+polls_dirty = False
 
-@bot.command()
-@is_not_blacklisted()
-async def aiadvice(ctx, *, topic):
-    async with ctx.channel.typing():
-        response = await ask_groq(f"Give me advice about {topic}")
-        await ctx.send(f"💡 **Advice:** {response}")
+async def close_poll(poll):
+    poll.data["closed"] = True
+    active_polls.pop(poll.poll_id, None)
+    if poll.edit_task:
+        poll.edit_task.cancel()
+    await poll.refresh_message(view=None)
+    save_data()
 
-@bot.command()
-@is_not_blacklisted()
-async def aiidea(ctx, *, category):
-    async with ctx.channel.typing():
-        response = await ask_groq(f"Give me a creative idea for {category}")
-        await ctx.send(f"💭 **Idea:** {response}")
+@scheduler.handler("close_poll")
+async def scheduled_close_poll(poll_id):
+    poll = active_polls.get(poll_id)
+    if poll is None:
+        # The job can fire before restore_polls has rebuilt active_polls, e.g. in lazy startup
+        data = bot_data.get("polls", {}).get(poll_id)
+        if data is None or data["closed"]:
+            return
+        poll = Poll(poll_id, data)
+    await close_poll(poll)
+
+@tasks.loop(seconds=POLL_SAVE_SECONDS)
+async def save_polls_loop():
+    global polls_dirty
+    if polls_dirty:
+        polls_dirty = False
+        save_data()
+
+@bot.listen("on_ready")
+async def restore_polls():
+    await state_loaded.wait()
+    if not save_polls_loop.is_running():
+        save_polls_loop.start()
+    for poll_id, data in bot_data.get("polls", {}).items():
+        if data["closed"] or poll_id in active_polls or not data.get("message_id"):
+            continue
+        poll = active_polls[poll_id] = Poll(poll_id, data)
+        bot.add_view(PollView(poll), message_id=data["message_id"])
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
-async def aifact(ctx):
-    async with ctx.channel.typing():
-        response = await ask_groq("Tell me a random interesting fact")
-        await ctx.send(f"🧠 **AI Fact:** {response}")
+async def poll(ctx, *, question):
+    """Start a poll: [duration] question | option | option ..."""
+    closes_at = None
+    first, _, rest = question.partition(" ")
+    seconds = parse_duration(first)
+    if seconds and rest:
+        closes_at = time.time() + seconds
+        question = rest
+    parts = [part.strip() for part in question.split("|") if part.strip()]
+    if not parts:
+        await ctx.send(f"❌ Usage: `{PREFIX}poll [duration] question | option | option ...`")
+        return
+    question, options = parts[0], parts[1:] or ["👍 Yes", "👎 No"]
+    if len(options) < 2 or len(options) > POLL_MAX_OPTIONS:
+        await ctx.send(f"❌ A poll needs 2-{POLL_MAX_OPTIONS} options, separated by `|`.")
+        return
+    poll_id = os.urandom(4).hex()
+    data = {
+        "channel_id": ctx.channel.id,
+        "message_id": None,
+        "question": question[:256],
+        "options": options,
+        "votes": {},
+        "closes_at": closes_at,
+        "closed": False
+    }
+    poll = Poll(poll_id, data)
+    message = await ctx.send(embed=poll.embed(), view=PollView(poll))
+    data["message_id"] = message.id
+    bot_data.setdefault("polls", {})[poll_id] = data
+    active_polls[poll_id] = poll
+    if closes_at:
+        scheduler.schedule(seconds, "close_poll", poll_id)
+    save_data()
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 @is_not_blacklisted()
-async def airiddle(ctx):
-    async with ctx.channel.typing():
-        response = await ask_groq("Give me a riddle, then provide the answer after a pause")
-        await ctx.send(f"🤔 **Riddle:** {response}")
+async def endpoll(ctx, poll_id: str):
+    """Close a poll early (mods only)"""
+    poll = active_polls.get(poll_id)
+    if poll is None or poll.data["channel_id"] != ctx.channel.id:
+        await ctx.send("❌ No open poll with that ID in this channel.")
+        return
+    if not ctx.author.guild_permissions.manage_messages and ctx.author.id != OWNER_ID:
+        await ctx.send("❌ You are not allowed to close polls.")
+        return
+    await close_poll(poll)
+    await ctx.send(f"🔒 Poll `{poll_id}` closed.")
+
+# ================= AI COMMANDS (PROMPT REGISTRY) =================
+# Every AI command is generated from this table. Entries in PROMPTS_FILE (same shape,
+# keyed by command name) override or extend it and are picked up by !reloadprompts.
+PROMPTS_FILE = os.environ.get("PROMPTS_FILE", "prompts.json")
+DEFAULT_PROMPTS = {
+    "ask": {
+        "description": "Ask the AI anything",
+        "aliases": ["askai"],
+        "args": ["question"],
+        "template": "{question}",
+        "header": "🤖 **Answer:** ",
+        "cacheable": True
+    },
+    "translate": {
+        "description": "Translate text into another language",
+        "args": ["lang", "text"],
+        "template": "Translate this to {lang}: {text}",
+        "header": "🌍 **Translation to {lang}:** ",
+        "temperature": 0.1,
+        "cacheable": True
+    },
+    "define": {
+        "description": "Define a word",
+        "args": ["word"],
+        "template": "Define '{word}' in one or two sentences.",
+        "header": "📖 **Definition:** ",
+        "max_tokens": 60,
+        "temperature": 0.2,
+        "cacheable": True,
+        "timeout": 10
+    },
+    "aijoke": {
+        "description": "Hear an AI-written joke",
+        "template": "Tell me a funny joke",
+        "header": "😂 **AI Joke:** ",
+        "max_tokens": 120,
+        "temperature": 0.9
+    },
+    "aipoem": {
+        "description": "Get a short poem about a topic",
+        "args": ["topic"],
+        "template": "Write a short poem about {topic}",
+        "header": "📜 **Poem about {topic}:**\n",
+        "temperature": 0.8
+    },
+    "aistory": {
+        "description": "Get a story about a prompt",
+        "args": ["prompt"],
+        "template": "Write a story about: {prompt}",
+        "header": "📖 **Story:** ",
+        "max_tokens": 700,
+        "temperature": 0.8,
+        "timeout": 45
+    },
+    "aicode": {
+        "description": "Generate a code snippet",
+        "args": ["description"],
+        "template": "Generate code snippet for: {description}. Provide only code with brief explanation.",
+        "header": "💻 **Code:**\n",
+        "max_tokens": 900,
+        "temperature": 0.2,
+        "timeout": 45
+    },
+    "aiexplain": {
+        "description": "Explain a concept in simple terms",
+        "args": ["concept"],
+        "template": "Explain '{concept}' in simple terms",
+        "header": "🔍 **Explanation:** ",
+        "cacheable": True
+    },
+    "aiadvice": {
+        "description": "Get advice about a topic",
+        "args": ["topic"],
+        "template": "Give me advice about {topic}",
+        "header": "💡 **Advice:** "
+    },
+    "aiidea": {
+        "description": "Get a creative idea for a category",
+        "args": ["category"],
+        "template": "Give me a creative idea for {category}",
+        "header": "💭 **Idea:** ",
+        "max_tokens": 200,
+        "temperature": 0.9
+    },
+    "aifact": {
+        "description": "Learn a random interesting fact",
+        "template": "Tell me a random interesting fact",
+        "header": "🧠 **AI Fact:** ",
+        "max_tokens": 120,
+        "temperature": 0.9
+    },
+    "airiddle": {
+        "description": "Get a riddle with its answer",
+        "template": "Give me a riddle, then provide the answer after a pause",
+        "header": "🤔 **Riddle:** ",
+        "max_tokens": 150,
+        "temperature": 0.9
+    },
+    "aiquote": {
+        "description": "Get an inspirational quote",
+        "template": "Give me an inspirational quote. Reply with only the quote and its author.",
+        "header": "✨ **Quote:** ",
+        "max_tokens": 60,
+        "temperature": 0.9,
+        "stop": ["\n\n"],
+        "timeout": 10
+    }
+}
+PROMPT_DEFAULTS = {
+    "description": "AI command",
+    "aliases": [],
+    "args": [],
+    "model": None,
+    "max_tokens": AI_PAGE_TOKENS,
+    "temperature": 0.4,
+    "stop": None,
+    "cacheable": False,
+    "timeout": AI_TIMEOUT
+}
+prompt_registry = {}
+
+def load_prompt_registry():
+    """Merge PROMPTS_FILE over the built-in table; returns name -> complete spec"""
+    specs = {name: dict(spec) for name, spec in DEFAULT_PROMPTS.items()}
+    try:
+        with open(PROMPTS_FILE, "r") as f:
+            for name, spec in json.load(f).items():
+                if spec is None:
+                    specs.pop(name, None)
+                else:
+                    specs[name] = {**specs.get(name, {}), **spec}
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.error(f"Failed to read {PROMPTS_FILE}, using built-in prompts: {e}")
+    return {name: {**PROMPT_DEFAULTS, **spec} for name, spec in specs.items()}
+
+def generation_settings(spec):
+    return {key: spec[key] for key in ("model", "max_tokens", "temperature", "stop", "timeout")}
+
+async def run_prompt(ctx, name, values):
+    """Render a registry template and send the AI answer for it"""
+    spec = prompt_registry[name]
+    cache_key = None
+    if spec["cacheable"]:
+        cache_key = (name,) + tuple(" ".join(str(values[arg]).lower().split()) for arg in spec["args"])
+    async with ctx.typing():
+        await send_ai_response(
+            ctx,
+            spec["header"].format(**{key: str(value)[:AI_HEADER_VALUE_CHARS] for key, value in values.items()}),
+            spec["template"].format(**values),
+            settings=generation_settings(spec),
+            cache_key=cache_key
+        )
+
+def build_prompt_command(name, spec):
+    """Create a hybrid command whose parameters are the template's args (the last one takes the rest)"""
+    args = spec["args"]
+
+    async def callback(ctx, *positional, **keyword):
+        values = dict(zip(args, positional))
+        values.update(keyword)
+        await run_prompt(ctx, name, values)
+
+    params = [commands.Parameter("ctx", inspect.Parameter.POSITIONAL_OR_KEYWORD)]
+    for index, arg in enumerate(args):
+        kind = inspect.Parameter.KEYWORD_ONLY if index == len(args) - 1 else inspect.Parameter.POSITIONAL_OR_KEYWORD
+        params.append(commands.Parameter(arg, kind, annotation=str))
+    callback.__signature__ = inspect.Signature(params)
+    callback.__name__ = name
+    callback = is_not_blacklisted()(callback)
+    return commands.hybrid_command(
+        name=name,
+        aliases=spec["aliases"],
+        description=spec["description"][:100],
+        help=spec["description"],
+        extras={"category": "ai"}
+    )(callback)
+
+def install_prompt_commands():
+    """(Re)register the AI commands from the prompt registry"""
+    global prompt_registry
+    for name in prompt_registry:
+        bot.remove_command(name)
+    prompt_registry = load_prompt_registry()
+    for name, spec in prompt_registry.items():
+        try:
+            bot.add_command(build_prompt_command(name, spec))
+        except Exception as e:
+            logging.error(f"Could not register AI command '{name}': {e}")
+    logging.info(f"🧩 Registered {len(prompt_registry)} AI commands from the prompt registry")
 
-@bot.command()
+install_prompt_commands()
+
+# ================= CHANNEL SUMMARIES =================
+# !summary streams channel history, cuts it into token-bounded chunks, summarizes the
+# chunks concurrently (bounded by ai_slots) and merges the partial summaries.
+SUMMARY_DEFAULT_MESSAGES = int(os.environ.get("SUMMARY_DEFAULT_MESSAGES", 200))
+SUMMARY_MAX_MESSAGES = int(os.environ.get("SUMMARY_MAX_MESSAGES", 5000))
+SUMMARY_CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", 4000))
+# Chunks end at messages whose ID hashes to 0 mod this, so boundaries stay put between
+# runs and already summarized chunks are served from the cache
+SUMMARY_BOUNDARY_EVERY = int(os.environ.get("SUMMARY_BOUNDARY_EVERY", 128))
+SUMMARY_CHUNK_PROMPT = (
+    "Summarize this part of a Discord conversation in a few short bullet points. "
+    "Keep who said what, decisions, links and open questions.\n\n{text}"
+)
+SUMMARY_REDUCE_PROMPT = (
+    "These are summaries of consecutive parts of a Discord conversation in #{channel}, "
+    "oldest first. Merge them into one concise summary with the main topics, decisions "
+    "and open questions.\n\n{text}"
+)
+SUMMARY_SETTINGS = {"model": None, "max_tokens": AI_PAGE_TOKENS, "temperature": 0.2, "stop": None, "timeout": AI_TIMEOUT}
+summary_chunk_cache = TTLCache(int(os.environ.get("SUMMARY_CACHE_SIZE", 2000)), int(os.environ.get("SUMMARY_CACHE_TTL", 86400)))
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def summary_line(message):
+    content = message.clean_content.replace("\n", " ")[:500]
+    if message.attachments:
+        content += f" [{len(message.attachments)} attachment(s)]"
+    return f"[{message.created_at:%m-%d %H:%M}] {message.author.display_name}: {content}"
+
+def is_chunk_boundary(message):
+    return zlib.crc32(str(message.id).encode()) % SUMMARY_BOUNDARY_EVERY == 0
+
+async def summarize_chunk(text):
+    summary, finish_reason = await groq_chat(
+        [{"role": "user", "content": SUMMARY_CHUNK_PROMPT.format(text=text)}],
+        max_tokens=300,
+        temperature=0.2,
+        fan_out=True
+    )
+    return summary, finish_reason
+
+class SummaryMap:
+    """Collects streamed messages into chunks and starts a summary task for each finished chunk"""
+    def __init__(self, channel_id, newest_first):
+        self.channel_id = channel_id
+        self.newest_first = newest_first
+        self.lines = []
+        self.ids = []
+        self.tokens = 0
+        self.tasks = []
+        self.reused = 0
+        self.messages = 0
+
+    def add(self, message):
+        content = summary_line(message)
+        self.messages += 1
+        # Boundaries are defined chronologically: a boundary message is the last one of its chunk
+        if self.newest_first and is_chunk_boundary(message):
+            self.close()
+        self.lines.append(content)
+        self.ids.append(message.id)
+        self.tokens += estimate_tokens(content)
+        if (not self.newest_first and is_chunk_boundary(message)) or self.tokens >= SUMMARY_CHUNK_TOKENS:
+            self.close()
+
+    def close(self):
+        if not self.lines:
+            return
+        if self.newest_first:
+            self.lines.reverse()
+            self.ids.reverse()
+        key = (self.channel_id, self.ids[0], self.ids[-1])
+        cached = summary_chunk_cache.get(key)
+        if cached:
+            self.reused += 1
+            self.tasks.append(asyncio.create_task(asyncio.sleep(0, cached)))
+        else:
+            self.tasks.append(asyncio.create_task(self.run(key, "\n".join(self.lines))))
+        self.lines, self.ids, self.tokens = [], [], 0
+
+    async def run(self, key, text):
+        summary, finish_reason = await summarize_chunk(text)
+        if finish_reason == "error":
+            raise RuntimeError(summary)
+        summary_chunk_cache.put(key, summary)
+        return summary
+
+    async def results(self):
+        """Partial summaries, oldest first"""
+        self.close()
+        try:
+            partials = await asyncio.gather(*self.tasks)
+        except BaseException:
+            self.cancel()
+            raise
+        return partials[::-1] if self.newest_first else partials
+
+    def cancel(self):
+        """Stop chunks still being summarized once the summary as a whole has failed"""
+        for task in self.tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # mark a failure as retrieved; the caller already has one to report
+
+async def reduce_partials(partials):
+    """Merge partial summaries group-wise until they fit into one final prompt"""
+    while len(partials) > 1 and sum(estimate_tokens(p) for p in partials) > SUMMARY_CHUNK_TOKENS:
+        groups, group, tokens = [], [], 0
+        for partial in partials:
+            if group and tokens + estimate_tokens(partial) > SUMMARY_CHUNK_TOKENS:
+                groups.append(group)
+                group, tokens = [], 0
+            group.append(partial)
+            tokens += estimate_tokens(partial)
+        groups.append(group)
+        merged = await asyncio.gather(*(summarize_chunk("\n\n".join(g)) for g in groups))
+        if any(finish_reason == "error" for _, finish_reason in merged):
+            raise RuntimeError(next(text for text, finish_reason in merged if finish_reason == "error"))
+        partials = [text for text, _ in merged]
+    return partials
+
+@bot.hybrid_command(extras={"category": "ai"})
 @is_not_blacklisted()
-async def aiquote(ctx):
-    async with ctx.channel.typing():
-        response = await ask_groq("Give me an inspirational quote")
-        await ctx.send(f"✨ **Quote:** {response}")
+async def summary(ctx, channel: Optional[discord.TextChannel] = None, *, scope: str = None):
+    """Summarize a channel: [#channel] [last N messages | since 2h], or summarize pasted text"""
+    if channel is None and scope and not scope.isdigit() and parse_duration(scope.removeprefix("since ").strip()) is None:
+        # Anything that is not a channel, count or duration is text to summarize
+        async with ctx.typing():
+            await send_ai_response(
+                ctx,
+                "📝 **Summary:** ",
+                f"Summarize this: {scope}",
+                settings=SUMMARY_SETTINGS,
+                cache_key=("summary", " ".join(scope.lower().split()))
+            )
+        return
+    channel = channel or ctx.channel
+    if not channel.permissions_for(ctx.author).read_message_history:
+        await ctx.send("❌ You can't read the history of that channel.")
+        return
+    limit, after = SUMMARY_DEFAULT_MESSAGES, None
+    if scope and scope.isdigit():
+        limit = min(int(scope), SUMMARY_MAX_MESSAGES)
+    elif scope:
+        seconds = parse_duration(scope.removeprefix("since ").strip())
+        if seconds is None:
+            await ctx.send("❌ Use a message count like `500` or a time like `since 2h`.")
+            return
+        limit, after = SUMMARY_MAX_MESSAGES, discord.utils.utcnow() - timedelta(seconds=seconds)
+    started = time.perf_counter()
+    async with ctx.typing():
+        # history() pages lazily, so chunks are being summarized while older pages still load
+        mapper = SummaryMap(channel.id, newest_first=after is None)
+        first_id = last_id = None
+        try:
+            async for message in channel.history(limit=limit, after=after):
+                if not message.content and not message.attachments:
+                    continue
+                first_id = message.id if first_id is None else min(first_id, message.id)
+                last_id = message.id if last_id is None else max(last_id, message.id)
+                mapper.add(message)
+            if first_id is None:
+                await ctx.send(f"📭 No messages to summarize in {channel.mention}.")
+                return
+            partials = await reduce_partials(await mapper.results())
+        except RuntimeError as e:
+            await ctx.send(str(e))
+            return
+        finally:
+            # A failed history page or a cancelled command must not leave chunks running
+            mapper.cancel()
+        logging.info(
+            f"📝 Summarized {mapper.messages} messages of #{channel.name} in {len(mapper.tasks)} chunks "
+            f"({mapper.reused} cached)",
+            extra={"latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+        )
+        await send_ai_response(
+            ctx,
+            f"📝 **Summary of {channel.mention}** ({mapper.messages} messages): ",
+            SUMMARY_REDUCE_PROMPT.format(channel=channel.name, text="\n\n".join(partials)),
+            settings=SUMMARY_SETTINGS,
+            cache_key=("channel_summary", channel.id, first_id, last_id)
+        )
 
 # ================= ECONOMY (MOCK) (5) =================
-@bot.command()
+@bot.hybrid_command(extras={"category": "economy"})
 @is_not_blacklisted()
 async def level(ctx, member: discord.Member = None):
     member = member or ctx.author
     await ctx.send(f"📊 {member.mention} is level **{random.randint(1, 20)}**!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "economy"})
 @is_not_blacklisted()
 async def rank(ctx, member: discord.Member = None):
     member = member or ctx.author
     await ctx.send(f"🏆 {member.mention} is rank **#{random.randint(1, 100)}**!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "economy"})
 @is_not_blacklisted()
 async def leaderboard(ctx):
-    members = random.sample([m for m in ctx.guild.members if not m.bot], min(5, len(ctx.guild.members)))
+    async with ctx.typing():
+        humans = [m for m in await get_guild_members(ctx.guild) if not m.bot]
+    members = random.sample(humans, min(5, len(humans)))
     lines = []
     for i, m in enumerate(members, 1):
         lines.append(f"{i}. {m.mention} - {random.randint(100, 5000)} XP")
     await ctx.send("📈 **Leaderboard**\n" + "\n".join(lines))
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "economy"})
 @is_not_blacklisted()
 async def daily(ctx):
     await ctx.send(f"✅ {ctx.author.mention}, you claimed **{random.randint(50, 200)}** coins!")
 
-@bot.command()
+@bot.hybrid_command(extras={"category": "economy"})
 @is_not_blacklisted()
 async def rep(ctx, member: discord.Member):
     await ctx.send(f"⭐ {ctx.author.mention} gave reputation to {member.mention}!")
 
 # ================= WHITELIST/BLACKLIST (OWNER ONLY) =================
-@bot.command()
+
+@bot.command(extras={"category": "owner"})
 @is_owner()
 async def whitelist(ctx, action: str, member: discord.Member):
     if action.lower() in ["add", "+"]:
@@ -1127,7 +4113,7 @@ async def whitelist(ctx, action: str, member: discord.Member):
     else:
         await ctx.send("❌ Use `add` or `remove`.")
 
-@bot.command()
+@bot.command(extras={"category": "owner"})
 @is_owner()
 async def blacklist(ctx, action: str, member: discord.Member):
     if action.lower() in ["add", "+"]:
@@ -1147,7 +4133,7 @@ async def blacklist(ctx, action: str, member: discord.Member):
     else:
         await ctx.send("❌ Use `add` or `remove`.")
 
-@bot.command()
+@bot.command(extras={"category": "owner"})
 @is_owner()
 async def showlists(ctx):
     embed = discord.Embed(title="📋 Permission Lists", color=0x5865F2)
@@ -1157,55 +4143,519 @@ async def showlists(ctx):
     embed.add_field(name=f"❌ Blacklist ({len(bl)})", value="\n".join(bl) if bl else "Empty", inline=False)
     await ctx.send(embed=embed)
 
+@bot.command(extras={"category": "owner"})
+@is_owner()
+async def sync(ctx):
+    """Force a slash command tree sync"""
+    await sync_command_tree(force=True)
+    await ctx.send("🌲 Slash commands synced.")
+
+@bot.command(extras={"category": "owner"})
+@is_owner()
+async def reloadprompts(ctx):
+    """Reload AI command templates from the prompt registry file"""
+    install_prompt_commands()
+    ai_response_cache.entries.clear()
+    synced = await sync_command_tree()
+    await ctx.send(f"🧩 Reloaded {len(prompt_registry)} AI commands." + (" Slash commands synced." if synced else ""))
+
+@bot.command(extras={"category": "owner"})
+@is_owner()
+async def usage(ctx, scope: str = "command", limit: int = 10):
+    """Show AI token usage by user, guild or command"""
+    if scope not in UsageTracker.SCOPES:
+        await ctx.send(f"❌ Scope must be one of: {', '.join(UsageTracker.SCOPES)}")
+        return
+    embed = discord.Embed(title=f"🪙 AI usage by {scope}", color=0x5865F2)
+    for key, entry in usage_tracker.top(scope, limit):
+        avg_latency = entry["latency_ms"] / entry["calls"] if entry["calls"] else 0
+        who = f"<@{key}> · " if scope == "user" else ""
+        embed.add_field(
+            name=key,
+            value=f"{who}Today: **{entry['daily_tokens']}** · Month: **{entry['monthly_tokens']}**\n"
+                  f"{entry['calls']} calls · {avg_latency:.0f}ms avg",
+            inline=False
+        )
+    if not embed.fields:
+        embed.description = "No AI usage recorded yet."
+    await ctx.send(embed=embed)
+
+@bot.command(extras={"category": "owner"})
+@is_owner()
+async def loglevel(ctx, level: str = None, logger_name: str = None):
+    """Show or change a logger's level at runtime (root logger by default)"""
+    logger = logging.getLogger(logger_name)
+    if level is None:
+        await ctx.send(f"📜 `{logger_name or 'root'}` logs at **{logging.getLevelName(logger.getEffectiveLevel())}**.")
+        return
+    level = level.upper()
+    if level not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+        await ctx.send("❌ Level must be DEBUG, INFO, WARNING, ERROR or CRITICAL.")
+        return
+    logger.setLevel(level)
+    await ctx.send(f"📜 `{logger_name or 'root'}` now logs at **{level}**.")
+
+@bot.command(extras={"category": "owner"})
+@is_owner()
+async def looplag(ctx):
+    """Show event-loop lag and the most recent blocking call"""
+    m = loop_monitor.metrics()
+    embed = discord.Embed(title="🐢 Event loop lag", color=0x5865F2)
+    embed.add_field(name="Now", value=f"{m['lag_ms']:.0f}ms")
+    embed.add_field(name="p50 / p99", value=f"{m['p50_ms']:.0f}ms / {m['p99_ms']:.0f}ms")
+    embed.add_field(name="Max", value=f"{m['max_ms']:.0f}ms")
+    embed.add_field(name="Stalls", value=f"{m['stalls']} over {m['threshold_ms']:.0f}ms")
+    if m["recent_stalls"]:
+        stall = m["recent_stalls"][-1]
+        stack = "\n".join(stall["stack"])[-900:]
+        embed.add_field(name=f"Last stall · {stall['blocked_ms']:.0f}ms at {stall['at']}", value=f"```{stack}```", inline=False)
+    if m["slow_callbacks"]:
+        embed.add_field(
+            name="Slow callbacks",
+            value="\n".join(f"`{cb['seconds']}s` {cb['callback'][:80]}" for cb in m["slow_callbacks"][-5:]),
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+# ================= MEMORY PROFILING =================
+# Subsystems register a size report and optionally a trim function in a tier.
+# Above MEMORY_SOFT_LIMIT_MB of RSS the cheapest tier runs first; each cooldown
+# that passes still over the limit adds the next tier, before the VM's OOM killer steps in.
+MEMORY_SOFT_LIMIT_MB = float(os.environ.get("MEMORY_SOFT_LIMIT_MB", 0))
+MEMORY_CHECK_SECONDS = int(os.environ.get("MEMORY_CHECK_SECONDS", 30))
+# Trimming stops escalating once RSS falls under this share of the soft limit
+MEMORY_LOW_WATER = float(os.environ.get("MEMORY_LOW_WATER", 0.9))
+MEMORY_TRIM_COOLDOWN = float(os.environ.get("MEMORY_TRIM_COOLDOWN", 300))
+# 1: derived caches that refill on demand, 2: discord's message cache, 3: user-visible history
+MEMORY_TRIM_TIERS = 3
+TRACEMALLOC_FRAMES = int(os.environ.get("TRACEMALLOC_FRAMES", 10))
+# Required as a bearer token (or ?token=) for /memory, /usage and /loop; they are off without it
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+memory_subsystems = {}
+
+def register_memory_subsystem(name, report, trim=None, tier=1):
+    """report() returns a dict of counts/sizes; trim() frees what it can and is optional"""
+    memory_subsystems[name] = (report, trim, tier)
+
+def memory_report():
+    report = {"rss_mb": round(rss_mb(), 1), "soft_limit_mb": MEMORY_SOFT_LIMIT_MB or None, "subsystems": {}}
+    for name, (size, _, _) in list(memory_subsystems.items()):
+        try:
+            report["subsystems"][name] = size()
+        except Exception as e:
+            report["subsystems"][name] = {"error": str(e)}
+    return report
+
+def trim_memory(tier=MEMORY_TRIM_TIERS):
+    """Run the registered trim functions up to tier; returns the names that were trimmed"""
+    trimmed = []
+    for name, (_, trim, trim_tier) in list(memory_subsystems.items()):
+        if trim is not None and trim_tier <= tier:
+            trim()
+            trimmed.append(name)
+    gc.collect()
+    return trimmed
+
+class MemoryProfiler:
+    """tracemalloc on demand: a baseline snapshot to diff against, and top allocation sites"""
+    def __init__(self):
+        self.baseline = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        return "tracemalloc started"
+
+    def stop(self):
+        tracemalloc.stop()
+        self.baseline = None
+        return "tracemalloc stopped"
+
+    def snapshot(self):
+        if not tracemalloc.is_tracing():
+            return "tracemalloc is not running, start it first"
+        self.baseline = tracemalloc.take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        return f"baseline taken: {traced / 1048576:.1f} MB traced, {peak / 1048576:.1f} MB peak"
+
+    def top(self, limit=10):
+        if not tracemalloc.is_tracing():
+            return ["tracemalloc is not running, start it first"]
+        stats = tracemalloc.take_snapshot().statistics("lineno")[:limit]
+        return [f"{stat.size / 1024:.0f} KiB in {stat.count} blocks at {stat.traceback[0]}" for stat in stats]
+
+    def diff(self, limit=10):
+        if self.baseline is None or not tracemalloc.is_tracing():
+            return ["no baseline, take a snapshot first"]
+        stats = tracemalloc.take_snapshot().compare_to(self.baseline, "lineno")[:limit]
+        return [f"{stat.size_diff / 1024:+.0f} KiB ({stat.count_diff:+d} blocks) at {stat.traceback[0]}" for stat in stats]
+
+    def run(self, action, limit=10):
+        """Dispatch a command/endpoint action; returns JSON-able output"""
+        if action == "start":
+            return self.start()
+        if action == "stop":
+            return self.stop()
+        if action == "snapshot":
+            return self.snapshot()
+        if action == "diff":
+            return self.diff(limit)
+        if action == "top":
+            return self.top(limit)
+        if action == "trim":
+            return {"trimmed": trim_memory(), "rss_mb": round(rss_mb(), 1)}
+        return memory_report()
+
+memory_profiler = MemoryProfiler()
+
+def discord_cache_sizes():
+    return {
+        "guilds": len(bot.guilds),
+        "members": sum(len(g.members) for g in bot.guilds),
+        "users": len(bot.users),
+        "messages": len(bot.cached_messages)
+    }
+
+def trim_discord_messages():
+    # discord.py keeps cached messages in a bounded deque; they are only needed for edit/delete events
+    messages = getattr(bot._connection, "_messages", None)
+    if messages is not None:
+        messages.clear()
+
+def bot_data_sizes():
+    return {section: {"entries": len(value) if hasattr(value, "__len__") else 1, "json_bytes": len(json.dumps(value, default=str))}
+            for section, value in list(bot_data.items())}
+
+def ttl_cache_report(cache):
+    return lambda: {"entries": len(cache), "max_entries": cache.maxsize}
+
+register_memory_subsystem("discord_cache", discord_cache_sizes, trim_discord_messages, tier=2)
+register_memory_subsystem("bot_data", bot_data_sizes)
+register_memory_subsystem("ai_response_cache", ttl_cache_report(ai_response_cache), ai_response_cache.trim)
+register_memory_subsystem("summary_chunk_cache", ttl_cache_report(summary_chunk_cache), summary_chunk_cache.trim)
+register_memory_subsystem("answer_reuse", lambda: {"channels": len(answer_reuse.channels)}, answer_reuse.channels.clear)
+register_memory_subsystem("math_cache", lambda: {"entries": compile_expression.cache_info().currsize}, compile_expression.cache_clear)
+register_memory_subsystem("content_filter", lambda: {"guilds": len(guild_filters), "trie_nodes": sum(len(f.automaton.goto) for f in list(guild_filters.values()))})
+register_memory_subsystem("outbound", lambda: {"queued": outbound.depth(), "channels": len(outbound.queues)})
+register_memory_subsystem("scheduler", lambda: {"jobs": len(scheduler.heap)})
+register_memory_subsystem("ai_usage", lambda: {scope: len(entries) for scope, entries in usage_tracker.counters.items()})
+
+class MemoryGuard:
+    """Trims once per breach and escalates a tier per cooldown, instead of clearing everything every check"""
+    def __init__(self):
+        self.tier = 0
+        self.last_trim = None
+
+    def check(self, rss):
+        if rss < MEMORY_SOFT_LIMIT_MB * MEMORY_LOW_WATER:
+            if self.tier:
+                logging.info(f"🧠 RSS {rss:.0f} MB back under {MEMORY_LOW_WATER:.0%} of the soft limit")
+            self.tier = 0
+            return None
+        if rss <= MEMORY_SOFT_LIMIT_MB:
+            return None
+        now = time.monotonic()
+        if self.tier and now - self.last_trim < MEMORY_TRIM_COOLDOWN:
+            return None
+        self.tier = min(self.tier + 1, MEMORY_TRIM_TIERS)
+        self.last_trim = now
+        return trim_memory(self.tier)
+
+memory_guard = MemoryGuard()
+
+@tasks.loop(seconds=MEMORY_CHECK_SECONDS)
+async def check_memory():
+    rss = rss_mb()
+    trimmed = memory_guard.check(rss)
+    if trimmed is not None:
+        logging.warning(f"🧠 RSS {rss:.0f} MB over soft limit {MEMORY_SOFT_LIMIT_MB:.0f} MB, tier {memory_guard.tier} trimmed {', '.join(trimmed) or 'nothing'}: now {rss_mb():.0f} MB")
+
+@bot.listen("on_ready")
+async def start_memory_check():
+    if MEMORY_SOFT_LIMIT_MB and not check_memory.is_running():
+        check_memory.start()
+
+@bot.command(extras={"category": "owner"})
+@is_owner()
+async def memory(ctx, action: str = "report", limit: int = 10):
+    """Memory report, or tracemalloc start/stop/snapshot/diff/top, or trim"""
+    if action in ("snapshot", "diff", "top"):
+        # Snapshots walk every traced block, which takes long enough to stall the loop
+        output = await asyncio.to_thread(memory_profiler.run, action, limit)
+    else:
+        output = memory_profiler.run(action, limit)
+    if isinstance(output, str):
+        await ctx.send(f"🧠 {output}")
+        return
+    if isinstance(output, list):
+        await ctx.send("🧠 ```" + ("\n".join(output) or "nothing to show")[:1900] + "```")
+        return
+    if action == "trim":
+        await ctx.send(f"🧠 Trimmed {', '.join(output['trimmed'])}. RSS now {output['rss_mb']} MB.")
+        return
+    limit_text = f" / soft limit {output['soft_limit_mb']:.0f} MB" if output["soft_limit_mb"] else ""
+    embed = discord.Embed(title="🧠 Memory", description=f"RSS **{output['rss_mb']} MB**{limit_text}", color=0x5865F2)
+    for name, sizes in output["subsystems"].items():
+        if name == "bot_data":
+            value = "\n".join(f"{section}: {s['entries']} · {s['json_bytes'] / 1024:.1f} KiB" for section, s in sizes.items())
+        else:
+            value = " · ".join(f"{key} {value}" for key, value in sizes.items())
+        embed.add_field(name=name, value=value[:1024] or "empty", inline=name != "bot_data")
+    await ctx.send(embed=embed)
+
+# ================= SNIPE LOG =================
+# Recently seen messages are kept as compact records in small per-channel rings, so
+# deleted and edited messages can be recalled without a large discord.py message cache.
+# Channels are kept in LRU order and the least recently active ones are dropped once
+# the whole log goes over SNIPE_BUDGET_BYTES.
+SNIPE_RECENT_PER_CHANNEL = int(os.environ.get("SNIPE_RECENT_PER_CHANNEL", 50))
+SNIPE_PER_CHANNEL = int(os.environ.get("SNIPE_PER_CHANNEL", 10))
+SNIPE_CONTENT_CHARS = int(os.environ.get("SNIPE_CONTENT_CHARS", 300))
+SNIPE_BUDGET_BYTES = int(os.environ.get("SNIPE_BUDGET_BYTES", 2 * 1024 * 1024))
+
+class SnipeRecord:
+    __slots__ = ("message_id", "author_id", "content", "after", "at")
+
+    def __init__(self, message_id, author_id, content, at, after=None):
+        self.message_id = message_id
+        self.author_id = author_id
+        self.content = content
+        self.after = after
+        self.at = at
+
+    def size(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.content) + (sys.getsizeof(self.after) if self.after else 0)
+
+class ChannelSnipes:
+    __slots__ = ("recent", "deleted", "edited", "bytes")
+
+    def __init__(self):
+        self.recent = deque(maxlen=SNIPE_RECENT_PER_CHANNEL)
+        self.deleted = deque(maxlen=SNIPE_PER_CHANNEL)
+        self.edited = deque(maxlen=SNIPE_PER_CHANNEL)
+        self.bytes = 0
+
+    def push(self, ring, record):
+        """Append to a ring; returns the change in bytes, counting whatever fell off the end"""
+        delta = record.size()
+        if len(ring) == ring.maxlen:
+            delta -= ring[0].size()
+        ring.append(record)
+        self.bytes += delta
+        return delta
+
+    def find_recent(self, message_id):
+        for record in self.recent:
+            if record.message_id == message_id:
+                return record
+        return None
+
+class SnipeLog:
+    def __init__(self, budget):
+        self.budget = budget
+        self.channels = OrderedDict()
+        self.bytes = 0
+        self.evicted_channels = 0
+
+    def channel(self, channel_id):
+        snipes = self.channels.get(channel_id)
+        if snipes is None:
+            snipes = self.channels[channel_id] = ChannelSnipes()
+        self.channels.move_to_end(channel_id)
+        return snipes
+
+    def add(self, snipes, ring, record):
+        self.bytes += snipes.push(ring, record)
+        while self.bytes > self.budget and len(self.channels) > 1:
+            _, idle = self.channels.popitem(last=False)
+            self.bytes -= idle.bytes
+            self.evicted_channels += 1
+
+    def remember(self, message):
+        if not message.content:
+            return
+        snipes = self.channel(message.channel.id)
+        record = SnipeRecord(message.id, message.author.id, message.content[:SNIPE_CONTENT_CHARS], int(message.created_at.timestamp()))
+        self.add(snipes, snipes.recent, record)
+
+    def deleted(self, channel_id, message_id):
+        snipes = self.channels.get(channel_id)
+        record = snipes and snipes.find_recent(message_id)
+        if record:
+            self.channels.move_to_end(channel_id)
+            self.add(snipes, snipes.deleted, SnipeRecord(message_id, record.author_id, record.content, int(time.time())))
+
+    def edited(self, channel_id, message_id, content):
+        snipes = self.channels.get(channel_id)
+        record = snipes and snipes.find_recent(message_id)
+        if not record or content is None or content[:SNIPE_CONTENT_CHARS] == record.content:
+            return
+        self.channels.move_to_end(channel_id)
+        after = content[:SNIPE_CONTENT_CHARS]
+        self.add(snipes, snipes.edited, SnipeRecord(message_id, record.author_id, record.content, int(time.time()), after))
+        # Later edits should diff against this version
+        delta = sys.getsizeof(after) - sys.getsizeof(record.content)
+        snipes.bytes += delta
+        self.bytes += delta
+        record.content = after
+
+    def latest(self, channel_id, kind, index=1):
+        snipes = self.channels.get(channel_id)
+        ring = getattr(snipes, kind) if snipes else ()
+        return ring[-index] if 0 < index <= len(ring) else None
+
+    def clear(self):
+        self.channels.clear()
+        self.bytes = 0
+
+    def metrics(self):
+        return {
+            "channels": len(self.channels),
+            "records": sum(len(s.recent) + len(s.deleted) + len(s.edited) for s in list(self.channels.values())),
+            "bytes": self.bytes,
+            "budget_bytes": self.budget,
+            "evicted_channels": self.evicted_channels
+        }
+
+snipe_log = SnipeLog(SNIPE_BUDGET_BYTES)
+# Snipes are what users came for, so they only go once cheaper trims have not helped
+register_memory_subsystem("snipe_log", snipe_log.metrics, snipe_log.clear, tier=MEMORY_TRIM_TIERS)
+
+@bot.listen()
+async def on_raw_message_delete(payload):
+    snipe_log.deleted(payload.channel_id, payload.message_id)
+
+@bot.listen()
+async def on_raw_message_edit(payload):
+    snipe_log.edited(payload.channel_id, payload.message_id, payload.data.get("content"))
+
+async def send_snipe(ctx, kind, index):
+    record = snipe_log.latest(ctx.channel.id, kind, index)
+    if record is None:
+        await ctx.send("🔍 Nothing to snipe here.")
+        return
+    if kind == "deleted":
+        embed = discord.Embed(description=record.content, color=0xED4245)
+        embed.add_field(name="Deleted", value=f"<t:{record.at}:R> · by <@{record.author_id}>")
+    else:
+        embed = discord.Embed(color=0xFEE75C)
+        embed.add_field(name="Before", value=record.content[:1024], inline=False)
+        embed.add_field(name="After", value=record.after[:1024], inline=False)
+        embed.add_field(name="Edited", value=f"<t:{record.at}:R> · by <@{record.author_id}>")
+    await ctx.send(embed=embed, allowed_mentions=discord.AllowedMentions.none())
+
+@bot.hybrid_command(extras={"category": "moderation"})
+@is_mod()
+async def snipe(ctx, index: int = 1):
+    """Show a recently deleted message in this channel (1 = latest)"""
+    await send_snipe(ctx, "deleted", index)
+
+@bot.hybrid_command(extras={"category": "moderation"})
+@is_mod()
+async def editsnipe(ctx, index: int = 1):
+    """Show a recently edited message in this channel, before and after"""
+    await send_snipe(ctx, "edited", index)
+
 # ================= HELP COMMAND =================
-@bot.command()
+@bot.hybrid_command(extras={"category": "utility"})
 async def help(ctx, command: str = None):
-    if command:
-        cmd = bot.get_command(command)
-        if not cmd:
-            await ctx.send(f"❌ Command `{command}` not found.")
+    """Show all commands, one category, or one command"""
+    embed = command_catalog.help_embed(command)
+    if embed is None:
+        await ctx.send(f"❌ Command `{command}` not found.")
+        return
+    await ctx.send(embed=embed)
+
+# ================= GRACEFUL SHUTDOWN =================
+# On SIGTERM/SIGINT: refuse new commands, give in-flight work up to DRAIN_DEADLINE seconds,
+# flush all pending state, snapshot the AI caches for the next instance, then disconnect.
+DRAIN_DEADLINE = float(os.environ.get("DRAIN_DEADLINE", 20))
+CACHE_SNAPSHOT_FILE = os.environ.get("CACHE_SNAPSHOT_FILE", "cache_snapshot.json")
+SNAPSHOT_CACHES = {"ai_responses": ai_response_cache, "summary_chunks": summary_chunk_cache}
+
+class Draining(commands.CheckFailure):
+    pass
+
+class Drainer:
+    def __init__(self):
+        self.draining = False
+        self.inflight = 0
+
+    def pending(self):
+        return {"commands": self.inflight, "ai_calls": ai_pending, "outbound": outbound.depth()}
+
+    async def drain(self, reason):
+        if self.draining:
             return
-        embed = discord.Embed(title=f"Help: {PREFIX}{cmd.name}", description=cmd.help or "No description.", color=0x5865F2)
-        await ctx.send(embed=embed)
+        self.draining = True
+        started = time.monotonic()
+        logging.info(f"🔄 {reason}: draining {self.pending()}")
+        while any(self.pending().values()) and time.monotonic() - started < DRAIN_DEADLINE:
+            await asyncio.sleep(0.2)
+        if any(self.pending().values()):
+            logging.warning(f"⌛ Drain deadline hit, abandoning {self.pending()}")
+        flush_state()
+        logging.info(f"👋 Drained in {time.monotonic() - started:.1f}s, disconnecting")
+        await bot.close()
+
+drainer = Drainer()
+
+def flush_state():
+    """Write everything that is normally flushed periodically, plus the cache snapshot"""
+    # Subsystems that never finished restoring their state must not overwrite it on disk
+    if flush_usage_loop.is_running():
+        bot_data["ai_usage"] = usage_tracker.export()
+        usage_tracker.dirty = False
+    if scheduler.task is not None:
+        write_schedule(scheduler.export())
+        scheduler.dirty = False
+    save_data()
+    snapshot = {"saved_at": time.time(), "caches": {name: cache.export() for name, cache in SNAPSHOT_CACHES.items()}}
+    try:
+        write_json_atomic(CACHE_SNAPSHOT_FILE, snapshot, separators=(",", ":"))
+    except Exception as e:
+        logging.error(f"Cache snapshot error: {e}")
+
+def read_cache_snapshot():
+    try:
+        with open(CACHE_SNAPSHOT_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.error(f"Could not read {CACHE_SNAPSHOT_FILE}: {e}")
+        return None
+
+async def warm_caches():
+    """Load the previous instance's cache snapshot so a deploy starts with warm caches"""
+    snapshot = await asyncio.to_thread(read_cache_snapshot)
+    if not snapshot:
         return
+    elapsed = time.time() - snapshot["saved_at"]
+    for name, items in snapshot["caches"].items():
+        if name in SNAPSHOT_CACHES:
+            SNAPSHOT_CACHES[name].restore(items, elapsed)
+    logging.info(f"♨️ Warmed caches from snapshot: " + ", ".join(f"{name}={len(cache)}" for name, cache in SNAPSHOT_CACHES.items()))
 
-    embed = discord.Embed(
-        title="🤖 DeepSeek Bot Help",
-        description=f"Prefix: `{PREFIX}` | Owner: <@{OWNER_ID}>",
-        color=0x5865F2
-    )
-    embed.add_field(
-        name="🛡️ Moderation (15)",
-        value="`kick`, `ban`, `timeout`, `untimeout`, `warn`, `warnings`, `clear`/`purge`, `lock`, `unlock`, `slowmode`, `nick`, `role`, `mute`, `unmute`, `trollkick`",
-        inline=False
-    )
-    embed.add_field(
-        name="🎉 Fun (30)",
-        value="`meme`, `dice`, `coinflip`, `8ball`, `joke`, `rps`, `randomfact`, `compliment`, `insult`, `roast`, `slap`, `hug`, `pat`, `kiss`, `cuddle`, `tickle`, `poke`, `wave`, `highfive`, `dance`, `cry`, `laugh`, `think`, `shrug`, `clap`, `facepalm`, `tableflip`, `unflip`",
-        inline=False
-    )
-    embed.add_field(
-        name="🛠️ Utility (15)",
-        value="`avatar`, `serverinfo`, `userinfo`, `poll`, `say`, `echo`, `embed`, `ping`, `uptime`, `stats`, `invite`, `support`, `math`, `choose`, `flip`",
-        inline=False
-    )
-    embed.add_field(
-        name="🤖 AI (15)",
-        value="`ask`/`askai`, `summary`, `translate`, `define`, `aijoke`, `aipoem`, `aistory`, `aicode`, `aiexplain`, `aiadvice`, `aiidea`, `aifact`, `airiddle`, `aiquote`",
-        inline=False
-    )
-    embed.add_field(
-        name="💰 Economy (Mock) (5)",
-        value="`level`, `rank`, `leaderboard`, `daily`, `rep`",
-        inline=False
-    )
-    embed.add_field(
-        name="⚙️ Admin (Owner Only)",
-        value="`whitelist`, `blacklist`, `showlists`",
-        inline=False
-    )
-    embed.set_footer(text=f"Total commands: {len(bot.commands)}")
-    await ctx.send(embed=embed)
+@bot.check
+async def refuse_while_draining(ctx):
+    if drainer.draining:
+        raise Draining("draining")
+    return True
+
+@bot.listen()
+async def on_command(ctx):
+    drainer.inflight += 1
+
+@bot.listen("on_command_completion")
+async def command_finished(ctx):
+    drainer.inflight -= 1
+
+@bot.listen("on_command_error")
+async def command_failed(ctx, error):
+    # CommandNotFound is raised without on_command having been dispatched
+    if not isinstance(error, commands.CommandNotFound):
+        drainer.inflight -= 1
 
 # ================= MAIN =================
 if __name__ == "__main__":
@@ -1219,7 +4669,8 @@ if __name__ == "__main__":
         sys.exit(1)
 
     try:
-        bot.run(TOKEN)
+        # Our queue handler on the root logger already covers discord.py's loggers
+        bot.run(TOKEN, log_handler=None)
     except Exception as e:
         logging.error(f"❌ Bot crashed: {e}")
         sys.exit(1)
@@ -0,0 +1,574 @@
+import asyncio
+
+import pytest
+
+from bot import split_pages
+
+
+def test_split_pages_short_text_is_one_page():
+    assert split_pages("short answer", 100) == ["short answer"]
+
+
+def test_split_pages_respects_limit_and_keeps_words():
+    text = " ".join(f"word{i}" for i in range(500))
+    pages = split_pages(text, 120)
+    assert all(len(page) <= 120 for page in pages)
+    assert " ".join(pages).split() == text.split()
+
+
+def test_split_pages_prefers_line_breaks():
+    text = "a" * 60 + "\n" + "b" * 60
+    assert split_pages(text, 100) == ["a" * 60, "b" * 60]
+
+
+def test_split_pages_hard_cuts_unbroken_text():
+    pages = split_pages("x" * 250, 100)
+    assert pages == ["x" * 100, "x" * 100, "x" * 50]
+
+
+def test_split_pages_tiny_limit_terminates():
+    pages = split_pages("a b\nc d", 1)
+    assert "".join(pages).replace(" ", "").replace("\n", "") == "abcd"
+
+
+@pytest.mark.parametrize("limit", [0, -30])
+def test_split_pages_rejects_non_positive_limit(limit):
+    with pytest.raises(ValueError):
+        split_pages("some answer text here", limit)
+
+
+def test_scheduler_keyed_job_is_superseded():
+    from bot import Scheduler
+    scheduler = Scheduler()
+    scheduler.schedule(3600, "unlock", 42)
+    scheduler.schedule(60, "unlock", 42)
+    scheduler.schedule(60, "remind", 42, 1, "tea")
+    assert sorted((kind, due_args[0]) for _, _, kind, due_args in scheduler.export()) == [("remind", 42), ("unlock", 42)]
+
+
+def test_scheduler_cancel_key_drops_pending_job():
+    from bot import Scheduler
+    scheduler = Scheduler()
+    scheduler.schedule(3600, "remove_role", 1, 2, 3)
+    scheduler.cancel_key("remove_role", 1, 2, 3)
+    scheduler.cancel_key("remove_role", 1, 2, 3)
+    assert scheduler.export() == []
+    assert scheduler.pending() == 0
+
+
+def test_scheduler_restore_keeps_latest_keyed_job():
+    from bot import Scheduler
+    scheduler = Scheduler()
+    scheduler.restore([[200.0, 5, "unban", [1, 2]], [100.0, 1, "unban", [1, 2]]])
+    assert [job[0] for job in scheduler.export()] == [200.0]
+    scheduler.cancel_key("unban", 1, 2)
+    assert scheduler.export() == []
+
+
+def test_memory_guard_trims_once_then_escalates(monkeypatch):
+    import bot
+    tiers = []
+    clock = [1000.0]
+    monkeypatch.setattr(bot, "MEMORY_SOFT_LIMIT_MB", 100)
+    monkeypatch.setattr(bot, "trim_memory", lambda tier: tiers.append(tier) or [])
+    monkeypatch.setattr(bot.time, "monotonic", lambda: clock[0])
+    guard = bot.MemoryGuard()
+    guard.check(150)
+    guard.check(150)
+    assert tiers == [1]
+    clock[0] += bot.MEMORY_TRIM_COOLDOWN
+    guard.check(150)
+    guard.check(95)
+    assert tiers == [1, 2]
+    guard.check(80)
+    guard.check(150)
+    assert tiers == [1, 2, 1]
+
+
+@pytest.mark.parametrize("source", ["(-8) ^ 0.5", "x = -2; x ^ 1.5 + 1"])
+def test_evaluate_expression_rejects_complex_results(source):
+    from bot import MathError, evaluate_expression
+    with pytest.raises(MathError):
+        evaluate_expression(source)
+
+
+def test_evaluate_expression_keeps_real_powers():
+    from bot import evaluate_expression
+    assert evaluate_expression("(-8) ^ 2") == "64"
+    assert evaluate_expression("8 ^ 0.5") == "2.82842712475"
+
+
+def spin_forever(source):
+    while True:
+        pass
+
+
+def test_run_math_timeout_kills_the_worker(monkeypatch):
+    import asyncio
+    import multiprocessing
+    import time
+    import bot
+    monkeypatch.setattr(bot, "evaluate_expression", spin_forever)
+    monkeypatch.setattr(bot, "MATH_TIMEOUT", 0.5)
+    monkeypatch.setattr(bot, "math_pool", None)
+    with pytest.raises(bot.MathError):
+        asyncio.run(bot.run_math("1 + 1"))
+    deadline = time.monotonic() + 5
+    while multiprocessing.active_children() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert multiprocessing.active_children() == []
+
+
+class FakeChannel:
+    def __init__(self, channel_id=1, delay=0.05):
+        self.id = channel_id
+        self.delay = delay
+        self.sent = []
+
+    async def send(self, content, **kwargs):
+        await asyncio.sleep(self.delay)
+        self.sent.append(content)
+        return len(self.sent)
+
+
+def test_outbound_coalesces_under_message_cap():
+    from bot import OutboundDispatcher
+
+    async def scenario():
+        dispatcher = OutboundDispatcher()
+        channel = FakeChannel()
+        lines = [f"{i:03d} " + "x" * 300 for i in range(20)]
+        results = await asyncio.gather(*(dispatcher.send(channel, line, coalesce=True) for line in lines))
+        return channel.sent, lines, results
+
+    sent, lines, results = asyncio.run(scenario())
+    assert len(sent) < len(lines)
+    assert all(len(message) <= 2000 for message in sent)
+    assert "\n".join(sent).split("\n") == lines
+    assert results == sorted(results)
+
+
+def test_outbound_keeps_per_channel_order():
+    from bot import OutboundDispatcher
+
+    async def scenario():
+        dispatcher = OutboundDispatcher()
+        first, second = FakeChannel(1, 0.01), FakeChannel(2, 0.02)
+        await asyncio.gather(*(dispatcher.send(channel, f"{channel.id}-{i}") for i in range(5) for channel in (first, second)))
+        return first.sent, second.sent
+
+    first, second = asyncio.run(scenario())
+    assert first == [f"1-{i}" for i in range(5)]
+    assert second == [f"2-{i}" for i in range(5)]
+
+
+def test_outbound_drops_stale_low_priority(monkeypatch):
+    import bot
+    monkeypatch.setattr(bot, "OUTBOUND_STALE_SECONDS", 0.01)
+
+    async def scenario():
+        dispatcher = bot.OutboundDispatcher()
+        channel = FakeChannel()
+        results = await asyncio.gather(
+            dispatcher.send(channel, "urgent", bot.PRIORITY_HIGH),
+            dispatcher.send(channel, "late", bot.PRIORITY_LOW),
+            dispatcher.send(channel, "normal", bot.PRIORITY_NORMAL)
+        )
+        return channel.sent, results, dispatcher.dropped
+
+    sent, results, dropped = asyncio.run(scenario())
+    assert sent == ["urgent", "normal"]
+    assert results[1] is None
+    assert dropped == 1
+
+
+def test_outbound_survives_cancelled_waiter():
+    from bot import OutboundDispatcher
+
+    async def scenario():
+        dispatcher = OutboundDispatcher()
+        channel = FakeChannel()
+        first = asyncio.create_task(dispatcher.send(channel, "one", coalesce=True))
+        await asyncio.sleep(0)
+        abandoned = asyncio.create_task(dispatcher.send(channel, "two", coalesce=True))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        last = await asyncio.wait_for(dispatcher.send(channel, "three", coalesce=True), 1)
+        return channel.sent, await first, last
+
+    sent, first, last = asyncio.run(scenario())
+    assert sent == ["one", "three"]
+    assert (first, last) == (1, 2)
+
+
+def filter_for(invites=False, **patterns):
+    from bot import GuildFilter
+    return GuildFilter({"patterns": patterns, "invites": invites})
+
+
+def test_aho_corasick_matches_brute_force():
+    import random
+    from bot import AhoCorasick
+    rng = random.Random(7)
+    for _ in range(50):
+        patterns = {"".join(rng.choice("ab ") for _ in range(rng.randint(1, 4))) for _ in range(8)}
+        text = "".join(rng.choice("ab ") for _ in range(60))
+        automaton = AhoCorasick()
+        for pattern in patterns:
+            automaton.add(pattern, pattern)
+        automaton.build()
+        expected = {(i + len(p) - 1, len(p), p) for p in patterns for i in range(len(text)) if text.startswith(p, i)}
+        assert set(automaton.search(text)) == expected
+
+
+def test_filter_words_need_both_boundaries():
+    guild_filter = filter_for(word=["scam"])
+    assert guild_filter.first_match("this is a SCAM!") == "scam"
+    assert guild_filter.first_match("that was a sc4m") == "scam"
+    assert guild_filter.first_match("scampi for dinner") is None
+
+
+def test_filter_phrases_ignore_whitespace_runs():
+    guild_filter = filter_for(phrase=["free  nitro"])
+    assert guild_filter.first_match("get FREE    nitro now") == "free nitro"
+    assert guild_filter.first_match("free\n\tnitro") == "free nitro"
+
+
+def test_filter_domains_need_boundary_after():
+    guild_filter = filter_for(domain=["evil.com"])
+    assert guild_filter.first_match("see https://evil.com/login") == "evil.com"
+    assert guild_filter.first_match("visit evil.com: now") == "evil.com"
+    assert guild_filter.first_match("evil.com") == "evil.com"
+    assert guild_filter.first_match("join evil.community today") is None
+    assert guild_filter.first_match("read evil.comics") is None
+    assert guild_filter.first_match("notevil.com") is None
+
+
+def test_filter_invite_prefixes_match_codes():
+    guild_filter = filter_for(invites=True)
+    assert guild_filter.first_match("join discord.gg/abc123") == "discord.gg/"
+
+
+class FakeResponse:
+    def __init__(self):
+        self.calls = []
+
+    async def defer(self):
+        self.calls.append("defer")
+
+    async def edit_message(self, **kwargs):
+        self.calls.append("edit")
+
+
+class FakeInteraction:
+    def __init__(self):
+        self.response = FakeResponse()
+
+    async def edit_original_response(self, **kwargs):
+        pass
+
+
+def test_paginator_generates_once_for_double_next(monkeypatch):
+    import bot
+    calls = []
+
+    async def slow_chat(messages, **settings):
+        calls.append(messages)
+        await asyncio.sleep(0.05)
+        return "more words", "length"
+
+    monkeypatch.setattr(bot, "groq_chat", slow_chat)
+
+    async def scenario():
+        view = bot.AIPaginator(1, "header\n", [], "first page", False, {})
+        first, second = FakeInteraction(), FakeInteraction()
+        clicks = [view.next_page.callback(first), view.next_page.callback(second)]
+        await asyncio.gather(*clicks)
+        return view, second
+
+    view, second = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert view.pages == ["first page", "more words"]
+    assert view.index == 1
+    assert second.response.calls == ["defer"]
+    assert not view.next_page.disabled
+
+
+class StubCompletions:
+    def __init__(self, name, delay, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.started = 0
+        self.cancelled = 0
+        self.active = 0
+        self.peak = 0
+
+    async def create(self, **request):
+        self.started += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+        if self.fail:
+            raise RuntimeError(f"{self.name} failed")
+        return self.name
+
+
+class StubClient:
+    def __init__(self, name, delay, fail=False):
+        from types import SimpleNamespace
+        self.completions = StubCompletions(name, delay, fail)
+        self.chat = SimpleNamespace(completions=self.completions)
+
+
+def run_hedged(monkeypatch, primary, hedge, count=1, max_rate=1.0):
+    import bot
+    policy = bot.HedgePolicy(0.9, 0.05, 0.05, max_rate)
+    monkeypatch.setattr(bot, "ai_hedging", policy)
+    monkeypatch.setattr(bot, "get_hedge_client", lambda: hedge)
+
+    async def scenario():
+        return await asyncio.gather(*(bot.hedged_completion(primary, {"model": "m"}) for _ in range(count)), return_exceptions=True)
+
+    return asyncio.run(scenario()), policy
+
+
+def test_hedge_not_sent_when_primary_is_fast(monkeypatch):
+    primary, hedge = StubClient("primary", 0.01), StubClient("hedge", 0.01)
+    results, policy = run_hedged(monkeypatch, primary, hedge)
+    assert results == ["primary"]
+    assert hedge.completions.started == 0
+    assert policy.hedged == 0
+
+
+def test_hedge_wins_and_primary_is_cancelled(monkeypatch):
+    primary, hedge = StubClient("primary", 1.0), StubClient("hedge", 0.01)
+    results, policy = run_hedged(monkeypatch, primary, hedge)
+    assert results == ["hedge"]
+    assert primary.completions.cancelled == 1
+    assert policy.hedge_wins == 1
+
+
+def test_hedge_replaces_a_primary_that_fails_early(monkeypatch):
+    primary, hedge = StubClient("primary", 0.0, fail=True), StubClient("hedge", 0.01)
+    results, policy = run_hedged(monkeypatch, primary, hedge)
+    assert results == ["hedge"]
+    assert policy.hedged == 0
+
+
+def test_hedge_rate_cap_is_respected(monkeypatch):
+    primary, hedge = StubClient("primary", 0.2), StubClient("hedge", 0.01)
+    results, policy = run_hedged(monkeypatch, primary, hedge, count=40, max_rate=0.1)
+    assert len(results) == 40
+    # One saved credit plus 0.1 per request
+    assert hedge.completions.started == policy.hedged <= 1 + 40 * 0.1
+    assert policy.capped == 40 - policy.hedged
+
+
+def test_groq_chat_respects_concurrency_cap(monkeypatch):
+    import bot
+    primary = StubClient("primary", 0.02)
+    monkeypatch.setattr(bot, "get_ai_client", lambda: primary)
+    monkeypatch.setattr(bot, "get_hedge_client", lambda: None)
+    monkeypatch.setattr(bot, "ai_slots", asyncio.Semaphore(3))
+
+    async def scenario():
+        return await asyncio.gather(*(bot.groq_chat([]) for _ in range(12)))
+
+    asyncio.run(scenario())
+    assert primary.completions.started == 12
+    assert primary.completions.peak == 3
+
+
+def test_http_stats_read_only_the_published_snapshot(monkeypatch):
+    import bot
+
+    def loop_only():
+        raise AssertionError("read from the HTTP thread")
+
+    bot.status_snapshot.publish()
+    published = bot.status_snapshot.snapshot
+    monkeypatch.setattr(bot.outbound, "depth", loop_only)
+    monkeypatch.setattr(bot.answer_reuse, "metrics", loop_only)
+    stats, _, _ = bot.live_stats(0, 0.0)
+    assert stats["queue_depth"] == published["queue_depth"] == 0
+    assert bot.status_snapshot.snapshot is published
+
+
+class FakeContext:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+@pytest.mark.parametrize("question", ["|", "5m |", " | | "])
+def test_poll_rejects_empty_question(question):
+    import bot
+    ctx = FakeContext()
+    asyncio.run(bot.poll.callback(ctx, question=question))
+    assert len(ctx.sent) == 1 and ctx.sent[0].startswith("❌ Usage")
+
+
+def test_answer_reuse_hits_rewording_and_misses_unrelated():
+    from bot import AnswerReuse
+    reuse = AnswerReuse()
+    reuse.store(1, reuse.signature("How do I reset my password?"), "Use /reset.")
+    assert reuse.lookup(1, reuse.signature("how can i reset my password")) == "Use /reset."
+    assert reuse.lookup(1, reuse.signature("how do I reset my account password?")) == "Use /reset."
+    assert reuse.lookup(1, reuse.signature("what time is the event tonight?")) is None
+    assert reuse.lookup(2, reuse.signature("How do I reset my password?")) is None
+    assert (reuse.hits, reuse.misses) == (2, 2)
+
+
+def test_answer_index_expires_after_ttl():
+    import bot
+    from bot import ChannelAnswerIndex, question_shingles, minhash_signature
+    signature = minhash_signature(question_shingles("when does the tournament start"))
+    index = ChannelAnswerIndex()
+    index.add(signature, "Saturday", 1000.0)
+    assert index.lookup(signature, 1000.0 + bot.REUSE_TTL - 1)[0] == "Saturday"
+    assert index.lookup(signature, 1000.0 + bot.REUSE_TTL)[0] is None
+    assert not index.entries and not index.buckets
+
+
+def test_answer_index_evicts_oldest_per_channel(monkeypatch):
+    import bot
+    monkeypatch.setattr(bot, "REUSE_MAX_PER_CHANNEL", 3)
+    questions = ["how do i join voice", "what are the server rules", "who made this bot", "where is the faq channel"]
+    signatures = [bot.minhash_signature(bot.question_shingles(q)) for q in questions]
+    index = bot.ChannelAnswerIndex()
+    for i, signature in enumerate(signatures):
+        index.add(signature, f"answer {i}", 1000.0)
+    assert len(index.entries) == 3
+    assert index.lookup(signatures[0], 1000.0)[0] is None
+    assert [index.lookup(s, 1000.0)[0] for s in signatures[1:]] == ["answer 1", "answer 2", "answer 3"]
+    assert all(entry_id in index.entries for bucket in index.buckets.values() for entry_id in bucket)
+
+
+def test_answer_reuse_evicts_least_recent_channel(monkeypatch):
+    import bot
+    monkeypatch.setattr(bot, "REUSE_MAX_CHANNELS", 2)
+    reuse = bot.AnswerReuse()
+    signature = reuse.signature("is the bot open source")
+    reuse.store(1, signature, "yes")
+    reuse.store(2, signature, "yes")
+    reuse.lookup(1, signature)
+    reuse.store(3, signature, "yes")
+    assert list(reuse.channels) == [1, 3]
+
+
+def snipe_message(message_id, channel_id, content="hello there"):
+    from datetime import datetime, timezone
+    from types import SimpleNamespace
+    return SimpleNamespace(
+        id=message_id,
+        content=content,
+        channel=SimpleNamespace(id=channel_id),
+        author=SimpleNamespace(id=7),
+        created_at=datetime.fromtimestamp(1700000000, timezone.utc)
+    )
+
+
+def counted_snipe_bytes(log):
+    return sum(record.size() for snipes in log.channels.values() for ring in (snipes.recent, snipes.deleted, snipes.edited) for record in ring)
+
+
+def test_snipe_log_bytes_stay_bounded_and_exact():
+    from bot import SnipeLog
+    log = SnipeLog(20_000)
+    for i in range(2000):
+        channel_id = i % 40
+        log.remember(snipe_message(i, channel_id, "x" * (i % 200 + 1)))
+        if i % 3 == 0:
+            log.deleted(channel_id, i)
+        if i % 5 == 0:
+            log.edited(channel_id, i, "edited " + "y" * (i % 50))
+        assert log.bytes <= log.budget
+    assert log.bytes == counted_snipe_bytes(log)
+    assert log.evicted_channels > 0
+
+
+def test_snipe_log_evicts_least_recent_channel_first():
+    from bot import SnipeLog
+    log = SnipeLog(10_000)
+    for channel_id in (1, 2, 3):
+        log.remember(snipe_message(channel_id, channel_id, "a" * 200))
+    log.remember(snipe_message(10, 1, "b" * 200))
+    message_id = 100
+    while 2 in log.channels:
+        log.remember(snipe_message(message_id, 4, "c" * 200))
+        message_id += 1
+    assert 1 in log.channels and 3 in log.channels
+    while 3 in log.channels:
+        log.remember(snipe_message(message_id, 4, "c" * 200))
+        message_id += 1
+    assert 1 in log.channels
+    assert log.bytes == counted_snipe_bytes(log)
+
+
+def test_overload_cooldown_follows_level_change():
+    from types import SimpleNamespace
+    from discord.ext import commands
+    from bot import OverloadController
+    author = SimpleNamespace(id=5)
+    ctx = SimpleNamespace(author=author, message=SimpleNamespace(author=author), command=SimpleNamespace(extras={"category": "fun"}))
+    controller = OverloadController()
+    controller.level = 1
+    controller.admit(ctx)
+    with pytest.raises(commands.CommandOnCooldown) as cooled:
+        controller.admit(ctx)
+    assert cooled.value.retry_after <= 3
+    controller.level = 3
+    controller.admit(ctx)
+    with pytest.raises(commands.CommandOnCooldown) as cooled:
+        controller.admit(ctx)
+    assert cooled.value.retry_after > 10
+    controller.level = 0
+    controller.admit(ctx)
+
+
+def test_scheduler_restore_never_overwrites_live_jobs():
+    from bot import Scheduler
+    scheduler = Scheduler()
+    scheduler.schedule(60, "remind", 9, 1, "live")
+    scheduler.schedule(60, "unlock", 42)
+    scheduler.restore([[100.0, 1, "remind", [8, 1, "persisted"]], [50.0, 2, "unlock", [42]], [70.0, 3, "unlock", [43]]])
+    jobs = scheduler.export()
+    assert len({job_id for _, job_id, _, _ in jobs}) == len(jobs) == 4
+    assert sorted(args[-1] for _, _, kind, args in jobs if kind == "remind") == ["live", "persisted"]
+    assert [due > 1000 for due, _, kind, args in jobs if kind == "unlock" and args == [42]] == [True]
+    scheduler.cancel_key("unlock", 43)
+    assert scheduler.pending() == 3
+
+
+def test_summary_map_cancels_other_chunks_on_failure(monkeypatch):
+    import bot
+
+    async def stub_chunk(text):
+        if text == "fail":
+            return "❌ AI failed: boom", "error"
+        await asyncio.sleep(10)
+        return "never", "stop"
+
+    monkeypatch.setattr(bot, "summarize_chunk", stub_chunk)
+
+    async def scenario():
+        mapper = bot.SummaryMap(987654321, newest_first=False)
+        for message_id, line in enumerate(["slow one", "fail", "slow two"], start=1):
+            mapper.lines, mapper.ids = [line], [message_id]
+            mapper.close()
+        with pytest.raises(RuntimeError, match="boom"):
+            await asyncio.wait_for(mapper.results(), 2)
+        await asyncio.sleep(0)
+        return mapper.tasks
+
+    tasks = asyncio.run(scenario())
+    assert [task.cancelled() for task in tasks] == [True, False, True]